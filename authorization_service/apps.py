@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class AuthorizationServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authorization_service'
+
+    def ready(self):
+        import authorization_service.checks  # noqa: F401
+        import authorization_service.signals  # noqa: F401
+        from authorization_service.metrics import install_query_recorder
+        from authorization_service.revocation import get_token_revocation_store
+
+        # С неподходящим хранилищем отзыва отозванные токены снова стали бы действительными: не запускаемся
+        get_token_revocation_store()
+
+        # Запросы к базе учитываются в метриках на всех соединениях, в каком бы потоке они ни были созданы
+        connection_created.connect(install_query_recorder)
+
+        if settings.STARTUP_WARMUP:
+            from authorization_service.leaderboard import start_leaderboard_refresh
+            from authorization_service.warmup import warmup
+            warmup()
+            # Рейтинг собирается в фоне процесса приложения, а не в первых запросах к нему
+            start_leaderboard_refresh()
@@ -0,0 +1,131 @@
+""" Асинхронные представления для сервиса authorization_service
+
+Используются при запуске через config/asgi.py: задержка перед проверкой кода
+не блокирует воркер, а запросы к базе выполняются через асинхронный API ORM.
+Синхронные представления из views.py остаются для запуска через WSGI.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.serializers import ValidationError
+from rest_framework.throttling import BaseThrottle
+
+from authorization_service.code_store import get_verification_code_store, CODE_VERIFIED, CODE_ATTEMPTS_EXCEEDED
+from authorization_service.models import UserProfile
+from authorization_service.ratelimit import check_rate_limits
+from authorization_service.sms import send_verification_code, SmsQueueFull
+from authorization_service.tokens import issue_token_pair
+from authorization_service.utils import generate_verification_code, create_phone_user_profile
+from authorization_service.validators import PhoneNumberValidator
+from users.models import User
+
+
+class AsyncAPIView(View):
+    """ Базовое асинхронное представление с разбором JSON и form-data """
+    rate_limit_scope = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Как и APIView, представления работают по JWT и не используют сессионный CSRF
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    def get_request_data(request):
+        """ Данные запроса из JSON-тела или из формы """
+        if request.content_type == 'application/json':
+            return json.loads(request.body or b'{}')
+        return request.POST
+
+    def check_rate_limits(self, request, data):
+        """ Ответ 429, если превышен лимит частоты запросов области rate_limit_scope, иначе None """
+        retry_after = check_rate_limits(self.rate_limit_scope, data.get('phone_number'),
+                                        BaseThrottle().get_ident(request))
+        if retry_after is None:
+            return None
+        response = JsonResponse({'detail': f'Слишком много запросов, повторите через {retry_after} с'}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return JsonResponse({'detail': 'Некорректный JSON в теле запроса'}, status=400)
+
+
+class AsyncUserProfileLoginAPI(AsyncAPIView):
+    """ Асинхронное представление для входа в аккаунт и получения кода верификации
+    params: {'phone_number': '+79999999999'}"""
+    rate_limit_scope = 'login'
+
+    async def post(self, request):
+        """ Вход в аккаунт и получение кода верификации """
+        data = self.get_request_data(request)
+        throttled = self.check_rate_limits(request, data)
+        if throttled:
+            return throttled
+        phone_number = data.get('phone_number')
+
+        try:
+            phone_number_validator = PhoneNumberValidator()
+            phone_number = phone_number_validator(phone_number)
+        except ValidationError as e:
+            return JsonResponse(e.detail, safe=False, status=400)
+
+        verification_code = generate_verification_code()
+
+        if not await User.objects.filter(username=phone_number).aexists():
+            # Транзакция доступна только синхронному ORM
+            await sync_to_async(create_phone_user_profile)(phone_number)
+
+        await get_verification_code_store().aissue(phone_number, verification_code)
+        try:
+            send_verification_code(phone_number, verification_code)
+        except SmsQueueFull as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code)
+
+        return JsonResponse({'message': 'Введите верификационный код из СМС для входа POST /input_verification_code/'})
+
+
+class AsyncInputVerificationCodeAPI(AsyncAPIView):
+    """ Асинхронное представление для ввода кода верификации
+    params: {'phone_number': '+79999999999', 'entered_code': '1234'}"""
+    rate_limit_scope = 'verify'
+
+    async def post(self, request):
+        """ Ввод кода верификации """
+        data = self.get_request_data(request)
+        throttled = self.check_rate_limits(request, data)
+        if throttled:
+            return throttled
+        await asyncio.sleep(settings.VERIFICATION_DELAY)
+        username = data.get('phone_number')
+
+        try:
+            phone_number_validator = PhoneNumberValidator()
+            username = phone_number_validator(username)
+        except ValidationError as e:
+            return JsonResponse(e.detail, safe=False, status=400)
+
+        try:
+            user = await User.objects.aget(username=username)
+        except User.DoesNotExist:
+            return JsonResponse({'error': 'Пользователь не найден'}, status=400)
+
+        entered_code = data.get('entered_code')
+        if entered_code == '':
+            return JsonResponse({'error': 'Отсутствует код верификации'}, status=400)
+
+        result = await get_verification_code_store().averify(username, entered_code)
+        if result == CODE_VERIFIED:
+            if await UserProfile.objects.filter(user=user).aexists():
+                return JsonResponse({**issue_token_pair(user), 'message': 'Вход выполнен успешно'})
+            return JsonResponse({'detail': 'Профиль пользователя не найден'}, status=404)
+        if result == CODE_ATTEMPTS_EXCEEDED:
+            return JsonResponse({'error': 'Превышено число попыток ввода кода, запросите новый код'}, status=400)
+        return JsonResponse({'error': 'Неверный код верификации'}, status=400)
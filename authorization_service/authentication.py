@@ -0,0 +1,115 @@
+""" Аутентификация по JWT без запроса пользователя к базе на каждый запрос """
+import copy
+import functools
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from authorization_service.revocation import is_token_revoked
+from authorization_service.ttl_cache import TTLCache
+
+JWT_USER_CACHE_MODE_CACHED = 'cached'
+JWT_USER_CACHE_MODE_STATELESS = 'stateless'
+
+
+@functools.lru_cache(maxsize=None)
+def get_jwt_user_cache():
+    """ Внутрипроцессный кэш пользователей по id """
+    config = settings.JWT_USER_CACHE
+    return TTLCache(max_entries=config['MAX_ENTRIES'], timeout=config['TIMEOUT'])
+
+
+def user_version_key(user_id):
+    """ Ключ версии пользователя в общем кэше Django """
+    return f'jwt_user_version:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    """ Удаление пользователя из кэша текущего процесса и смена его версии для остальных процессов
+
+    Запись старше TIMEOUT в кэше процессов не живёт, поэтому и версия хранится столько же.
+    """
+    get_jwt_user_cache().pop(str(user_id))
+    cache.set(user_version_key(user_id), uuid4().hex, timeout=settings.JWT_USER_CACHE['TIMEOUT'] + 1)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWT-аутентификация с кэшем пользователей в памяти процесса
+
+    Режимы (настройка JWT_USER_CACHE['MODE']):
+    - cached: пользователь загружается из базы один раз и хранится в кэше
+      процесса с временем жизни вместе с версией из общего кэша Django.
+      Сохранение и удаление пользователя меняют версию, и все процессы,
+      использующие этот кэш, загружают пользователя заново. Запись
+      загружается заново и тогда, когда username или is_staff в токене
+      расходятся с кэшированным пользователем;
+    - stateless: пользователь строится только из полей токена, без базы.
+
+    Отозванные токены (выход, ротация) отклоняются по хранилищу
+    TOKEN_REVOCATION, тоже без запроса к базе.
+    """
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if is_token_revoked(validated_token):
+            raise InvalidToken(_("Token is blacklisted"))
+        return validated_token
+
+    def get_user(self, validated_token):
+        if settings.JWT_USER_CACHE['MODE'] == JWT_USER_CACHE_MODE_STATELESS:
+            return self.get_user_from_claims(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # Версия читается до загрузки из базы: смена версии во время загрузки приведёт к повторной загрузке
+        version = cache.get(user_version_key(user_id))
+        user_cache = get_jwt_user_cache()
+        entry = user_cache.get(str(user_id))
+        if entry is None or entry[1] != version or self.claims_differ(entry[0], validated_token):
+            user = super().get_user(validated_token)
+            user_cache.set(str(user_id), (user, version))
+        else:
+            user = entry[0]
+            self.check_user(user, validated_token)
+        # Копия, чтобы запросы не делили один изменяемый объект
+        return copy.copy(user)
+
+    @staticmethod
+    def claims_differ(user, validated_token):
+        """ Расходятся ли username и is_staff из токена с пользователем (токен выдан после изменения) """
+        return (validated_token.get('username', user.get_username()) != user.get_username()
+                or validated_token.get('is_staff', user.is_staff) != user.is_staff)
+
+    @staticmethod
+    def check_user(user, validated_token):
+        """ Те же проверки, что выполняет JWTAuthentication для пользователя из базы """
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+    def get_user_from_claims(self, validated_token):
+        """ Несохраняемый пользователь, построенный из полей токена """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        user_model = get_user_model()
+        user = user_model(**{api_settings.USER_ID_FIELD: user_id},
+                          username=validated_token.get('username', ''),
+                          is_staff=validated_token.get('is_staff', False),
+                          is_active=True)
+        user._state.adding = False
+        user._state.db = 'default'
+        return user
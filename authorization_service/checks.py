@@ -0,0 +1,18 @@
+""" Проверки настроек сервиса authorization_service (manage.py check) """
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from authorization_service.referral_codes import DEFAULT_REFERRAL_CODE_KEY
+
+
+@register(Tags.security, deploy=True)
+def check_referral_code_key(app_configs, **kwargs):
+    """ Предупреждение о публичном ключе перестановки реферальных кодов """
+    if settings.REFERRAL_CODE_KEY != DEFAULT_REFERRAL_CODE_KEY:
+        return []
+    return [Warning(
+        'REFERRAL_CODE_KEY не задан: с публичным ключом по умолчанию реферальные коды предсказуемы по номеру '
+        'пользователя',
+        hint='Задайте постоянный секретный REFERRAL_CODE_KEY до первого запуска и не меняйте его',
+        id='authorization_service.W001',
+    )]
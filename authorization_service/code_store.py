@@ -0,0 +1,163 @@
+""" Хранилища кодов верификации
+
+Коды живут недолго, поэтому хранятся не в таблице профилей, а в хранилище
+с временем жизни, счётчиком попыток и одноразовым использованием.
+Бэкенд задаётся настройкой VERIFICATION_CODE_STORE.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from authorization_service.ttl_cache import TTLCache
+
+# Результаты проверки кода
+CODE_VERIFIED = 'verified'
+CODE_INVALID = 'invalid'
+CODE_EXPIRED = 'expired'
+CODE_ATTEMPTS_EXCEEDED = 'attempts_exceeded'
+
+
+class BaseVerificationCodeStore:
+    """ Базовое хранилище кодов верификации """
+
+    def __init__(self, timeout=300, max_attempts=5):
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+    def issue(self, phone_number, code):
+        """ Сохранение нового кода для номера телефона со сбросом счётчика попыток """
+        raise NotImplementedError
+
+    def verify(self, phone_number, entered_code):
+        """ Проверка введённого кода; верный код погашается и больше не действует """
+        raise NotImplementedError
+
+    def peek(self, phone_number):
+        """ Текущий код для номера телефона без учёта попытки """
+        raise NotImplementedError
+
+    async def aissue(self, phone_number, code):
+        return await sync_to_async(self.issue)(phone_number, code)
+
+    async def averify(self, phone_number, entered_code):
+        return await sync_to_async(self.verify)(phone_number, entered_code)
+
+
+class LocMemVerificationCodeStore(BaseVerificationCodeStore):
+    """ Хранилище кодов в памяти процесса (TTL + LRU)
+
+    Подходит только для запуска в одном процессе: воркеры не видят коды друг друга.
+    """
+
+    def __init__(self, timeout=300, max_attempts=5, max_entries=100000):
+        super().__init__(timeout=timeout, max_attempts=max_attempts)
+        self._codes = TTLCache(max_entries=max_entries, timeout=timeout)
+
+    def issue(self, phone_number, code):
+        self._codes.set(phone_number, [code, 0])
+
+    def verify(self, phone_number, entered_code):
+        with self._codes.lock:
+            entry = self._codes.get(phone_number)
+            if entry is None:
+                return CODE_EXPIRED
+            if constant_time_compare(entry[0], entered_code):
+                self._codes.pop(phone_number)
+                return CODE_VERIFIED
+            entry[1] += 1
+            if entry[1] >= self.max_attempts:
+                self._codes.pop(phone_number)
+                return CODE_ATTEMPTS_EXCEEDED
+            return CODE_INVALID
+
+    def peek(self, phone_number):
+        entry = self._codes.get(phone_number)
+        return entry[0] if entry else None
+
+    def clear(self):
+        """ Удаление всех кодов """
+        self._codes.clear()
+
+    async def aissue(self, phone_number, code):
+        return self.issue(phone_number, code)
+
+    async def averify(self, phone_number, entered_code):
+        return self.verify(phone_number, entered_code)
+
+
+class CacheVerificationCodeStore(BaseVerificationCodeStore):
+    """ Хранилище кодов в кэше Django (Redis, Memcached, LocMemCache)
+
+    Погашение кода опирается на атомарность cache.delete: из нескольких
+    одновременных верных попыток успешной будет только одна. Кэш
+    verification_codes отделён от общего, чтобы вытеснение ответов и
+    счётчиков не удаляло коды до истечения их срока.
+    """
+    code_key_prefix = 'verification_code'
+    attempts_key_prefix = 'verification_attempts'
+
+    def __init__(self, timeout=300, max_attempts=5, cache_alias='verification_codes'):
+        super().__init__(timeout=timeout, max_attempts=max_attempts)
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _keys(self, phone_number):
+        return f'{self.code_key_prefix}:{phone_number}', f'{self.attempts_key_prefix}:{phone_number}'
+
+    def issue(self, phone_number, code):
+        code_key, attempts_key = self._keys(phone_number)
+        self.cache.set_many({code_key: code, attempts_key: 0}, self.timeout)
+
+    def verify(self, phone_number, entered_code):
+        code_key, attempts_key = self._keys(phone_number)
+        code = self.cache.get(code_key)
+        if code is None:
+            return CODE_EXPIRED
+        if constant_time_compare(code, entered_code):
+            return CODE_VERIFIED if self.cache.delete(code_key) else CODE_EXPIRED
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            return CODE_EXPIRED
+        if attempts >= self.max_attempts:
+            self.cache.delete_many([code_key, attempts_key])
+            return CODE_ATTEMPTS_EXCEEDED
+        return CODE_INVALID
+
+    def peek(self, phone_number):
+        return self.cache.get(self._keys(phone_number)[0])
+
+    async def aissue(self, phone_number, code):
+        code_key, attempts_key = self._keys(phone_number)
+        await self.cache.aset_many({code_key: code, attempts_key: 0}, self.timeout)
+
+    async def averify(self, phone_number, entered_code):
+        code_key, attempts_key = self._keys(phone_number)
+        code = await self.cache.aget(code_key)
+        if code is None:
+            return CODE_EXPIRED
+        if constant_time_compare(code, entered_code):
+            return CODE_VERIFIED if await self.cache.adelete(code_key) else CODE_EXPIRED
+        try:
+            attempts = await self.cache.aincr(attempts_key)
+        except ValueError:
+            return CODE_EXPIRED
+        if attempts >= self.max_attempts:
+            await self.cache.adelete_many([code_key, attempts_key])
+            return CODE_ATTEMPTS_EXCEEDED
+        return CODE_INVALID
+
+
+@functools.lru_cache(maxsize=None)
+def get_verification_code_store():
+    """ Хранилище кодов верификации, заданное в настройке VERIFICATION_CODE_STORE """
+    config = settings.VERIFICATION_CODE_STORE
+    store_class = import_string(config['BACKEND'])
+    return store_class(**config.get('OPTIONS', {}))
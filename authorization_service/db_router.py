@@ -0,0 +1,119 @@
+""" Маршрутизация запросов к базе: чтение с реплик, запись на основную базу
+
+Чтения безопасных HTTP-запросов (GET, HEAD, OPTIONS) идут на реплику,
+выбранную для запроса, всё остальное — на основную базу (default):
+запись, чтение внутри транзакции, небезопасные запросы, команды управления
+и код вне запросов.
+
+Чтение своих записей: после первой записи оставшиеся запросы к базе в
+рамках HTTP-запроса идут на основную базу, а клиенту ставится cookie, с
+которой его запросы читают с основной базы ещё STICKY_SECONDS секунд —
+пока реплики догоняют основную базу. Поэтому, например, активированный
+реферальный код сразу виден в профиле.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class RoutingState:
+    """ Маршрутизация текущего HTTP-запроса: реплика для чтения (None — основная база) и была ли запись """
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+# Состояние текущего запроса; вне запросов — None, и всё идёт на основную базу
+_routing_state = ContextVar('database_routing_state', default=None)
+
+
+def get_replicas():
+    """ Псевдонимы реплик из настройки DATABASE_ROUTING """
+    return settings.DATABASE_ROUTING['REPLICAS']
+
+
+def reading_from_replica():
+    """ Идёт ли чтение в текущем контексте с реплики """
+    state = _routing_state.get()
+    return state is not None and state.replica is not None
+
+
+class ReplicaRouter:
+    """ Роутер баз данных: чтение с реплики текущего запроса, запись и миграции — на основной базе """
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or state.replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            # Дальше запрос читает свои записи с основной базы
+            state.replica = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик обновляется репликацией
+        return False if db in get_replicas() else None
+
+
+class ReplicaRoutingMiddleware:
+    """ Выбор реплики для безопасных запросов и cookie чтения с основной базы после записи """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _routing_state.set(self.routing_state(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = _routing_state.get()
+            _routing_state.reset(token)
+        return self.stick_to_primary(response, state)
+
+    async def __acall__(self, request):
+        token = _routing_state.set(self.routing_state(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = _routing_state.get()
+            _routing_state.reset(token)
+        return self.stick_to_primary(response, state)
+
+    @staticmethod
+    def routing_state(request):
+        replicas = get_replicas()
+        if (not replicas or request.method not in SAFE_METHODS
+                or settings.DATABASE_ROUTING['COOKIE_NAME'] in request.COOKIES):
+            return RoutingState()
+        return RoutingState(random.choice(replicas))
+
+    @staticmethod
+    def stick_to_primary(response, state):
+        if state.wrote and get_replicas():
+            response.set_cookie(settings.DATABASE_ROUTING['COOKIE_NAME'], '1',
+                                max_age=settings.DATABASE_ROUTING['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        return response
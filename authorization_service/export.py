@@ -0,0 +1,82 @@
+""" Потоковая выгрузка профилей и реферальных связей в NDJSON и CSV
+
+Строки читаются курсором на стороне сервера (QuerySet.iterator) в виде
+кортежей values_list, без создания экземпляров моделей, и сразу
+форматируются, поэтому память не зависит от числа выгружаемых строк.
+Выгрузка в CSV с колонкой phone_number читается командой import_users.
+"""
+import csv
+import io
+import json
+
+from django.db.models import F
+
+from authorization_service.models import UserProfile
+
+# Колонки наборов данных
+EXPORT_FIELDS = {
+    'profiles': ('id', 'phone_number', 'user_referral_code', 'activated_referral_code', 'referred_by',
+                 'referral_count'),
+    'edges': ('referrer_id', 'referrer_phone_number', 'referral_id', 'referral_phone_number', 'referral_code'),
+}
+
+# Типы содержимого форматов
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def dataset_rows(dataset, chunk_size, using=None):
+    """ Кортежи строк набора данных по возрастанию id профиля, по chunk_size строк за обращение к курсору
+
+    using — псевдоним базы; по умолчанию её выбирает роутер.
+    """
+    if dataset == 'profiles':
+        queryset = UserProfile.objects.order_by('id').values_list(
+            'id', 'phone_number', 'user_referral_code', 'activated_referral_code', 'referrer__username',
+            'referral_count')
+    else:
+        queryset = UserProfile.objects.filter(referrer__isnull=False).exclude(referrer_id=F('user_id')).order_by(
+            'id').values_list('referrer__profile__id', 'referrer__username', 'id', 'phone_number',
+                              'activated_referral_code')
+    return queryset.using(using).iterator(chunk_size=chunk_size)
+
+
+# json.dumps с параметрами создаёт новый кодировщик на каждый вызов
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def format_ndjson(fields, rows):
+    """ Строки в формате NDJSON: объект JSON на строку """
+    encode = _json_encoder.encode
+    return ''.join(encode(dict(zip(fields, row))) + '\n' for row in rows)
+
+
+def format_csv(fields, rows, header=False):
+    """ Строки в формате CSV, при header=True — с заголовком """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def iter_export(dataset, export_format, chunk_size=2000, using=None):
+    """ Выгрузка набора данных частями: пары (число строк, текст части)
+
+    Заголовок CSV отдаётся первой частью с нулём строк.
+    """
+    fields = EXPORT_FIELDS[dataset]
+    if export_format == 'csv':
+        yield 0, format_csv(fields, [], header=True)
+    formatter = format_ndjson if export_format == 'ndjson' else format_csv
+    chunk = []
+    for row in dataset_rows(dataset, chunk_size, using):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield len(chunk), formatter(fields, chunk)
+            chunk = []
+    if chunk:
+        yield len(chunk), formatter(fields, chunk)
@@ -0,0 +1,429 @@
+""" Рейтинг пригласивших по числу рефералов
+
+Рейтинг поддерживается инкрементально: после фиксации активации кода счёт
+пригласившего увеличивается в упорядоченной структуре, и чтение топа из K
+профилей занимает O(K), а место любого профиля — O(log n), без агрегации
+по таблице профилей.
+
+Место профиля — 1 + число пригласивших с большим счётом (при равном счёте
+места равны). Число пригласивших с каждым счётом хранится в дереве Фенвика,
+поэтому число профилей со счётом больше заданного — это сумма на префиксе.
+
+Бэкенд задаётся настройкой LEADERBOARD: LocMemLeaderboard хранит рейтинг
+в памяти процесса и пересобирает его из базы в фоновом потоке, CacheLeaderboard —
+в общем кэше Django, и рейтинг общий для всех воркеров. Расхождения
+с базой (например, после repair_referral_counters или при гонке с пересборкой)
+исправляет команда reconcile_leaderboard.
+
+Запросы к API рейтинг не пересобирают: пока он не собран, чтение выполняет
+DatabaseLeaderboard — по одному запросу к базе по индексу счётчиков.
+"""
+import bisect
+import functools
+import heapq
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from authorization_service.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+def _top_key(member, score):
+    """ Ключ сортировки топа: по убыванию счёта, при равном счёте — по возрастанию pk """
+    return -score, member
+
+
+class FenwickTree:
+    """ Дерево Фенвика над счётами 1..size: добавление и сумма на префиксе за O(log size)
+
+    При добавлении счёта больше size дерево удваивается.
+    """
+
+    def __init__(self, size=1024):
+        self.tree = [0] * (size + 1)
+
+    @property
+    def size(self):
+        return len(self.tree) - 1
+
+    def add(self, index, delta):
+        while index > self.size:
+            self._grow()
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index):
+        """ Сумма значений с индексами 1..index """
+        index = min(index, self.size)
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def _grow(self):
+        # Новые узлы, кроме последнего, покрывают только новые индексы, а последний — весь массив
+        size = self.size
+        self.tree.extend([0] * size)
+        self.tree[2 * size] = self.tree[size]
+
+
+class BaseLeaderboard:
+    """ Базовый рейтинг пригласивших """
+
+    def is_built(self):
+        """ Собран ли рейтинг из базы """
+        raise NotImplementedError
+
+    def start_refresh(self):
+        """ Запуск фоновой пересборки рейтинга; по умолчанию её выполняет reconcile_leaderboard по расписанию """
+
+    def rebuild(self, scores):
+        """ Сборка рейтинга заново по парам (pk профиля, счёт); возвращает число пригласивших """
+        raise NotImplementedError
+
+    def increment(self, member, delta):
+        """ Увеличение счёта профиля member на delta
+
+        Пока рейтинг не собран, изменения не учитываются: сборка прочитает их из базы.
+        """
+        raise NotImplementedError
+
+    def top(self, limit):
+        """ До limit пар (pk профиля, счёт) с наибольшим счётом """
+        raise NotImplementedError
+
+    def count_above(self, score):
+        """ Число пригласивших со счётом больше score """
+        raise NotImplementedError
+
+    def total(self):
+        """ Число пригласивших с ненулевым счётом """
+        raise NotImplementedError
+
+    def rank(self, score):
+        """ Место профиля со счётом score """
+        return self.count_above(score) + 1
+
+
+class LocMemLeaderboard(BaseLeaderboard):
+    """ Рейтинг в памяти процесса
+
+    Профили хранятся в корзинах по счёту (отсортированные списки pk), счёты
+    корзин — в отсортированном списке, число профилей с каждым счётом —
+    в дереве Фенвика. Каждый процесс учитывает только свои активации, поэтому
+    после start_refresh рейтинг пересобирается из базы фоновым потоком раз
+    в refresh_interval секунд.
+    """
+
+    def __init__(self, top_size=100, refresh_interval=300):
+        self.top_size = top_size
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self._built_at = None
+        self._refresh_thread = None
+        self._scores, self._buckets, self._distinct, self._tree = {}, {}, [], FenwickTree()
+
+    def is_built(self):
+        return self._built_at is not None
+
+    def start_refresh(self):
+        """ Пересборка из базы в фоновом потоке: сразу и затем раз в refresh_interval секунд
+
+        Потоки не переживают fork, поэтому в дочернем процессе (воркере gunicorn
+        --preload) поток запускается заново.
+        """
+        if self.refresh_interval is None or self._refresh_thread is not None:
+            return
+        os.register_at_fork(after_in_child=self._restart_refresh)
+        self._start_refresh_thread()
+
+    def _restart_refresh(self):
+        # Блокировку мог удерживать поток родителя, которого в дочернем процессе нет
+        self.lock = threading.RLock()
+        self._start_refresh_thread()
+
+    def _start_refresh_thread(self):
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='leaderboard-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                reconcile_leaderboard(self)
+            except Exception:
+                logger.exception('Не удалось пересобрать рейтинг пригласивших')
+            finally:
+                # Соединение потока не держится открытым до следующей пересборки
+                connection.close()
+            time.sleep(self.refresh_interval)
+
+    def rebuild(self, scores):
+        state = ({}, {}, [], FenwickTree())
+        for member, score in scores:
+            if score > 0:
+                self._add(state, member, score)
+        with self.lock:
+            self._scores, self._buckets, self._distinct, self._tree = state
+            self._built_at = time.monotonic()
+        return len(state[0])
+
+    @staticmethod
+    def _add(state, member, score):
+        members, buckets, distinct, tree = state
+        members[member] = score
+        bucket = buckets.get(score)
+        if bucket is None:
+            bucket = buckets[score] = []
+            bisect.insort(distinct, score)
+        bisect.insort(bucket, member)
+        tree.add(score, 1)
+
+    @staticmethod
+    def _remove(state, member):
+        members, buckets, distinct, tree = state
+        score = members.pop(member)
+        bucket = buckets[score]
+        del bucket[bisect.bisect_left(bucket, member)]
+        if not bucket:
+            del buckets[score]
+            del distinct[bisect.bisect_left(distinct, score)]
+        tree.add(score, -1)
+
+    def increment(self, member, delta):
+        with self.lock:
+            if self._built_at is None:
+                return None
+            state = (self._scores, self._buckets, self._distinct, self._tree)
+            score = self._scores.get(member, 0) + delta
+            if member in self._scores:
+                self._remove(state, member)
+            if score > 0:
+                self._add(state, member, score)
+            return score
+
+    def top(self, limit):
+        result = []
+        with self.lock:
+            for score in reversed(self._distinct):
+                for member in self._buckets[score]:
+                    if len(result) == limit:
+                        return result
+                    result.append((member, score))
+        return result
+
+    def count_above(self, score):
+        with self.lock:
+            return len(self._scores) - self._tree.prefix_sum(score)
+
+    def total(self):
+        return len(self._scores)
+
+
+class CacheLeaderboard(BaseLeaderboard):
+    """ Рейтинг в кэше Django, общий для всех процессов, использующих этот кэш
+
+    В кэше хранятся счёт каждого пригласившего, узлы дерева Фенвика над
+    счётами 1..max_score (счёт больше max_score учитывается как max_score),
+    число пригласивших и топ из top_size профилей. Счёт и узлы изменяются
+    атомарным incr, топ — под блокировкой на cache.add. Ключи содержат номер
+    версии: пересборка пишет новую версию и затем переключает на неё, а ключи
+    старой версии вытесняет сам кэш.
+    """
+
+    def __init__(self, cache_alias='default', key_prefix='leaderboard', top_size=100, max_score=65536,
+                 lock_timeout=5):
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+        self.top_size = top_size
+        self.max_score = max_score
+        self.lock_timeout = lock_timeout
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, version, *parts):
+        return ':'.join((self.key_prefix, str(version), *map(str, parts)))
+
+    @property
+    def _version(self):
+        return self.cache.get(f'{self.key_prefix}:version')
+
+    def _incr(self, key, delta):
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            self.cache.add(key, 0, timeout=None)
+            return self.cache.incr(key, delta)
+
+    def is_built(self):
+        return self._version is not None
+
+    def rebuild(self, scores):
+        version = (self._version or 0) + 1
+        tree = FenwickTree(self.max_score)
+        values = {}
+        top = []
+        for member, score in scores:
+            if score <= 0:
+                continue
+            values[self._key(version, 'score', member)] = score
+            tree.add(min(score, self.max_score), 1)
+            top.append((member, score))
+        total = len(values)
+        values.update({self._key(version, 'node', index): value
+                       for index, value in enumerate(tree.tree) if index and value})
+        values[self._key(version, 'total')] = total
+        values[self._key(version, 'top')] = heapq.nsmallest(self.top_size, top, key=lambda item: _top_key(*item))
+        items = list(values.items())
+        for start in range(0, len(items), 1000):
+            self.cache.set_many(dict(items[start:start + 1000]), timeout=None)
+        self.cache.set(f'{self.key_prefix}:version', version, timeout=None)
+        return total
+
+    def increment(self, member, delta):
+        version = self._version
+        if version is None:
+            return None
+        score = self._incr(self._key(version, 'score', member), delta)
+        previous = score - delta
+        if previous > 0:
+            self._fenwick_add(version, previous, -1)
+        else:
+            self._incr(self._key(version, 'total'), 1)
+        self._fenwick_add(version, score, 1)
+        self._update_top(version, member, score)
+        return score
+
+    def _fenwick_add(self, version, score, delta):
+        index = min(score, self.max_score)
+        while index <= self.max_score:
+            self._incr(self._key(version, 'node', index), delta)
+            index += index & -index
+
+    @contextmanager
+    def _lock(self, version):
+        """ Блокировка изменения топа; отдаёт False, если её не удалось получить за lock_timeout """
+        key = self._key(version, 'lock')
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.cache.add(key, 1, timeout=self.lock_timeout):
+            if time.monotonic() > deadline:
+                yield False
+                return
+            time.sleep(0.005)
+        try:
+            yield True
+        finally:
+            self.cache.delete(key)
+
+    def _update_top(self, version, member, score):
+        key = self._key(version, 'top')
+        top = self.cache.get(key) or []
+        is_listed = any(listed == member for listed, _ in top)
+        if not is_listed and len(top) >= self.top_size and _top_key(member, score) >= _top_key(*top[-1]):
+            return
+        with self._lock(version) as locked:
+            if not locked:
+                # Топ поправит ближайшая сверка
+                return
+            top = [(listed, listed_score) for listed, listed_score in self.cache.get(key) or [] if listed != member]
+            top.append((member, score))
+            top.sort(key=lambda item: _top_key(*item))
+            self.cache.set(key, top[:self.top_size], timeout=None)
+
+    def top(self, limit):
+        version = self._version
+        if version is None:
+            return []
+        return [tuple(item) for item in (self.cache.get(self._key(version, 'top')) or [])[:limit]]
+
+    def count_above(self, score):
+        version = self._version
+        if version is None:
+            return 0
+        indexes = []
+        index = min(score, self.max_score)
+        while index > 0:
+            indexes.append(index)
+            index -= index & -index
+        keys = [self._key(version, 'node', index) for index in indexes] + [self._key(version, 'total')]
+        values = self.cache.get_many(keys)
+        total = values.get(keys[-1], 0)
+        return total - sum(values.get(key, 0) for key in keys[:-1])
+
+    def total(self):
+        version = self._version
+        return 0 if version is None else self.cache.get(self._key(version, 'total'), 0)
+
+
+class DatabaseLeaderboard(BaseLeaderboard):
+    """ Чтение рейтинга запросами к базе, пока поддерживаемый рейтинг не собран
+
+    Каждое чтение — один запрос по индексу profile_referral_count_idx: топ
+    ограничен limit строками, место и число пригласивших считаются COUNT.
+    Рейтинг только читается: пересборка и инкременты не поддерживаются.
+    """
+
+    def __init__(self, top_size=100):
+        self.top_size = top_size
+
+    def is_built(self):
+        return True
+
+    def top(self, limit):
+        return list(UserProfile.objects.filter(referral_count__gt=0).order_by('-referral_count', 'pk').values_list(
+            'pk', 'referral_count')[:limit])
+
+    def count_above(self, score):
+        return UserProfile.objects.filter(referral_count__gt=score).count()
+
+    def total(self):
+        return self.count_above(0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_leaderboard():
+    """ Рейтинг с бэкендом из настройки LEADERBOARD """
+    config = settings.LEADERBOARD
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def load_scores():
+    """ Счёт пригласивших из базы: пары (pk профиля, referral_count), по индексу profile_referral_count_idx """
+    return UserProfile.objects.filter(referral_count__gt=0).values_list('pk', 'referral_count').iterator(
+        chunk_size=5000)
+
+
+def reconcile_leaderboard(leaderboard=None):
+    """ Пересборка рейтинга по счётчикам из базы; возвращает число пригласивших """
+    return (leaderboard or get_leaderboard()).rebuild(load_scores())
+
+
+def get_readable_leaderboard():
+    """ Рейтинг для чтения в запросе: поддерживаемый, а пока он не собран — DatabaseLeaderboard
+
+    Запрос никогда не пересобирает рейтинг: это делают фоновый поток и reconcile_leaderboard.
+    """
+    leaderboard = get_leaderboard()
+    return leaderboard if leaderboard.is_built() else DatabaseLeaderboard(leaderboard.top_size)
+
+
+def start_leaderboard_refresh():
+    """ Запуск фоновой пересборки рейтинга при старте процесса приложения """
+    get_leaderboard().start_refresh()
+
+
+def record_referrals(referrer_pk, count):
+    """ Учёт count новых рефералов профиля referrer_pk в рейтинге """
+    get_leaderboard().increment(referrer_pk, count)
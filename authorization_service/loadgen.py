@@ -0,0 +1,363 @@
+""" Воспроизведение записанного трафика и генерация нагрузки внутри процесса
+
+Запись — строка JSONL с полями:
+- method, path — HTTP-метод и путь;
+- body — тело запроса (объект отправляется как JSON);
+- auth — заголовок Authorization целиком или {"phone_number": ...}: тогда
+  перед прогоном выпускается access-токен существующего пользователя;
+- remote_addr — IP-адрес клиента (по умолчанию 127.0.0.1);
+- issue_code — код верификации, который выдаётся номеру body.phone_number
+  перед отправкой запроса: так ввод кода воспроизводится без чтения СМС;
+- session — ключ сессии: записи одной сессии отправляются по порядку одним
+  воркером (ввод кода не обгоняет вход), разные сессии — параллельно.
+
+Запросы отправляются в WSGI- или ASGI-приложение Django без сети (тестовые
+Client и AsyncClient) из потоков, процессов или задач asyncio. С целевой
+частотой запросы отправляются по расписанию (открытая модель нагрузки), а
+задержка считается от запланированного момента отправки, поэтому ожидание
+свободного воркера тоже входит в задержку.
+"""
+import asyncio
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connections
+from django.test import Client, AsyncClient
+from django.urls import Resolver404, resolve
+
+# Результат запроса: имя URL, код ответа (0 — исключение), задержка в мс
+LoadResult = namedtuple('LoadResult', 'url_name status latency_ms')
+
+# Коды операторов мобильной связи России (DEF-коды) и их примерные доли абонентов
+MOBILE_CODES = {
+    '900': 3, '901': 2, '902': 2, '903': 4, '904': 2, '905': 4, '906': 4, '908': 2, '909': 4, '910': 5,
+    '911': 3, '912': 3, '913': 3, '914': 2, '915': 4, '916': 6, '917': 4, '918': 3, '919': 3, '920': 3,
+    '921': 3, '922': 2, '925': 5, '926': 6, '927': 3, '928': 3, '929': 2, '950': 2, '951': 2, '952': 2,
+    '953': 2, '958': 1, '960': 2, '961': 2, '962': 2, '963': 2, '964': 2, '965': 3, '977': 3, '978': 1,
+    '980': 1, '981': 2, '982': 1, '985': 3, '987': 1, '988': 1, '991': 1, '993': 1, '995': 1, '996': 1,
+    '999': 3,
+}
+
+# Форматы, в которых пользователи вводят номер
+PHONE_FORMATS = (
+    (lambda code, number: f'+7{code}{number}', 70),
+    (lambda code, number: f'+7 {code} {number[:3]}-{number[3:5]}-{number[5:]}', 15),
+    (lambda code, number: f'8{code}{number}', 8),
+    (lambda code, number: f'8 ({code}) {number[:3]}-{number[3:5]}-{number[5:]}', 7),
+)
+
+# Опечатки в номере: короткий, длинный, с буквами
+INVALID_PHONE_NUMBERS = ('+7999123', '+7999123456789', '8-800-ABC-00-00', '12345', '')
+
+SCENARIOS = ('login', 'login-verify')
+
+
+def synthesize_records(count, scenario='login', seed=0, repeat_ratio=0.2, invalid_ratio=0.02, ip_pool=1000,
+                       code='0000'):
+    """ Записи входа count пользователей из правдоподобной совокупности номеров
+
+    Доля repeat_ratio запросов — повторы уже встречавшихся номеров (чаще
+    недавних: пользователь не дождался СМС), доля invalid_ratio — опечатки.
+    При сценарии login-verify за каждым входом следует ввод кода code.
+    """
+    generator = random.Random(seed)
+    codes, code_weights = zip(*MOBILE_CODES.items())
+    formats, format_weights = zip(*PHONE_FORMATS)
+    seen = []
+    records = []
+    for _ in range(count):
+        address = generator.randrange(ip_pool)
+        remote_addr = f'10.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}'
+        if generator.random() < invalid_ratio:
+            records.append({'method': 'POST', 'path': '/user_login/', 'remote_addr': remote_addr,
+                            'body': {'phone_number': generator.choice(INVALID_PHONE_NUMBERS)}})
+            continue
+        if seen and generator.random() < repeat_ratio:
+            # Недавние номера повторяются чаще давних
+            code_number = seen[-1 - min(int(generator.expovariate(0.2)), len(seen) - 1)]
+        else:
+            code_number = (generator.choices(codes, code_weights)[0], f'{generator.randrange(10 ** 7):07d}')
+            seen.append(code_number)
+        phone_number = generator.choices(formats, format_weights)[0](*code_number)
+        records.append({'method': 'POST', 'path': '/user_login/', 'remote_addr': remote_addr,
+                        'body': {'phone_number': phone_number}, 'session': len(records)})
+        if scenario == 'login-verify':
+            records.append({'method': 'POST', 'path': '/input_verification_code/', 'remote_addr': remote_addr,
+                            'body': {'phone_number': f'+7{code_number[0]}{code_number[1]}', 'entered_code': code},
+                            'issue_code': code, 'session': records[-1]['session']})
+    return records
+
+
+def read_records(path):
+    """ Записи из файла JSONL; пустые строки пропускаются """
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def prepare_records(records):
+    """ Замена auth вида {"phone_number": ...} на заголовок с новым access-токеном пользователя """
+    from authorization_service.tokens import UserClaimsRefreshToken
+    from users.models import User
+
+    tokens = {}
+    for record in records:
+        auth = record.get('auth')
+        if isinstance(auth, dict):
+            phone_number = auth['phone_number']
+            if phone_number not in tokens:
+                user = User.objects.get(username=phone_number)
+                tokens[phone_number] = f'Bearer {UserClaimsRefreshToken.for_user(user).access_token}'
+            record['auth'] = tokens[phone_number]
+    return records
+
+
+def group_sessions(records):
+    """ Записи, разбитые на сессии: списки пар (номер записи, запись) в порядке первой записи сессии
+
+    Запись без ключа session — отдельная сессия.
+    """
+    sessions = {}
+    for index, record in enumerate(records):
+        key = record['session'] if record.get('session') is not None else ('record', index)
+        sessions.setdefault(key, []).append((index, record))
+    return list(sessions.values())
+
+
+def url_name(path):
+    """ Имя URL из authorization_service/urls.py (или другого приложения) для пути """
+    try:
+        return resolve(path.split('?', 1)[0]).url_name or 'unnamed'
+    except Resolver404:
+        return 'unresolved'
+
+
+def request_kwargs(record):
+    """ Аргументы Client.generic для записи """
+    body = record.get('body')
+    kwargs = {'REMOTE_ADDR': record.get('remote_addr', '127.0.0.1')}
+    if record.get('auth'):
+        kwargs['headers'] = {'Authorization': record['auth']}
+    if body is not None:
+        kwargs['data'] = body if isinstance(body, str) else json.dumps(body)
+        kwargs['content_type'] = 'application/json'
+    return kwargs
+
+
+def issue_code(record):
+    """ Выдача кода верификации из записи номеру из её тела """
+    if record.get('issue_code'):
+        from authorization_service.code_store import get_verification_code_store
+        from authorization_service.ratelimit import normalize_phone_number
+
+        phone_number = record['body']['phone_number']
+        get_verification_code_store().issue(normalize_phone_number(phone_number) or phone_number,
+                                            record['issue_code'])
+
+
+class Schedule:
+    """ Моменты отправки запросов: i-й запрос — через i / rate секунд после начала; rate=0 — без ограничения """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.perf_counter()
+
+    def at(self, index):
+        return self.started + index / self.rate if self.rate else None
+
+
+def _finish(record, scheduled_at, started, status):
+    latency = time.perf_counter() - (scheduled_at or started)
+    return LoadResult(url_name(record['path']), status, latency * 1000)
+
+
+def send_sync(client, record, scheduled_at):
+    """ Отправка записи синхронным клиентом с ожиданием запланированного момента """
+    if scheduled_at is not None:
+        time.sleep(max(0.0, scheduled_at - time.perf_counter()))
+    started = time.perf_counter()
+    try:
+        issue_code(record)
+        response = client.generic(record['method'], record['path'], **request_kwargs(record))
+        status = response.status_code
+    except Exception:
+        status = 0
+    return _finish(record, scheduled_at, started, status)
+
+
+async def send_async(client, record, scheduled_at):
+    """ Отправка записи асинхронным клиентом с ожиданием запланированного момента """
+    if scheduled_at is not None:
+        await asyncio.sleep(max(0.0, scheduled_at - time.perf_counter()))
+    started = time.perf_counter()
+    try:
+        issue_code(record)
+        response = await client.generic(record['method'], record['path'], **request_kwargs(record))
+        status = response.status_code
+    except Exception:
+        status = 0
+    return _finish(record, scheduled_at, started, status)
+
+
+class ReplayAsyncClient(AsyncClient):
+    """ AsyncClient, передающий REMOTE_ADDR записи в поле client области ASGI
+
+    AsyncClient превращает дополнительные аргументы запроса в заголовки, а
+    адрес клиента берёт из общих для всех запросов defaults.
+    """
+
+    def _base_scope(self, **request):
+        scope = super()._base_scope(**request)
+        headers = []
+        for name, value in scope['headers']:
+            if name == b'remote_addr':
+                scope['client'] = [value.decode('latin1'), 0]
+            else:
+                headers.append((name, value))
+        scope['headers'] = headers
+        return scope
+
+
+def make_sync_client(app):
+    """ Синхронный клиент приложения: WSGI напрямую, ASGI — через async_to_sync """
+    if app == 'wsgi':
+        return Client(raise_request_exception=False)
+    client = ReplayAsyncClient(raise_request_exception=False)
+
+    class SyncAsgiClient:
+        generic = staticmethod(async_to_sync(client.generic))
+
+    return SyncAsgiClient()
+
+
+def make_async_client(app):
+    """ Асинхронный клиент приложения: ASGI напрямую, WSGI — в пуле потоков """
+    if app == 'asgi':
+        return ReplayAsyncClient(raise_request_exception=False)
+    local = threading.local()
+
+    def send(*args, **kwargs):
+        if not hasattr(local, 'client'):
+            local.client = Client(raise_request_exception=False)
+        return local.client.generic(*args, **kwargs)
+
+    class AsyncWsgiClient:
+        generic = staticmethod(sync_to_async(send, thread_sensitive=False))
+
+    return AsyncWsgiClient()
+
+
+def run_threads(records, workers, rate, app):
+    """ Прогон записей в workers потоках; каждый поток берёт следующую сессию из общей очереди """
+    schedule = Schedule(rate)
+    sessions = group_sessions(records)
+    positions = itertools.count()
+    lock = threading.Lock()
+    results = []
+
+    def worker():
+        client = make_sync_client(app)
+        local_results = []
+        while True:
+            with lock:
+                position = next(positions)
+            if position >= len(sessions):
+                break
+            for index, record in sessions[position]:
+                local_results.append(send_sync(client, record, schedule.at(index)))
+        # Потоки обращаются к базе через свои соединения; их нужно закрыть
+        connections.close_all()
+        with lock:
+            results.extend(local_results)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_asyncio(records, workers, rate, app):
+    """ Прогон записей в workers задачах asyncio одного потока """
+
+    async def main():
+        schedule = Schedule(rate)
+        client = make_async_client(app)
+        sessions = iter(group_sessions(records))
+        results = []
+
+        async def worker():
+            for session in sessions:
+                for index, record in session:
+                    results.append(await send_async(client, record, schedule.at(index)))
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+
+    return asyncio.run(main())
+
+
+def _run_process_part(args):
+    records, rate, app = args
+    return run_threads(records, 1, rate, app)
+
+
+def run_processes(records, workers, rate, app):
+    """ Прогон записей в workers дочерних процессах, по одному потоку в каждом
+
+    Процессы создаются через fork и получают сессии по кругу; целевая
+    частота делится между ними поровну.
+    """
+    # Соединения с базой не должны переходить в дочерние процессы
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    sessions = group_sessions(records)
+    parts = [([record for session in sessions[index::workers] for _, record in session], rate / workers, app)
+             for index in range(workers)]
+    with context.Pool(workers) as pool:
+        return [result for part in pool.map(_run_process_part, parts) for result in part]
+
+
+RUNNERS = {'threads': run_threads, 'processes': run_processes, 'asyncio': run_asyncio}
+
+
+def percentile(values, percent):
+    """ Процентиль percent списка values по методу ближайшего ранга """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(results, elapsed):
+    """ Сводка по именам URL и итог: запросы, пропускная способность, процентили, доля ошибок, коды ответов
+
+    Ошибка — исключение или код ответа 400 и выше.
+    """
+    groups = defaultdict(list)
+    for result in results:
+        groups[result.url_name].append(result)
+    groups['всего'] = list(results)
+    summary = {}
+    for name, group in groups.items():
+        if not group:
+            continue
+        latencies = [result.latency_ms for result in group]
+        statuses = defaultdict(int)
+        for result in group:
+            statuses[result.status] += 1
+        summary[name] = {
+            'requests': len(group),
+            'throughput': len(group) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'error_rate': sum(1 for result in group if not 200 <= result.status < 400) / len(group),
+            'statuses': dict(sorted(statuses.items())),
+        }
+    return summary
@@ -0,0 +1,50 @@
+""" Печать планов выполнения для основных запросов сервиса """
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from authorization_service.models import UserProfile
+from authorization_service.views import UserProfileViewSet
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Печать планов выполнения (EXPLAIN) для основных запросов сервиса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help='Выполнить запросы и показать фактическое время (только PostgreSQL)')
+
+    def get_hot_queries(self):
+        """ Основные запросы сервиса с параметрами, взятыми из существующего профиля """
+        sample = UserProfile.objects.order_by('id').values('user_id', 'phone_number', 'user_referral_code').first()
+        if sample is None:
+            sample = {'user_id': 1, 'phone_number': '+79999999999', 'user_referral_code': 'AAAAAA'}
+
+        viewset = UserProfileViewSet(action='list')
+        return [
+            ('Пользователь по номеру телефона (вход, проверка кода)',
+             User.objects.filter(username=sample['phone_number'])),
+            ('Профиль по реферальному коду (активация кода)',
+             UserProfile.objects.filter(user_referral_code=sample['user_referral_code'])),
+            ('Рефералы по активированному коду',
+             UserProfile.objects.filter(activated_referral_code=sample['user_referral_code'])),
+            ('Рефералы по пригласившему пользователю (список профилей)',
+             UserProfile.objects.filter(referrer_id=sample['user_id']).order_by('id')),
+            ('Профили без активированного кода',
+             UserProfile.objects.filter(activated_referral_code__isnull=True).order_by('id')[:50]),
+            ('Страница списка профилей',
+             viewset.get_queryset()[:5]),
+        ]
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                self.stderr.write('--analyze поддерживается только для PostgreSQL, параметр проигнорирован')
+            else:
+                explain_options['analyze'] = True
+
+        for title, queryset in self.get_hot_queries():
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,33 @@
+""" Потоковая выгрузка профилей и реферальных связей в файл """
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authorization_service.export import iter_export, EXPORT_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка профилей или реферальных связей в NDJSON или CSV курсором на стороне сервера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу для выгрузки')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Формат файла; по умолчанию определяется по расширению')
+        parser.add_argument('--dataset', choices=list(EXPORT_FIELDS), default='profiles',
+                            help='Профили или реферальные связи')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE,
+                            help='Число строк, читаемых из курсора за одно обращение')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        exported = 0
+        started = time.perf_counter()
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            for rows, text in iter_export(options['dataset'], file_format, options['chunk_size']):
+                file.write(text)
+                exported += rows
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено строк: {exported} в {path} за {elapsed:.1f} с'))
@@ -0,0 +1,158 @@
+""" Массовое создание пользователей из файла с номерами телефонов """
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.serializers import ValidationError
+
+from authorization_service.models import UserProfile
+from authorization_service.response_cache import invalidate_profile_responses
+from authorization_service.utils import generate_referral_code, fallback_referral_code, REFERRAL_CODE_ATTEMPTS
+from authorization_service.validators import PhoneNumberValidator
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Потоковый импорт пользователей из CSV (колонка phone_number или первая колонка) '
+            'или NDJSON (объекты с ключом phone_number) пакетными вставками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу CSV или NDJSON')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Формат файла; по умолчанию определяется по расширению')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Число записей в одной транзакции')
+        parser.add_argument('--checkpoint',
+                            help='Файл контрольной точки: число обработанных записей. Если файл существует, '
+                                 'импорт продолжается с сохранённой позиции')
+
+    def read_phone_numbers(self, path, file_format):
+        """ Потоковое чтение номеров телефонов из файла """
+        with open(path, newline='', encoding='utf-8') as file:
+            if file_format == 'ndjson':
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    yield record.get('phone_number') if isinstance(record, dict) else str(record)
+            else:
+                reader = csv.reader(file)
+                header = next(reader, None)
+                if header is None:
+                    return
+                if 'phone_number' in header:
+                    column = header.index('phone_number')
+                else:
+                    column = 0
+                    yield header[0]
+                for row in reader:
+                    if row:
+                        yield row[column]
+
+    def iter_chunks(self, phone_numbers, chunk_size, skip):
+        """ Разбиение потока номеров на порции с пропуском уже обработанных записей """
+        chunk = []
+        for position, phone_number in enumerate(phone_numbers):
+            if position < skip:
+                continue
+            chunk.append(phone_number)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def import_chunk(self, raw_phone_numbers, validator, password):
+        """ Создание пользователей и профилей для порции номеров; возвращает (создано, пропущено, ошибок) """
+        phone_numbers = {}
+        invalid = 0
+        for raw_phone_number in raw_phone_numbers:
+            try:
+                phone_numbers[validator(raw_phone_number)] = None
+            except ValidationError:
+                invalid += 1
+                if self.verbosity > 1:
+                    self.stderr.write(f'Некорректный номер: {raw_phone_number!r}')
+
+        existing = set(User.objects.filter(username__in=phone_numbers).values_list('username', flat=True))
+        new_phone_numbers = [phone_number for phone_number in phone_numbers if phone_number not in existing]
+        if not new_phone_numbers:
+            return 0, len(raw_phone_numbers) - invalid, invalid
+
+        with transaction.atomic():
+            User.objects.bulk_create([User(username=phone_number, password=password)
+                                      for phone_number in new_phone_numbers], ignore_conflicts=True)
+            user_ids = dict(User.objects.filter(username__in=new_phone_numbers).values_list('username', 'id'))
+            self.create_profiles(user_ids)
+
+        invalidate_profile_responses()
+        created = len(user_ids)
+        return created, len(raw_phone_numbers) - invalid - created, invalid
+
+    def create_profiles(self, user_ids):
+        """ Создание профилей для {номер: id пользователя} пакетными вставками
+
+        Профиль, чей код по первичному ключу совпал с кодом, выданным до перехода
+        на распределитель кодов, вставкой пропускается (ignore_conflicts). Такие
+        профили вставляются повторно с кодами fallback_referral_code.
+        """
+        pending = user_ids
+        codes = {user_id: generate_referral_code(user_id) for user_id in user_ids.values()}
+        for _ in range(REFERRAL_CODE_ATTEMPTS):
+            UserProfile.objects.bulk_create([
+                UserProfile(user_id=user_id, phone_number=phone_number, user_referral_code=codes[user_id])
+                for phone_number, user_id in pending.items()
+            ], ignore_conflicts=True)
+            if UserProfile.objects.filter(user_id__in=pending.values()).count() == len(pending):
+                return
+            created = set(UserProfile.objects.filter(user_id__in=pending.values()).values_list('user_id', flat=True))
+            pending = {phone_number: user_id for phone_number, user_id in pending.items() if user_id not in created}
+            codes = {user_id: fallback_referral_code() for user_id in pending.values()}
+            if self.verbosity > 1:
+                self.stderr.write(f'Реферальные коды заняты, повтор со случайными кодами: {len(pending)}')
+        raise CommandError('Не удалось создать профили: номер телефона уже занят другим профилем '
+                           'или не удалось подобрать свободный реферальный код')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        checkpoint = options['checkpoint']
+
+        skip = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                skip = int(file.read().strip() or 0)
+            self.stdout.write(f'Продолжение импорта с записи {skip}')
+
+        validator = PhoneNumberValidator()
+        password = make_password(None)  # Вход только по коду из СМС, пароль не используется
+        processed = skip
+        created = skipped = invalid = 0
+        started = time.perf_counter()
+
+        chunks = self.iter_chunks(self.read_phone_numbers(path, file_format), options['chunk_size'], skip)
+        for chunk in chunks:
+            chunk_created, chunk_skipped, chunk_invalid = self.import_chunk(chunk, validator, password)
+            created += chunk_created
+            skipped += chunk_skipped
+            invalid += chunk_invalid
+            processed += len(chunk)
+            if checkpoint:
+                with open(checkpoint, 'w') as file:
+                    file.write(str(processed))
+
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'Обработано записей: {processed}, создано: {created}, пропущено: {skipped}, '
+                              f'некорректных: {invalid}, скорость: {(processed - skip) / elapsed:.0f} записей/с')
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт завершён за {elapsed:.1f} с: создано {created}, пропущено существующих {skipped}, '
+            f'некорректных номеров {invalid}'))
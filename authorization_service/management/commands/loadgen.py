@@ -0,0 +1,65 @@
+""" Воспроизведение записанного трафика и генерация нагрузки """
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authorization_service.loadgen import RUNNERS, SCENARIOS, read_records, prepare_records, synthesize_records, \
+    summarize
+
+
+class Command(BaseCommand):
+    help = ('Воспроизведение запросов из JSONL (method, path, body, auth) или сгенерированных входов '
+            'в приложение внутри процесса с отчётом по именам URL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', help='Файл JSONL с записанными запросами')
+        parser.add_argument('--synthesize', type=int, default=0,
+                            help='Сгенерировать столько входов пользователей, если записи нет')
+        parser.add_argument('--scenario', choices=SCENARIOS, default='login',
+                            help='Сценарий генерации: только вход или вход и ввод кода')
+        parser.add_argument('--repeat-ratio', type=float, default=0.2, help='Доля повторных входов с тем же номером')
+        parser.add_argument('--invalid-ratio', type=float, default=0.02, help='Доля некорректных номеров')
+        parser.add_argument('--ip-pool', type=int, default=1000, help='Число различных IP-адресов клиентов')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора')
+        parser.add_argument('--save', help='Сохранить сгенерированные записи в JSONL')
+        parser.add_argument('--mode', choices=list(RUNNERS), default='threads',
+                            help='Потоки, процессы или задачи asyncio')
+        parser.add_argument('--workers', type=int, default=8, help='Число потоков, процессов или задач')
+        parser.add_argument('--rate', type=float, default=0, help='Целевая частота, запросов/с (0 — без ограничения)')
+        parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi', help='Приложение Django')
+        parser.add_argument('--loops', type=int, default=1, help='Сколько раз повторить записи')
+        parser.add_argument('--json', action='store_true', help='Вывести сводку в JSON')
+
+    def handle(self, *args, **options):
+        if options['input']:
+            records = read_records(options['input'])
+        elif options['synthesize']:
+            records = synthesize_records(options['synthesize'], options['scenario'], options['seed'],
+                                         options['repeat_ratio'], options['invalid_ratio'], options['ip_pool'])
+            if options['save']:
+                with open(options['save'], 'w', encoding='utf-8') as file:
+                    file.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        else:
+            raise CommandError('Укажите --input или --synthesize')
+        if options['workers'] < 1:
+            raise CommandError('--workers должно быть не меньше 1')
+        records = prepare_records(records) * options['loops']
+
+        started = time.perf_counter()
+        results = RUNNERS[options['mode']](records, options['workers'], options['rate'], options['app'])
+        elapsed = time.perf_counter() - started
+        summary = summarize(results, elapsed)
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'{len(results)} запросов за {elapsed:.2f} с: {options["mode"]} x{options["workers"]}, '
+                          f'{options["app"]}, частота {options["rate"] or "без ограничения"}')
+        self.stdout.write(f'{"имя URL":<28}{"запросов":>9}{"запр./с":>10}{"p50, мс":>10}{"p95, мс":>10}'
+                          f'{"p99, мс":>10}{"ошибок":>8}  коды ответов')
+        for name, stats in summary.items():
+            statuses = ', '.join(f'{status}: {count}' for status, count in stats['statuses'].items())
+            self.stdout.write(f'{name:<28}{stats["requests"]:>9}{stats["throughput"]:>10.1f}{stats["p50_ms"]:>10.2f}'
+                              f'{stats["p95_ms"]:>10.2f}{stats["p99_ms"]:>10.2f}{stats["error_rate"]:>8.1%}  '
+                              f'{statuses}')
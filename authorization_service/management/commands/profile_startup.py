@@ -0,0 +1,90 @@
+""" Профилирование холодного старта воркера """
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Скрипт дочернего процесса: настройка Django и два запроса подряд через WSGI-обработчик
+CHILD_SCRIPT = '''
+import json
+import sys
+import time
+
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - started
+
+from django.test import Client
+
+client = Client()
+latencies = []
+for _ in range(2):
+    request_started = time.perf_counter()
+    response = client.generic(sys.argv[1], sys.argv[2])
+    latencies.append(time.perf_counter() - request_started)
+print(json.dumps({'setup': setup, 'latencies': latencies, 'status': response.status_code}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Время импорта модулей и задержка первого запроса в новом процессе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/user_login/', help='Путь первого запроса')
+        parser.add_argument('--method', default='GET', help='HTTP-метод первого запроса')
+        parser.add_argument('--top', type=int, default=20, help='Число модулей в отчёте')
+        parser.add_argument('--warmup', action='store_true', help='Включить прогрев при старте (STARTUP_WARMUP=1)')
+        parser.add_argument('--no-docs', action='store_true', help='Отключить документацию API (API_DOCS_ENABLED=0)')
+
+    def run_child(self, options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'))
+        env['STARTUP_WARMUP'] = '1' if options['warmup'] else '0'
+        if options['no_docs']:
+            env['API_DOCS_ENABLED'] = '0'
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT, options['method'].upper(), options['path']],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Дочерний процесс завершился с ошибкой:\n{result.stderr[-2000:]}')
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    @staticmethod
+    def parse_importtime(output):
+        """ Разбор вывода -X importtime: список (модуль, собственное время, суммарное время) в мкс """
+        modules = []
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_time, cumulative, name = line[len('import time:'):].split('|')
+            modules.append((name.rstrip(), int(self_time), int(cumulative)))
+        return modules
+
+    def handle(self, *args, **options):
+        report, stderr = self.run_child(options)
+        modules = self.parse_importtime(stderr)
+
+        packages = defaultdict(int)
+        for name, self_time, _ in modules:
+            packages[name.strip().split('.')[0]] += self_time
+
+        top = options['top']
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Модули с наибольшим суммарным временем импорта (top {top})'))
+        for name, self_time, cumulative in sorted(modules, key=lambda item: -item[2])[:top]:
+            self.stdout.write(f'{cumulative / 1000:>10.1f} мс {self_time / 1000:>9.1f} мс  {name}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Собственное время импорта по пакетам (top {top})'))
+        for package, self_time in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f'{self_time / 1000:>10.1f} мс  {package}')
+
+        first, second = report['latencies']
+        self.stdout.write(self.style.MIGRATE_HEADING('Старт процесса'))
+        self.stdout.write(f'django.setup(): {report["setup"] * 1000:.1f} мс')
+        self.stdout.write(f'Первый запрос {options["method"].upper()} {options["path"]} '
+                          f'(статус {report["status"]}): {first * 1000:.1f} мс')
+        self.stdout.write(f'Второй запрос: {second * 1000:.1f} мс')
@@ -0,0 +1,23 @@
+""" Сверка рейтинга пригласивших с базой """
+from django.core.management.base import BaseCommand
+
+from authorization_service.leaderboard import get_leaderboard, reconcile_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Пересборка рейтинга пригласивших по счётчикам рефералов из базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Размер топа, расхождения в котором выводятся')
+
+    def handle(self, *args, **options):
+        leaderboard = get_leaderboard()
+        before = leaderboard.top(options['limit']) if leaderboard.is_built() else []
+        total = reconcile_leaderboard(leaderboard)
+        after = leaderboard.top(options['limit'])
+        if options['verbosity'] > 1 and before != after:
+            self.stdout.write(f'Топ до сверки: {before}')
+            self.stdout.write(f'Топ после сверки: {after}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг пересобран: пригласивших {total}, топ-{options["limit"]} '
+            f'{"изменился" if before != after else "без изменений"}'))
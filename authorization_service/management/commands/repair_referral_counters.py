@@ -0,0 +1,76 @@
+""" Пересчёт денормализованных счётчиков и списков рефералов """
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from authorization_service.leaderboard import reconcile_leaderboard
+from authorization_service.models import UserProfile
+from authorization_service.response_cache import invalidate_profile_responses
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт referral_count и списка номеров рефералов в профилях порциями с выявлением расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Число профилей в одной порции')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, не исправляя их')
+
+    def repair_chunk(self, last_id, chunk_size, cache_phone_numbers, dry_run, verbosity):
+        """ Пересчёт порции профилей с id больше last_id; возвращает порцию и изменённые профили """
+        queryset = UserProfile.objects.filter(id__gt=last_id).order_by('id').only(
+            'id', 'user_id', 'referral_count', 'referred_phone_numbers')
+        if not dry_run:
+            queryset = queryset.select_for_update()
+        profiles = list(queryset[:chunk_size])
+
+        referrals = defaultdict(list)
+        rows = UserProfile.objects.filter(referrer_id__in=[profile.user_id for profile in profiles]) \
+            .order_by('id').values_list('referrer_id', 'user_id', 'phone_number')
+        for referrer_id, user_id, phone_number in rows:
+            if referrer_id != user_id:
+                referrals[referrer_id].append(phone_number)
+
+        changed = []
+        for profile in profiles:
+            phone_numbers = referrals.get(profile.user_id, [])
+            is_drifted = profile.referral_count != len(phone_numbers)
+            if cache_phone_numbers:
+                is_drifted = is_drifted or set(profile.referred_phone_number_list) != set(phone_numbers)
+            if not is_drifted:
+                continue
+            if verbosity > 1:
+                self.stdout.write(f'Профиль {profile.id}: referral_count {profile.referral_count} -> '
+                                  f'{len(phone_numbers)}')
+            profile.referral_count = len(phone_numbers)
+            profile.referred_phone_numbers = ','.join(phone_numbers)
+            changed.append(profile)
+        return profiles, changed
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        cache_phone_numbers = settings.REFERRAL_CACHE_PHONE_NUMBERS
+        update_fields = ['referral_count', 'referred_phone_numbers'] if cache_phone_numbers else ['referral_count']
+
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                profiles, changed = self.repair_chunk(last_id, chunk_size, cache_phone_numbers, dry_run,
+                                                      options['verbosity'])
+                if changed and not dry_run:
+                    UserProfile.objects.bulk_update(changed, update_fields)
+                    invalidate_profile_responses([profile.pk for profile in changed])
+            if not profiles:
+                break
+            last_id = profiles[-1].id
+            checked += len(profiles)
+            drifted += len(changed)
+
+        if drifted and not dry_run:
+            # Счётчики изменились в обход активации, поэтому рейтинг собирается заново
+            reconcile_leaderboard()
+        action = 'найдено' if dry_run else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(f'Проверено профилей: {checked}, расхождений {action}: {drifted}'))
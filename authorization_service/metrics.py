@@ -0,0 +1,256 @@
+""" Метрики запросов: middleware с заголовком Server-Timing и эндпоинт /metrics в формате Prometheus
+
+Для каждого запроса измеряются полное время обработки, число и время
+запросов к базе, время отрисовки ответа (JSON-рендерер DRF) и размер
+ответа. Запросы к базе считает execute_wrapper, который ставится на каждое
+соединение при его создании и пишет в измерения текущего запроса из
+ContextVar: соединения у каждого потока свои, и под ASGI ORM работает в
+потоках sync_to_async, куда контекст копируется. Значения попадают в гистограммы
+по имени представления и HTTP-методу.
+
+Гистограммы хранятся в памяти процесса по потокам: каждый поток пишет только
+в свои счётчики, поэтому запись не берёт блокировок, а /metrics суммирует
+счётчики всех потоков при чтении. Каждый процесс (воркер gunicorn) отдаёт
+свои метрики.
+
+Метрики и Server-Timing раскрывают число запросов к базе (например, по нему
+видно, зарегистрирован ли номер при входе), поэтому /metrics и заголовок
+доступны только запросам с адресов METRICS['INTERNAL_IPS'].
+"""
+import bisect
+import ipaddress
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.throttling import BaseThrottle
+
+# Гистограммы: имя метрики, описание и верхние границы корзин
+HISTOGRAMS = (
+    ('http_request_duration_seconds', 'Полное время обработки запроса',
+     (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)),
+    ('http_request_db_queries', 'Число запросов к базе на запрос',
+     (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)),
+    ('http_request_db_duration_seconds', 'Время запросов к базе на запрос',
+     (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)),
+    ('http_response_render_duration_seconds', 'Время отрисовки (сериализации) ответа',
+     (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)),
+    ('http_response_size_bytes', 'Размер тела ответа',
+     (100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000, 1000000)),
+)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Остальные методы записываются как other, чтобы клиент не мог создавать новые ряды метрик
+HTTP_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+
+def internal_networks():
+    """ Адреса и подсети из настройки METRICS['INTERNAL_IPS'] """
+    return tuple(ipaddress.ip_network(network, strict=False) for network in settings.METRICS['INTERNAL_IPS'])
+
+
+def is_internal_request(request, networks=None):
+    """ Пришёл ли запрос с внутреннего адреса; адрес клиента определяется, как для лимитов частоты (NUM_PROXIES) """
+    try:
+        address = ipaddress.ip_address(BaseThrottle().get_ident(request))
+    except ValueError:
+        return False
+    return any(address in network for network in (internal_networks() if networks is None else networks))
+
+
+class MetricsRegistry:
+    """ Гистограммы по представлениям в счётчиках потоков
+
+    Поток получает свой словарь счётчиков при первой записи (регистрация
+    под блокировкой, один раз на поток); дальше запись идёт без блокировок.
+    Счётчики завершившихся потоков сохраняются.
+    """
+
+    def __init__(self, histograms=HISTOGRAMS):
+        self.histograms = histograms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, labels, values):
+        """ Запись значений всех гистограмм (в порядке histograms) для меток labels """
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # Для каждой гистограммы: счётчики корзин (последняя — +Inf) и сумма значений
+            series = shard[labels] = [[[0] * (len(buckets) + 1), 0.0] for _, _, buckets in self.histograms]
+        for (_, _, buckets), histogram, value in zip(self.histograms, series, values):
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def collect(self):
+        """ Сумма счётчиков всех потоков: {метки: [(счётчики корзин, сумма), ...]} """
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for labels, series in list(shard.items()):
+                total = merged.setdefault(labels, [[[0] * len(counts), 0.0] for counts, _ in series])
+                for histogram, (counts, value_sum) in zip(total, series):
+                    histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                    histogram[1] += value_sum
+        return merged
+
+    def clear(self):
+        """ Сброс всех счётчиков """
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def render(self):
+        """ Метрики в текстовом формате Prometheus """
+        collected = sorted(self.collect().items())
+        lines = []
+        for index, (name, description, buckets) in enumerate(self.histograms):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (view, method), series in collected:
+                counts, value_sum = series[index]
+                label = f'view="{view}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}}} {value_sum:.6f}')
+                lines.append(f'{name}_count{{{label}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestTimings:
+    """ Измерения одного запроса """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.render_started = None
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """ execute_wrapper соединений с базой: число и время запросов """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.finish_render)
+        return response
+
+    def finish_render(self, response):
+        self.render_time += time.perf_counter() - self.render_started
+
+
+# Измерения текущего запроса; вне запросов — None, и запросы к базе не учитываются
+_current_timings = ContextVar('request_timings', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """ execute_wrapper всех соединений: запрос к базе учитывается в измерениях текущего запроса """
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """ Обработчик сигнала connection_created: подсчёт запросов нового соединения """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    """ Измерение запросов, заголовок Server-Timing и запись гистограмм
+
+    Должен стоять первым в MIDDLEWARE, чтобы время включало остальные
+    middleware. Server-Timing добавляется только при METRICS['SERVER_TIMING']
+    и только в ответы на внутренние запросы. Работает и в синхронном, и в асинхронном стеке. У потоковых
+    ответов (выгрузка) измеряется только подготовка ответа, размер равен 0.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = settings.METRICS['SERVER_TIMING']
+        self.internal_networks = internal_networks()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = request._metrics_timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = request._metrics_timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        """ Ответы DRF отрисовываются после представления: замер времени отрисовки """
+        return request._metrics_timings.start_render(response)
+
+    def _finish(self, request, response, timings):
+        duration = time.perf_counter() - timings.started
+        size = 0 if response.streaming else len(response.content)
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        registry.observe((_view_name(request), method),
+                         (duration, timings.db_queries, timings.db_time, timings.render_time, size))
+        if self.server_timing and is_internal_request(request, self.internal_networks):
+            response['Server-Timing'] = (
+                f'total;dur={duration * 1000:.2f}, '
+                f'db;dur={timings.db_time * 1000:.2f};desc="{timings.db_queries} queries", '
+                f'render;dur={timings.render_time * 1000:.2f}'
+            )
+        return response
+
+
+def metrics_view(request):
+    """ Гистограммы процесса в текстовом формате Prometheus; только для внутренних адресов """
+    if not is_internal_request(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authorization_service', '0003_alter_userprofile_activated_referral_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('activated_referral_code__isnull', False)), fields=['activated_referral_code'], name='profile_activated_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('activated_referral_code__isnull', True)), fields=['id'], name='profile_without_referral_idx'),
+        ),
+    ]
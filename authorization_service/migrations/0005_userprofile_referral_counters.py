@@ -0,0 +1,51 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:22
+
+import itertools
+
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_referral_counters(apps, schema_editor):
+    """ Заполнение счётчиков и списков номеров рефералов по уже активированным кодам, порциями """
+    UserProfile = apps.get_model('authorization_service', 'UserProfile')
+    profiles = UserProfile.objects.using(schema_editor.connection.alias)
+    # Рефералы идут подряд по пригласившему; старые записи, где профиль пригласил сам себя, пропускаются
+    rows = profiles.filter(referrer__isnull=False).exclude(referrer_id=models.F('user_id')) \
+        .order_by('referrer_id', 'id').values_list('referrer_id', 'phone_number') \
+        .iterator(chunk_size=BACKFILL_BATCH_SIZE)
+    groups = itertools.groupby(rows, key=lambda row: row[0])
+    while True:
+        batch = {referrer_id: [phone_number for _, phone_number in group]
+                 for referrer_id, group in itertools.islice(groups, BACKFILL_BATCH_SIZE)}
+        if not batch:
+            break
+        changed = []
+        for profile in profiles.filter(user_id__in=batch).only('id', 'user_id'):
+            phone_numbers = batch[profile.user_id]
+            profile.referral_count = len(phone_numbers)
+            profile.referred_phone_numbers = ','.join(phone_numbers)
+            changed.append(profile)
+        profiles.bulk_update(changed, ['referral_count', 'referred_phone_numbers'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authorization_service', '0004_userprofile_referral_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='referral_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='referred_phone_numbers',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_referral_counters, migrations.RunPython.noop),
+    ]
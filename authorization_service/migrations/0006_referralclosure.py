@@ -0,0 +1,60 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_referral_closure(apps, schema_editor):
+    """ Заполнение таблицы замыкания по уже активированным кодам, уровень за уровнем """
+    profile_table = apps.get_model('authorization_service', 'UserProfile')._meta.db_table
+    closure_table = apps.get_model('authorization_service', 'ReferralClosure')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {closure_table} (ancestor_id, descendant_id, depth) '
+            f'SELECT r.id, p.id, 1 FROM {profile_table} p JOIN {profile_table} r ON r.user_id = p.referrer_id '
+            f'WHERE r.id <> p.id'
+        )
+        depth = 1
+        while True:
+            # Пары, уже найденные на меньшей глубине, и петли из старых данных пропускаются
+            cursor.execute(
+                f'INSERT INTO {closure_table} (ancestor_id, descendant_id, depth) '
+                f'SELECT DISTINCT c.ancestor_id, e.descendant_id, %s FROM {closure_table} c '
+                f'JOIN {closure_table} e ON e.ancestor_id = c.descendant_id AND e.depth = 1 '
+                f'WHERE c.depth = %s AND c.ancestor_id <> e.descendant_id AND NOT EXISTS ('
+                f'SELECT 1 FROM {closure_table} x WHERE x.ancestor_id = c.ancestor_id '
+                f'AND x.descendant_id = e.descendant_id)',
+                [depth + 1, depth]
+            )
+            if cursor.rowcount == 0:
+                break
+            depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authorization_service', '0005_userprofile_referral_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='authorization_service.userprofile')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='authorization_service.userprofile')),
+            ],
+            options={
+                'verbose_name': 'связь реферального дерева',
+                'verbose_name_plural': 'связи реферального дерева',
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='referral_closure_subtree_idx'), models.Index(fields=['descendant', 'depth'], name='referral_closure_ancestors_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referralclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_closure_unique_pair'),
+        ),
+        migrations.RunPython(backfill_referral_closure, migrations.RunPython.noop),
+    ]
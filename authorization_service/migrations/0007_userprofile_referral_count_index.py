@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authorization_service', '0006_referralclosure'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('referral_count__gt', 0)), fields=['-referral_count', 'id'], name='profile_referral_count_idx'),
+        ),
+    ]
@@ -12,10 +12,18 @@ class UserProfile(models.Model):
     user_referred_code_used = models.BooleanField(default=False)
     referrer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='referrals',
                                  null=True)
+    # Денормализованные данные о рефералах, обновляются при активации кода
+    referral_count = models.PositiveIntegerField(default=0)
+    referred_phone_numbers = models.TextField(blank=True, default='')
 
     def __str__(self):
         return f"{self.user}"
 
+    @property
+    def referred_phone_number_list(self):
+        """ Номера телефонов рефералов из денормализованного списка """
+        return self.referred_phone_numbers.split(',') if self.referred_phone_numbers else []
+
     def mark_user_referred_code_used(self):
         """ Метод для отметки использования инвайта """
         self.referred_code_used = True
@@ -25,3 +33,39 @@ class UserProfile(models.Model):
         """ Мета-данные """
         verbose_name = 'профиль пользователя'
         verbose_name_plural = 'профили пользователей'
+        indexes = [
+            # Поиск рефералов по активированному коду; профили без кода в индекс не попадают
+            models.Index(fields=['activated_referral_code'], name='profile_activated_code_idx',
+                         condition=models.Q(activated_referral_code__isnull=False)),
+            # Выборка профилей, ещё не активировавших реферальный код
+            models.Index(fields=['id'], name='profile_without_referral_idx',
+                         condition=models.Q(activated_referral_code__isnull=True)),
+            # Сборка рейтинга пригласивших: только профили с рефералами, по убыванию счёта
+            models.Index(fields=['-referral_count', 'id'], name='profile_referral_count_idx',
+                         condition=models.Q(referral_count__gt=0)),
+        ]
+
+
+class ReferralClosure(models.Model):
+    """ Таблица замыкания реферального дерева: строка на каждую пару предок - потомок
+
+    depth — расстояние между профилями (1 для прямого реферала). Строки профиля
+    самого с собой не хранятся. Заполняется при активации реферального кода.
+    """
+    ancestor = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        """ Мета-данные """
+        verbose_name = 'связь реферального дерева'
+        verbose_name_plural = 'связи реферального дерева'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='referral_closure_unique_pair'),
+        ]
+        indexes = [
+            # Поддерево профиля по уровням и его размер
+            models.Index(fields=['ancestor', 'depth'], name='referral_closure_subtree_idx'),
+            # Цепочка пригласивших профиля
+            models.Index(fields=['descendant', 'depth'], name='referral_closure_ancestors_idx'),
+        ]
@@ -1,8 +1,112 @@
-""" Пагинаторы приложения training_courses """
-from rest_framework.pagination import PageNumberPagination
+""" Пагинаторы приложения authorization_service
 
+Постраничный вывод поддерживает два режима:
+- по номеру страницы (?page=N) — общее число записей берётся из кэша, а для
+  больших таблиц PostgreSQL — из оценки планировщика (pg_class.reltuples),
+  вместо COUNT(*) по всей таблице на каждый запрос;
+- по курсору (?cursor=... или ?pagination=cursor) — страница выбирается условием
+  id > последний id предыдущей страницы, без OFFSET, поэтому время ответа
+  не зависит от глубины страницы. Курсоры непрозрачные (base64).
+"""
+import hashlib
 
-class UserProfilePagination(PageNumberPagination):
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+def estimate_count(queryset):
+    """ Оценка числа строк таблицы по статистике PostgreSQL или None, если оценка недоступна
+
+    Оценка используется только для запросов без условий и только для больших
+    таблиц (не меньше PAGINATION_APPROXIMATE_COUNT_THRESHOLD строк).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < settings.PAGINATION_APPROXIMATE_COUNT_THRESHOLD:
+        return None
+    return row[0]
+
+
+def get_cached_count(queryset):
+    """ Число записей запроса из кэша; при промахе — оценка или COUNT(*) """
+    sql = str(queryset.query)
+    key = f'pagination_count:{queryset.model._meta.label_lower}:{hashlib.md5(sql.encode()).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = estimate_count(queryset)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """ Пагинатор Django с общим числом записей из кэша """
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return get_cached_count(self.object_list)
+        return len(self.object_list)
+
+
+class IdCursorPagination(CursorPagination):
+    """ Пагинация по курсору с сортировкой по id """
+    ordering = 'id'
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+class CursorOrPageNumberPagination(PageNumberPagination):
+    """ Пагинация по номеру страницы с кэшированным числом записей либо, по запросу, по курсору """
+    django_paginator_class = CachedCountPaginator
+    cursor_pagination_class = IdCursorPagination
+    cursor_query_param = 'cursor'
+    pagination_mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def use_cursor(self, request):
+        """ Режим курсора: передан курсор или явно запрошен ?pagination=cursor """
+        return (self.cursor_query_param in request.query_params
+                or request.query_params.get(self.pagination_mode_query_param) == 'cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            self.cursor_paginator.page_size = self.page_size
+            self.cursor_paginator.max_page_size = self.max_page_size
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_html_context()
+        return super().get_html_context()
+
+    def get_schema_operation_parameters(self, view):
+        return (super().get_schema_operation_parameters(view)
+                + self.cursor_pagination_class().get_schema_operation_parameters(view)[:1])
+
+
+class UserProfilePagination(CursorOrPageNumberPagination):
     """ Пагинатор для вывода профилей """
     page_size = 5
     page_size_query_param = 'page_size'
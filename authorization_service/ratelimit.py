@@ -0,0 +1,169 @@
+""" Ограничение частоты запросов по номеру телефона и IP-адресу
+
+Используется счётчик скользящего окна: хранятся только число запросов
+в текущем и предыдущем окнах, а оценка числа запросов за последние window
+секунд — это счётчик текущего окна плюс доля предыдущего, ещё попадающая
+в скользящее окно. Проверка выполняется за O(1) по времени и памяти на ключ.
+
+Бэкенд задаётся настройкой RATE_LIMITS: LocMemRateLimitBackend хранит
+счётчики в памяти процесса (шарды с отдельными блокировками),
+CacheRateLimitBackend — в общем кэше Django, и лимиты действуют для всех воркеров.
+"""
+import functools
+import math
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+from rest_framework.serializers import ValidationError
+
+from authorization_service.ttl_cache import TTLCache
+from authorization_service.validators import PhoneNumberValidator
+
+
+def sliding_window_estimate(previous, current, elapsed_fraction):
+    """ Оценка числа запросов за последнее окно по счётчикам двух соседних окон """
+    return previous * (1 - elapsed_fraction) + current
+
+
+def sliding_window_retry_after(previous, current, limit, window, now):
+    """ Через сколько секунд оценка опустится настолько, что запрос будет разрешён """
+    window_start = now // window * window
+    if current + 1 <= limit and previous:
+        # Достаточно дождаться, пока вес предыдущего окна уменьшится
+        unblocked_at = window_start + window * (1 - (limit - 1 - current) / previous)
+    else:
+        # Нужно дождаться следующего окна, в котором текущий счётчик станет предыдущим
+        unblocked_at = window_start + window + window * max(0.0, 1 - (limit - 1) / current)
+    return max(1, math.ceil(unblocked_at - now))
+
+
+class BaseRateLimitBackend:
+    """ Базовый бэкенд счётчиков скользящего окна """
+
+    def hit(self, key, limit, window):
+        """ Учёт запроса: (разрешён ли запрос, через сколько секунд повторить, если нет)
+
+        Отклонённые запросы не увеличивают счётчик.
+        """
+        raise NotImplementedError
+
+
+class LocMemRateLimitBackend(BaseRateLimitBackend):
+    """ Счётчики в памяти процесса
+
+    Ключи распределяются по шардам, у каждого шарда своя блокировка, поэтому
+    потоки, проверяющие разные ключи, почти не ждут друг друга. Лимиты
+    действуют в пределах одного процесса.
+    """
+
+    def __init__(self, shards=16, max_entries=100000):
+        self._shards = [TTLCache(max_entries=max_entries // shards) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        window_index = int(now // window)
+        shard = self._shard(key)
+        with shard.lock:
+            stored_index, current, previous = shard.get(key) or (window_index, 0, 0)
+            if stored_index == window_index - 1:
+                current, previous = 0, current
+            elif stored_index != window_index:
+                current, previous = 0, 0
+            estimate = sliding_window_estimate(previous, current, now / window - window_index)
+            if estimate + 1 > limit:
+                return False, sliding_window_retry_after(previous, current, limit, window, now)
+            shard.set(key, (window_index, current + 1, previous), timeout=2 * window)
+        return True, None
+
+    def clear(self):
+        """ Сброс всех счётчиков """
+        for shard in self._shards:
+            shard.clear()
+
+
+class CacheRateLimitBackend(BaseRateLimitBackend):
+    """ Счётчики в кэше Django: лимиты общие для всех процессов, использующих этот кэш """
+
+    def __init__(self, cache_alias='default', key_prefix='ratelimit'):
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        window_index = int(now // window)
+        current_key = f'{self.key_prefix}:{key}:{window_index}'
+        previous_key = f'{self.key_prefix}:{key}:{window_index - 1}'
+        # Счётчик увеличивается атомарно, и только затем проверяется оценка
+        self.cache.add(current_key, 0, timeout=2 * window)
+        current = self.cache.incr(current_key)
+        previous = self.cache.get(previous_key, 0)
+        estimate = sliding_window_estimate(previous, current - 1, now / window - window_index)
+        if estimate + 1 > limit:
+            self.cache.decr(current_key)
+            return False, sliding_window_retry_after(previous, current - 1, limit, window, now)
+        return True, None
+
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limit_backend():
+    """ Бэкенд счётчиков, заданный в настройке RATE_LIMITS """
+    config = settings.RATE_LIMITS
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def normalize_phone_number(value):
+    """ Номер телефона в формате E.164 или None, если номер некорректен """
+    try:
+        return PhoneNumberValidator()(value)
+    except ValidationError:
+        return None
+
+
+def check_rate_limits(scope, phone_number, ip_address):
+    """ Проверка лимитов области scope ('login', 'verify') по номеру телефона и IP-адресу
+
+    Возвращает None, если запрос разрешён, иначе число секунд до повтора.
+    """
+    if not settings.RATE_LIMITS['ENABLED']:
+        return None
+    rules = settings.RATE_LIMITS['RULES'].get(scope, {})
+    idents = {'phone': normalize_phone_number(phone_number), 'ip': ip_address}
+    backend = get_rate_limit_backend()
+    for ident_type, (limit, window) in rules.items():
+        ident = idents.get(ident_type)
+        if ident is None:
+            continue
+        allowed, retry_after = backend.hit(f'{scope}:{ident_type}:{ident}', limit, window)
+        if not allowed:
+            return retry_after
+    return None
+
+
+class PhoneNumberAndIPRateThrottle(BaseThrottle):
+    """ Ограничение частоты запросов по номеру телефона из тела запроса и IP-адресу клиента
+
+    Область лимитов берётся из атрибута rate_limit_scope представления.
+    Проверка выполняется до обработчика представления, то есть до запросов к базе.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        self.retry_after = check_rate_limits(view.rate_limit_scope, request.data.get('phone_number'),
+                                             self.get_ident(request))
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,82 @@
+""" Выдача уникальных реферальных кодов без обращений к базе данных
+
+Код получается ключевой перестановкой порядкового номера (первичного ключа
+пользователя) по пространству всех 6-символьных кодов. Перестановка —
+сбалансированная сеть Фейстеля над двумя половинами по 36 ** 3 значений,
+поэтому разные номера всегда дают разные коды, а код нельзя предсказать
+по номеру без ключа.
+"""
+import functools
+import hashlib
+import string
+
+from django.conf import settings
+
+# Ключ по умолчанию из config/settings.py: публичный, подходит только для локального запуска
+DEFAULT_REFERRAL_CODE_KEY = 'authorization-service-referral-codes'
+
+REFERRAL_CODE_ALPHABET = string.ascii_uppercase + string.digits
+REFERRAL_CODE_LENGTH = 6
+
+_BASE = len(REFERRAL_CODE_ALPHABET)
+_HALF_SPACE = _BASE ** (REFERRAL_CODE_LENGTH // 2)
+# Число различных кодов; номер последовательности должен быть меньше этого значения
+CODE_SPACE = _HALF_SPACE * _HALF_SPACE
+_ALPHABET_INDEX = {char: index for index, char in enumerate(REFERRAL_CODE_ALPHABET)}
+
+
+class ReferralCodeAllocator:
+    """ Взаимно однозначное отображение номеров последовательности в реферальные коды """
+    rounds = 4
+
+    def __init__(self, key):
+        key = hashlib.sha256(key.encode() if isinstance(key, str) else key).digest()
+        # Раундовые функции заранее вычисляются для всех значений половины
+        self._round_tables = [self._build_round_table(key, round_number) for round_number in range(self.rounds)]
+
+    @staticmethod
+    def _build_round_table(key, round_number):
+        person = f'referral-{round_number}'.encode()
+        return [
+            int.from_bytes(hashlib.blake2b(value.to_bytes(2, 'big'), digest_size=4, key=key,
+                                           person=person).digest(), 'big') % _HALF_SPACE
+            for value in range(_HALF_SPACE)
+        ]
+
+    def permute(self, sequence):
+        """ Номер последовательности -> число в пространстве кодов """
+        if not 0 <= sequence < CODE_SPACE:
+            raise ValueError(f'Номер последовательности вне диапазона [0, {CODE_SPACE})')
+        left, right = divmod(sequence, _HALF_SPACE)
+        for table in self._round_tables:
+            left, right = right, (left + table[right]) % _HALF_SPACE
+        return left * _HALF_SPACE + right
+
+    def unpermute(self, value):
+        """ Обратная перестановка: число в пространстве кодов -> номер последовательности """
+        left, right = divmod(value, _HALF_SPACE)
+        for table in reversed(self._round_tables):
+            left, right = (right - table[left]) % _HALF_SPACE, left
+        return left * _HALF_SPACE + right
+
+    def code_for(self, sequence):
+        """ Реферальный код для номера последовательности """
+        value = self.permute(sequence)
+        chars = []
+        for _ in range(REFERRAL_CODE_LENGTH):
+            value, index = divmod(value, _BASE)
+            chars.append(REFERRAL_CODE_ALPHABET[index])
+        return ''.join(reversed(chars))
+
+    def sequence_for(self, code):
+        """ Номер последовательности, которому соответствует код """
+        value = 0
+        for char in code:
+            value = value * _BASE + _ALPHABET_INDEX[char]
+        return self.unpermute(value)
+
+
+@functools.lru_cache(maxsize=None)
+def get_referral_code_allocator():
+    """ Распределитель кодов с ключом из настройки REFERRAL_CODE_KEY """
+    return ReferralCodeAllocator(settings.REFERRAL_CODE_KEY)
@@ -0,0 +1,316 @@
+""" Активация реферальных кодов
+
+Успешная активация выполняется тремя запросами: условный UPDATE профиля,
+INSERT связей в таблицу замыкания ReferralClosure и UPDATE счётчиков
+пригласившего. Все правила — код ещё не активирован
+(WHERE activated_referral_code IS NULL), пригласивший существует, это не свой
+код и пригласивший не находится в поддереве профиля — проверяются в WHERE того
+же UPDATE, поэтому между проверкой и записью нет окна для гонки: из параллельных
+активаций одного профиля успешна ровно одна, остальные получают отказ. Причину
+отказа определяет отдельный SELECT, который выполняется только при неудаче.
+
+Массовая активация (bulk_activate_referral_codes) проверяет те же правила,
+загружая профили и коды пачками запросов с IN, и применяет допустимые
+активации частями, каждая в своей транзакции.
+
+Таблица замыкания хранит пару (предок, потомок, расстояние) для каждого
+профиля и каждого его предка, поэтому поддерево, цепочка пригласивших, размер
+и глубина поддерева выбираются одним запросом по индексу без рекурсии.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q, Case, When, Value, Exists, OuterRef, Count, Max
+from rest_framework.serializers import ValidationError
+
+from authorization_service.models import UserProfile, ReferralClosure
+from authorization_service.response_cache import invalidate_profile_responses
+from authorization_service.utils import increment_referral_counters
+from authorization_service.validators import PhoneNumberValidator
+
+# Результаты активации
+ACTIVATION_OK = 'activated'
+ACTIVATION_PROFILE_NOT_FOUND = 'profile_not_found'
+ACTIVATION_FORBIDDEN = 'forbidden'
+ACTIVATION_SELF_REFERRAL = 'self_referral'
+ACTIVATION_ALREADY_ACTIVATED = 'already_activated'
+ACTIVATION_CODE_NOT_FOUND = 'code_not_found'
+ACTIVATION_OTHER_CODE_ACTIVATED = 'other_code_activated'
+ACTIVATION_INVALID_PHONE_NUMBER = 'invalid_phone_number'
+ACTIVATION_CYCLE = 'referral_cycle'
+
+# Сообщения для результатов активации
+ACTIVATION_MESSAGES = {
+    ACTIVATION_OK: 'Вы успешно стали рефералом',
+    ACTIVATION_SELF_REFERRAL: 'Вы не можете использовать свой собственный реферальный код',
+    ACTIVATION_ALREADY_ACTIVATED: 'Вы уже активировали этот реферальный код',
+    ACTIVATION_CODE_NOT_FOUND: 'Профиль с таким реферальным кодом не найден',
+    ACTIVATION_OTHER_CODE_ACTIVATED: 'У вас уже активирован другой реферальный код',
+    ACTIVATION_PROFILE_NOT_FOUND: 'Профиль с таким номером телефона не найден',
+    ACTIVATION_INVALID_PHONE_NUMBER: 'Некорректный номер телефона',
+    ACTIVATION_CYCLE: 'Нельзя активировать код реферала из своего реферального дерева',
+}
+
+# Поля профиля, по которым проверяются правила активации
+ACTIVATION_FIELDS = ('pk', 'user_id', 'phone_number', 'user_referral_code', 'activated_referral_code')
+
+
+def check_activation(profile, referrer, referral_code, user_id=None):
+    """ Проверка правил активации по уже загруженным значениям профиля и пригласившего
+
+    profile и referrer — словари с полями pk, user_id, user_referral_code,
+    activated_referral_code (referrer может быть None) и, если известно,
+    in_subtree — находится ли пригласивший в поддереве профиля. Возвращает результат
+    ACTIVATION_*, где ACTIVATION_OK означает, что активация допустима.
+    """
+    if profile is None:
+        return ACTIVATION_PROFILE_NOT_FOUND
+    if user_id is not None and profile['user_id'] != user_id:
+        return ACTIVATION_FORBIDDEN
+    if referral_code == profile['user_referral_code']:
+        return ACTIVATION_SELF_REFERRAL
+    if profile['activated_referral_code'] == referral_code:
+        return ACTIVATION_ALREADY_ACTIVATED
+    if referrer is None:
+        return ACTIVATION_CODE_NOT_FOUND
+    if profile['activated_referral_code']:
+        return ACTIVATION_OTHER_CODE_ACTIVATED
+    if referrer.get('in_subtree'):
+        return ACTIVATION_CYCLE
+    return ACTIVATION_OK
+
+
+def lost_race_result(profile_id, referral_code):
+    """ Результат для профиля, который успел активировать код параллельный запрос """
+    activated_code = UserProfile.objects.filter(pk=profile_id).values_list('activated_referral_code', flat=True).first()
+    return ACTIVATION_ALREADY_ACTIVATED if activated_code == referral_code else ACTIVATION_OTHER_CODE_ACTIVATED
+
+
+def add_closure_rows(profile_ids):
+    """ Добавление в таблицу замыкания связей профилей profile_ids, только что получивших пригласившего
+
+    Одним INSERT ... SELECT: каждый предок пригласившего (и сам пригласивший)
+    становится предком профиля и всех его потомков.
+    """
+    profile_ids = list(profile_ids)
+    if not profile_ids:
+        return
+    profile_table = UserProfile._meta.db_table
+    closure_table = ReferralClosure._meta.db_table
+    placeholders = ', '.join(['%s'] * len(profile_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH pairs AS ('
+            f'SELECT r.id AS ancestor_id, p.id AS descendant_id FROM {profile_table} p '
+            f'JOIN {profile_table} r ON r.user_id = p.referrer_id WHERE p.id IN ({placeholders})) '
+            f'INSERT INTO {closure_table} (ancestor_id, descendant_id, depth) '
+            f'SELECT pairs.ancestor_id, pairs.descendant_id, 1 FROM pairs '
+            f'UNION ALL SELECT a.ancestor_id, pairs.descendant_id, a.depth + 1 FROM pairs '
+            f'JOIN {closure_table} a ON a.descendant_id = pairs.ancestor_id '
+            f'UNION ALL SELECT pairs.ancestor_id, d.descendant_id, d.depth + 1 FROM pairs '
+            f'JOIN {closure_table} d ON d.ancestor_id = pairs.descendant_id '
+            f'UNION ALL SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1 FROM pairs '
+            f'JOIN {closure_table} a ON a.descendant_id = pairs.ancestor_id '
+            f'JOIN {closure_table} d ON d.ancestor_id = pairs.descendant_id',
+            profile_ids
+        )
+
+
+def _conditional_activation(profile_id, referral_code, user_id=None):
+    """ Условный UPDATE профиля с проверкой всех правил активации в WHERE
+
+    Пригласивший выбирается подзапросом по коду, проверка цикла (пригласивший в
+    поддереве профиля) выполняется тем же оператором, что и запись, поэтому между
+    проверкой и записью нет окна для параллельной активации. Возвращает
+    (номер телефона профиля, pk пригласившего) или None, если профиль не обновлён.
+    """
+    profile_table = UserProfile._meta.db_table
+    closure_table = ReferralClosure._meta.db_table
+    owner_condition = 'AND user_id = %s ' if user_id is not None else ''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {profile_table} SET activated_referral_code = %s, '
+            f'referrer_id = (SELECT r.user_id FROM {profile_table} r WHERE r.user_referral_code = %s) '
+            f'WHERE id = %s AND activated_referral_code IS NULL AND user_referral_code <> %s {owner_condition}'
+            f'AND EXISTS (SELECT 1 FROM {profile_table} r WHERE r.user_referral_code = %s) '
+            f'AND NOT EXISTS (SELECT 1 FROM {closure_table} c JOIN {profile_table} r ON r.id = c.descendant_id '
+            f'WHERE c.ancestor_id = %s AND r.user_referral_code = %s) '
+            f'RETURNING phone_number, (SELECT r.id FROM {profile_table} r WHERE r.user_referral_code = %s)',
+            [referral_code, referral_code, profile_id, referral_code,
+             *([user_id] if user_id is not None else []),
+             referral_code, profile_id, referral_code, referral_code]
+        )
+        return cursor.fetchone()
+
+
+def activation_failure(profile_id, referral_code, user_id=None):
+    """ Причина, по которой условный UPDATE не активировал код: результат ACTIVATION_* """
+    rows = UserProfile.objects.filter(Q(pk=profile_id) | Q(user_referral_code=referral_code)).annotate(
+        in_subtree=Exists(ReferralClosure.objects.filter(ancestor_id=profile_id, descendant_id=OuterRef('pk')))
+    ).values(*ACTIVATION_FIELDS, 'in_subtree')
+    profile = referrer = None
+    for row in rows:
+        if row['pk'] == profile_id:
+            profile = row
+        if row['user_referral_code'] == referral_code:
+            referrer = row
+    result = check_activation(profile, referrer, referral_code, user_id)
+    # Правила выполняются, но UPDATE не прошёл: состояние изменил параллельный запрос
+    return lost_race_result(profile_id, referral_code) if result == ACTIVATION_OK else result
+
+
+def activate_referral_code(profile_id, referral_code, user_id=None):
+    """ Активация реферального кода в профиле profile_id
+
+    Если передан user_id, профиль должен принадлежать этому пользователю.
+    Возвращает результат ACTIVATION_*.
+    """
+    try:
+        profile_id = int(profile_id)
+    except (TypeError, ValueError):
+        return ACTIVATION_PROFILE_NOT_FOUND
+
+    with transaction.atomic():
+        activated = _conditional_activation(profile_id, referral_code, user_id)
+        if activated is None:
+            return activation_failure(profile_id, referral_code, user_id)
+        phone_number, referrer_pk = activated
+        add_closure_rows([profile_id])
+        increment_referral_counters(referrer_pk, [phone_number])
+    invalidate_profile_responses([profile_id])
+    return ACTIVATION_OK
+
+
+def _load_rows(field, values, chunk_size):
+    """ Строки профилей с значением field из values: словарь значение -> строка, по запросу на chunk_size значений """
+    values = list(values)
+    rows = {}
+    for start in range(0, len(values), chunk_size):
+        for row in UserProfile.objects.filter(**{f'{field}__in': values[start:start + chunk_size]}).values(
+                *ACTIVATION_FIELDS):
+            rows[row[field]] = row
+    return rows
+
+
+def _apply_activations(activations):
+    """ Применение части активаций в одной транзакции
+
+    activations — список (строка профиля, строка пригласившего, код). Профили,
+    код в которых успел активировать параллельный запрос, пропускаются.
+    Активации, где пригласивший — профиль этой же части или потомок одного из
+    них, применяются по одной с проверкой цикла; остальные — одним UPDATE.
+    Возвращает (множество pk активированных профилей, множество pk профилей,
+    активация которых замкнула бы цикл).
+    """
+    profile_ids = [profile['pk'] for profile, _, _ in activations]
+    with transaction.atomic():
+        # Блокировка строк: после проверки их не изменит параллельная активация
+        free_ids = set(UserProfile.objects.select_for_update().filter(
+            pk__in=profile_ids, activated_referral_code__isnull=True).values_list('pk', flat=True))
+        activations = [activation for activation in activations if activation[0]['pk'] in free_ids]
+        if not activations:
+            return set(), set()
+        # Пригласившие, находящиеся в поддеревьях профилей этой части
+        nested_ids = set(ReferralClosure.objects.filter(
+            ancestor_id__in=free_ids, descendant_id__in={referrer['pk'] for _, referrer, _ in activations}
+        ).values_list('descendant_id', flat=True))
+        independent, dependent = [], []
+        for activation in activations:
+            referrer_pk = activation[1]['pk']
+            is_dependent = referrer_pk in free_ids or referrer_pk in nested_ids
+            (dependent if is_dependent else independent).append(activation)
+
+        activated, cycles = set(), set()
+        if independent:
+            independent_ids = {profile['pk'] for profile, _, _ in independent}
+            UserProfile.objects.filter(pk__in=independent_ids, activated_referral_code__isnull=True).update(
+                activated_referral_code=Case(*(When(pk=profile['pk'], then=Value(code))
+                                               for profile, _, code in independent)),
+                referrer_id=Case(*(When(pk=profile['pk'], then=Value(referrer['user_id']))
+                                   for profile, referrer, _ in independent)),
+            )
+            add_closure_rows(independent_ids)
+            activated |= independent_ids
+        for profile, referrer, code in dependent:
+            if ReferralClosure.objects.filter(ancestor_id=profile['pk'], descendant_id=referrer['pk']).exists():
+                cycles.add(profile['pk'])
+                continue
+            UserProfile.objects.filter(pk=profile['pk']).update(
+                activated_referral_code=code, referrer_id=referrer['user_id'])
+            add_closure_rows([profile['pk']])
+            activated.add(profile['pk'])
+
+        phone_numbers_by_referrer = defaultdict(list)
+        for profile, referrer, _ in activations:
+            if profile['pk'] in activated:
+                phone_numbers_by_referrer[referrer['pk']].append(profile['phone_number'])
+        for referrer_pk, phone_numbers in phone_numbers_by_referrer.items():
+            increment_referral_counters(referrer_pk, phone_numbers)
+    invalidate_profile_responses(activated)
+    return activated, cycles
+
+
+def bulk_activate_referral_codes(pairs, chunk_size=500):
+    """ Массовая активация кодов по парам (номер телефона, реферальный код)
+
+    Правила те же, что у activate_referral_code: нельзя активировать свой код
+    и больше одного кода на профиль. Если номер встречается в нескольких парах,
+    применяется первая допустимая. Возвращает список результатов ACTIVATION_*
+    в порядке пар.
+    """
+    validator = PhoneNumberValidator()
+    results = [None] * len(pairs)
+    normalized = []
+    for index, (phone_number, referral_code) in enumerate(pairs):
+        try:
+            normalized.append((index, validator(phone_number), referral_code))
+        except ValidationError:
+            results[index] = ACTIVATION_INVALID_PHONE_NUMBER
+
+    profiles = _load_rows('phone_number', {phone_number for _, phone_number, _ in normalized}, chunk_size)
+    referrers = _load_rows('user_referral_code', {code for _, _, code in normalized}, chunk_size)
+
+    planned = []
+    for index, phone_number, referral_code in normalized:
+        profile = profiles.get(phone_number)
+        results[index] = check_activation(profile, referrers.get(referral_code), referral_code)
+        if results[index] == ACTIVATION_OK:
+            # Последующие пары с этим номером проверяются уже с учётом активации
+            profile['activated_referral_code'] = referral_code
+            planned.append((index, profile, referrers[referral_code], referral_code))
+
+    for start in range(0, len(planned), chunk_size):
+        chunk = planned[start:start + chunk_size]
+        activated, cycles = _apply_activations([activation[1:] for activation in chunk])
+        for index, profile, _, referral_code in chunk:
+            if profile['pk'] in cycles:
+                results[index] = ACTIVATION_CYCLE
+            elif profile['pk'] not in activated:
+                results[index] = lost_race_result(profile['pk'], referral_code)
+    return results
+
+
+def get_referral_tree(profile_id, depth, max_nodes):
+    """ Реферальное дерево профиля по таблице замыкания
+
+    Возвращает словарь: ancestors — цепочка пригласивших от ближайшего, не глубже
+    depth; descendants — потомки не глубже depth по уровням, не больше max_nodes;
+    truncated — были ли отброшены потомки сверх max_nodes; subtree_size
+    и max_depth — размер и глубина всего поддерева.
+    """
+    ancestors = ReferralClosure.objects.filter(descendant_id=profile_id, depth__lte=depth).order_by(
+        'depth').values_list('ancestor_id', 'ancestor__phone_number', 'depth')
+    descendants = list(ReferralClosure.objects.filter(ancestor_id=profile_id, depth__lte=depth).order_by(
+        'depth', 'descendant_id').values_list('descendant_id', 'descendant__phone_number', 'depth',
+                                              'descendant__referrer__username')[:max_nodes + 1])
+    stats = ReferralClosure.objects.filter(ancestor_id=profile_id).aggregate(
+        subtree_size=Count('id'), max_depth=Max('depth'))
+    return {
+        'ancestors': [{'id': pk, 'phone_number': phone_number, 'depth': level}
+                      for pk, phone_number, level in ancestors],
+        'descendants': [{'id': pk, 'phone_number': phone_number, 'depth': level, 'referred_by': referred_by}
+                        for pk, phone_number, level, referred_by in descendants[:max_nodes]],
+        'truncated': len(descendants) > max_nodes,
+        'subtree_size': stats['subtree_size'],
+        'max_depth': stats['max_depth'] or 0,
+    }
@@ -0,0 +1,132 @@
+""" Кэширование ответов чтения профилей с ETag
+
+Ответы list и retrieve хранятся в кэше Django под ключом из действия, id
+профиля, параметров запроса, формата ответа и id пользователя. Ключ включает
+номера поколений: при изменении профиля увеличиваются поколение списков и
+поколение этого профиля, при изменении пользователя — поколение пользователей.
+Старые записи после этого не читаются и вытесняются по времени жизни, поэтому
+инвалидация не требует перебора ключей и работает с любым бэкендом кэша,
+включая LocMemCache.
+
+Ответ, прочитанный с реплики, хранится не дольше окна чтения с основной
+базы после записи (DATABASE_ROUTING['STICKY_SECONDS']): реплика могла ещё
+не получить изменение, после которого сменилось поколение.
+
+Каждый ответ получает сильный ETag — хэш его данных. На запрос с совпадающим
+If-None-Match возвращается 304 без обращения к базе и сериализации.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from authorization_service.db_router import reading_from_replica
+
+GENERATION_KEY_PREFIX = 'profile_response_generation'
+RESPONSE_KEY_PREFIX = 'profile_response'
+
+
+def _generation_key(name):
+    return f'{GENERATION_KEY_PREFIX}:{name}'
+
+
+def bump_generations(*names):
+    """ Увеличение поколений; отсутствующее поколение начинается с текущего времени в мс,
+    чтобы после вытеснения счётчика не вернуться к уже использованному значению """
+    for name in names:
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+def get_generations(*names):
+    """ Текущие номера поколений одним обращением к кэшу """
+    values = cache.get_many([_generation_key(name) for name in names])
+    return tuple(values.get(_generation_key(name), 0) for name in names)
+
+
+def bump_generations_now_and_on_commit(*names):
+    """ Увеличение поколений сразу и ещё раз после фиксации транзакции
+
+    Иначе ответ, собранный другим запросом до фиксации (по старым данным),
+    мог бы сохраниться под уже новым поколением.
+    """
+    bump_generations(*names)
+    transaction.on_commit(lambda: bump_generations(*names))
+
+
+def invalidate_profile_responses(profile_ids=()):
+    """ Сброс кэшированных списков профилей и ответов для указанных профилей """
+    bump_generations_now_and_on_commit('list', *(f'profile:{profile_id}' for profile_id in profile_ids))
+
+
+def invalidate_user_responses():
+    """ Сброс всех кэшированных ответов: в них выводятся имена пользователей """
+    bump_generations_now_and_on_commit('users')
+
+
+def dump_response_data(data):
+    """ Данные ответа в виде JSON для хранения в кэше и сильный ETag по ним """
+    payload = json.dumps(data, cls=JSONEncoder, sort_keys=True, ensure_ascii=False)
+    return payload, '"%s"' % hashlib.sha256(payload.encode()).hexdigest()[:40]
+
+
+class ProfileResponseCacheMixin:
+    """ Кэширование ответов list и retrieve ViewSet'а профилей с поддержкой If-None-Match """
+
+    def get_response_cache_key(self, request):
+        if self.action == 'list':
+            generations = get_generations('list', 'users')
+        else:
+            generations = get_generations(f'profile:{self.kwargs.get(self.lookup_field)}', 'users')
+        params = hashlib.md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()
+        media_type = request.accepted_renderer.media_type if hasattr(request, 'accepted_renderer') else ''
+        user_id = request.user.pk if request.user.is_authenticated else 'anonymous'
+        return (f'{RESPONSE_KEY_PREFIX}:{self.action}:{self.kwargs.get(self.lookup_field, "")}:'
+                f'{request.get_host()}:{media_type}:{user_id}:{params}:'
+                f'{":".join(str(generation) for generation in generations)}')
+
+    @staticmethod
+    def etag_matches(request, etag):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        return bool(if_none_match) and ('*' in parse_etags(if_none_match) or etag in parse_etags(if_none_match))
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.PROFILE_RESPONSE_CACHE['ENABLED']:
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            etag, payload = cached
+            if self.etag_matches(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            return Response(json.loads(payload), headers={'ETag': etag})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        payload, etag = dump_response_data(response.data)
+        timeout = settings.PROFILE_RESPONSE_CACHE['TIMEOUT']
+        if reading_from_replica():
+            timeout = min(timeout, settings.DATABASE_ROUTING['STICKY_SECONDS'])
+        cache.set(key, (etag, payload), timeout)
+        if self.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
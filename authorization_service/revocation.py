@@ -0,0 +1,179 @@
+""" Отзыв JWT без таблиц blacklist simplejwt
+
+Отзываются идентификаторы токенов (jti) и сессий входа (sid — общий для
+всех токенов, выданных по одному вводу кода, включая обновлённые). Запись
+об отзыве хранится до истечения срока токена: после него токен отклоняется
+и без неё, поэтому хранилище не растёт без ограничения.
+
+Проверка токена на каждом запросе — одно обращение к хранилищу (кэшу или
+памяти процесса) без запросов к базе. Бэкенд задаётся настройкой
+TOKEN_REVOCATION и проверяется при запуске приложения: хранилище, из
+которого отзыв может пропасть раньше срока, не принимается.
+"""
+import functools
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.settings import api_settings
+
+
+# Кэши, не общие для процессов или вытесняющие записи при заполнении: отзыв из них может пропасть до срока
+UNSUITABLE_CACHE_BACKENDS = (LocMemCache, DummyCache, FileBasedCache, DatabaseCache, BaseMemcachedCache)
+
+
+def _compact(identifier):
+    """ jti и sid — 32 шестнадцатеричных символа uuid4; в памяти процесса они хранятся 16 байтами """
+    try:
+        return bytes.fromhex(identifier)
+    except (TypeError, ValueError):
+        return identifier
+
+
+class BaseTokenRevocationStore:
+    """ Базовое хранилище отозванных идентификаторов токенов и сессий """
+
+    def revoke(self, identifier, expires_at):
+        """ Отзыв идентификатора до момента expires_at (Unix-время)
+
+        Возвращает False, если идентификатор уже был отозван: так из
+        нескольких одновременных обновлений одного refresh-токена проходит одно.
+        """
+        raise NotImplementedError
+
+    def is_revoked(self, *identifiers):
+        """ Отозван ли хотя бы один из идентификаторов """
+        raise NotImplementedError
+
+    def check(self):
+        """ Проверка настройки хранилища; ImproperlyConfigured, если отзыв может пропасть до срока """
+
+
+class LocMemTokenRevocationStore(BaseTokenRevocationStore):
+    """ Множество отозванных идентификаторов со сроком жизни в памяти процесса
+
+    Проверка читает словарь без блокировки; просроченные записи удаляются
+    при следующих отзывах в порядке истечения (куча). Отзыв действует только
+    в своём процессе, поэтому подходит лишь для запуска в одном процессе.
+    """
+
+    def __init__(self):
+        self._expires = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def revoke(self, identifier, expires_at):
+        key = _compact(identifier)
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expired_at, expired_key = heapq.heappop(self._heap)
+                if self._expires.get(expired_key) == expired_at:
+                    del self._expires[expired_key]
+            current = self._expires.get(key)
+            if current is not None and current > now:
+                return False
+            self._expires[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+        return True
+
+    def is_revoked(self, *identifiers):
+        now = time.time()
+        for identifier in identifiers:
+            expires_at = self._expires.get(_compact(identifier))
+            if expires_at is not None and expires_at > now:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self._expires)
+
+    def clear(self):
+        """ Удаление всех записей """
+        with self._lock:
+            self._expires.clear()
+            self._heap.clear()
+
+
+class CacheTokenRevocationStore(BaseTokenRevocationStore):
+    """ Отозванные идентификаторы в кэше Django: отзыв виден всем процессам, использующим этот кэш
+
+    Запись живёт до истечения срока токена; атомарность revoke обеспечивает cache.add.
+    Кэш должен быть общим и не вытеснять записи (Redis с maxmemory-policy
+    noeviction): иначе вытесненный отзыв снова делает токен действительным.
+    """
+
+    def __init__(self, cache_alias='token_revocation', key_prefix='revoked_token'):
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, identifier):
+        return f'{self.key_prefix}:{identifier}'
+
+    def revoke(self, identifier, expires_at):
+        timeout = expires_at - time.time()
+        if timeout <= 0:
+            return True
+        return self.cache.add(self._key(identifier), 1, timeout=max(1, int(timeout) + 1))
+
+    def is_revoked(self, *identifiers):
+        if len(identifiers) == 1:
+            return self.cache.get(self._key(identifiers[0])) is not None
+        return bool(self.cache.get_many([self._key(identifier) for identifier in identifiers]))
+
+    def check(self):
+        if isinstance(self.cache, UNSUITABLE_CACHE_BACKENDS):
+            raise ImproperlyConfigured(
+                f'Кэш {self.cache_alias!r} ({type(self.cache).__name__}) не подходит для отзыва токенов: он не общий '
+                f'для процессов или вытесняет записи. Используйте Redis с maxmemory-policy noeviction или, '
+                f'при запуске в одном процессе, LocMemTokenRevocationStore'
+            )
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_revocation_store():
+    """ Хранилище, заданное в настройке TOKEN_REVOCATION, после проверки его настройки """
+    config = settings.TOKEN_REVOCATION
+    store = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    store.check()
+    return store
+
+
+def token_identifiers(token):
+    """ Идентификаторы токена, по которым он может быть отозван: jti и, если есть, sid """
+    return tuple(identifier for identifier in (token.get('jti'), token.get('sid')) if identifier)
+
+
+def is_token_revoked(token):
+    """ Отозван ли токен или его сессия """
+    return get_token_revocation_store().is_revoked(*token_identifiers(token))
+
+
+def revoke_token(token):
+    """ Отзыв токена до истечения его срока; False, если он уже отозван """
+    return get_token_revocation_store().revoke(token['jti'], token['exp'])
+
+
+def revoke_session(token):
+    """ Отзыв всех токенов сессии token; у токенов без sid отзывается только сам токен
+
+    Обновлённые refresh-токены сессии живут дольше предъявленного, поэтому
+    сессия отзывается на полный срок refresh-токена от текущего момента.
+    """
+    if token.get('sid'):
+        expires_at = time.time() + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+        get_token_revocation_store().revoke(token['sid'], expires_at)
+    revoke_token(token)
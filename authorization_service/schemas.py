@@ -0,0 +1,118 @@
+""" Описание эндпоинтов для документации drf_yasg
+
+Модуль импортируется только при включённой документации (API_DOCS_ENABLED),
+поэтому без неё drf_yasg не загружается в воркеры.
+"""
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from authorization_service.views import UserProfileLoginAPI, InputVerificationCodeAPI, LogoutAPI, UserProfileViewSet
+
+
+def apply_swagger_schemas():
+    """ Привязка описаний к методам представлений """
+    swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'phone_number': openapi.Schema(type=openapi.TYPE_STRING,
+                                               description='Номер телефона в формате +79999999999'),
+            }
+        ),
+        responses={200: 'OK', 400: 'Invalid Request'},
+        operation_description='Представление для входа в аккаунт и получения кода верификации'
+    )(UserProfileLoginAPI.post)
+
+    swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'phone_number': openapi.Schema(type=openapi.TYPE_STRING,
+                                               description='Номер телефона в формате +79999999999'),
+                'entered_code': openapi.Schema(type=openapi.TYPE_STRING,
+                                               description='Код верификации, полученный по СМС')
+            }
+        ),
+        responses={200: 'OK: access_token и refresh_token', 400: 'Invalid Request'},
+        operation_description='Представление для ввода кода верификации'
+    )(InputVerificationCodeAPI.post)
+
+    swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'refresh_token': openapi.Schema(type=openapi.TYPE_STRING,
+                                                description='Refresh-токен сессии (необязателен при запросе '
+                                                            'с access-токеном)')
+            }
+        ),
+        responses={200: 'OK', 400: 'Invalid Request'},
+        operation_description='Выход: отзыв всех токенов сессии'
+    )(LogoutAPI.post)
+
+    swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'referral_code': openapi.Schema(type=openapi.TYPE_STRING, description='Реферальный код')
+            }
+        ),
+        responses={200: 'OK', 400: 'Invalid Request'},
+        operation_description='Обновление профиля пользователя'
+    )(UserProfileViewSet.update)
+
+    swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'items': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'phone_number': openapi.Schema(type=openapi.TYPE_STRING,
+                                                           description='Номер телефона в формате +79999999999'),
+                            'referral_code': openapi.Schema(type=openapi.TYPE_STRING, description='Реферальный код'),
+                        }
+                    )
+                )
+            }
+        ),
+        responses={200: 'OK', 400: 'Invalid Request', 403: 'Forbidden'},
+        operation_description='Массовая активация реферальных кодов (только для администраторов)'
+    )(UserProfileViewSet.bulk_activate)
+
+    swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('depth', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description='Глубина дерева в обе стороны (по умолчанию 3)'),
+        ],
+        responses={200: 'OK', 400: 'Invalid Request', 404: 'Not Found'},
+        operation_description='Реферальное дерево профиля: цепочка пригласивших, рефералы всех уровней '
+                              'до заданной глубины, размер и глубина поддерева'
+    )(UserProfileViewSet.referral_tree)
+
+    swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description='Число профилей в топе (по умолчанию 10)'),
+        ],
+        responses={200: 'OK', 400: 'Invalid Request'},
+        operation_description='Топ пригласивших по числу рефералов'
+    )(UserProfileViewSet.leaderboard)
+
+    swagger_auto_schema(
+        responses={200: 'OK', 404: 'Not Found'},
+        operation_description='Место профиля в рейтинге пригласивших'
+    )(UserProfileViewSet.leaderboard_rank)
+
+    swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['ndjson', 'csv'],
+                              description='Формат выгрузки (по умолчанию ndjson)'),
+            openapi.Parameter('dataset', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['profiles', 'edges'],
+                              description='Профили или реферальные связи (по умолчанию profiles)'),
+        ],
+        responses={200: 'OK', 400: 'Invalid Request', 403: 'Forbidden'},
+        operation_description='Потоковая выгрузка профилей или реферальных связей (только для администраторов)'
+    )(UserProfileViewSet.export)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from authorization_service.models import UserProfile
 
@@ -14,15 +15,30 @@ class UserProfileSerializer(serializers.ModelSerializer):
             return None
 
     def get_referred_users(self, obj):
-        user_referral_code = obj.user_referral_code
-        if user_referral_code:
-            referred_users = UserProfile.objects.filter(activated_referral_code=user_referral_code).exclude(user=obj.user)
-            if referred_users.exists():
-                return [user.user.username for user in referred_users]
-        return None
+        if settings.REFERRAL_CACHE_PHONE_NUMBERS:
+            return obj.referred_phone_number_list or None
+        # Список рефералов заранее загружается в UserProfileViewSet.get_queryset
+        referred_profiles = getattr(obj.user, 'referred_profiles', None)
+        if referred_profiles is None:
+            referred_profiles = obj.user.referrals.select_related('user').order_by('id')
+        referred_users = [profile.user.username for profile in referred_profiles if profile.user_id != obj.user_id]
+        return referred_users or None
 
     class Meta:
         """Мета-данные"""
         model = UserProfile
-        fields = ['id', 'phone_number', 'user_referral_code', 'user_referred_code_used', 'referred_users', 'activated_referral_code', 'referred_by']
+        fields = ['id', 'phone_number', 'user_referral_code', 'user_referred_code_used', 'referral_count',
+                  'referred_users', 'activated_referral_code', 'referred_by']
+        read_only_fields = ['referral_count']
 
+
+class ReferralActivationItemSerializer(serializers.Serializer):
+    """Сериализатор пары номер телефона - реферальный код для массовой активации"""
+    phone_number = serializers.CharField(max_length=32)
+    referral_code = serializers.CharField(max_length=8)
+
+
+class BulkReferralActivationSerializer(serializers.Serializer):
+    """Сериализатор запроса массовой активации реферальных кодов"""
+    items = serializers.ListField(child=ReferralActivationItemSerializer(), allow_empty=False,
+                                  max_length=settings.REFERRAL_BULK_ACTIVATION['MAX_ITEMS'])
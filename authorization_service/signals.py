@@ -0,0 +1,43 @@
+""" Обработчики сигналов приложения authorization_service """
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authorization_service.authentication import invalidate_cached_user
+from authorization_service.models import UserProfile
+from authorization_service.response_cache import invalidate_profile_responses, invalidate_user_responses
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_jwt_user_cache(sender, instance, **kwargs):
+    """ Сброс пользователя в кэше JWT-аутентификации при изменении или удалении """
+    invalidate_cached_user(instance.pk)
+
+
+# Поля пользователя, которые выводятся в ответах профилей
+DISPLAYED_USER_FIELDS = frozenset(['username'])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_response_cache_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """ Сброс кэшированных ответов профилей при изменении выводимых полей пользователя
+
+    Новый пользователь ещё не выводится ни в одном ответе: списки сбросит создание
+    его профиля. Сохранения только невыводимых полей (например, last_login при
+    входе) кэш не сбрасывают.
+    """
+    if created or (update_fields is not None and not DISPLAYED_USER_FIELDS & update_fields):
+        return
+    invalidate_user_responses()
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_response_cache_on_delete(sender, instance, **kwargs):
+    """ Сброс кэшированных ответов профилей при удалении пользователя """
+    invalidate_user_responses()
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile_response_cache(sender, instance, **kwargs):
+    """ Сброс кэшированных ответов при изменении или удалении профиля """
+    invalidate_profile_responses([instance.pk])
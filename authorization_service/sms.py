@@ -0,0 +1,216 @@
+""" Отправка СМС через очередь в памяти процесса
+
+Представления только ставят сообщение в очередь и сразу отвечают. Фоновый
+поток-диспетчер забирает сообщения пачками, отправляет пачку одним вызовом
+провайдера и при ошибке откладывает пачку на повтор с экспоненциальной
+задержкой. Ожидание повтора не останавливает отправку новых сообщений:
+диспетчер ждёт новые сообщения до срока ближайшего повтора.
+Если очередь заполнена, постановка завершается ошибкой 503, а не ожиданием.
+Провайдер и параметры очереди задаются настройкой SMS_DISPATCHER.
+"""
+import collections
+import functools
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+SmsMessage = collections.namedtuple('SmsMessage', ['phone_number', 'text'])
+
+# Сигнал остановки для потока-диспетчера
+_STOP = object()
+
+
+class SmsQueueFull(APIException):
+    """ Очередь исходящих СМС заполнена """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис отправки СМС перегружен, повторите попытку позже'
+    default_code = 'sms_queue_full'
+
+
+class BaseSmsProvider:
+    """ Базовый провайдер СМС: отправляет пачку сообщений одним вызовом """
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+class ConsoleSmsProvider(BaseSmsProvider):
+    """ Провайдер для локального запуска: выводит сообщения в консоль """
+
+    def send_batch(self, messages):
+        for message in messages:
+            print(f'СМС на номер {message.phone_number}: {message.text}')
+
+
+class FakeSmsProvider(BaseSmsProvider):
+    """ Провайдер для тестов: складывает пачки в outbox, первые fail_times вызовов завершаются ошибкой """
+
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.calls = 0
+        self.batches = []
+
+    @property
+    def outbox(self):
+        return [message for batch in self.batches for message in batch]
+
+    def send_batch(self, messages):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise ConnectionError('Провайдер СМС недоступен')
+        self.batches.append(list(messages))
+
+
+class SmsDispatcher:
+    """ Очередь исходящих СМС с фоновой пакетной отправкой """
+
+    def __init__(self, provider, queue_size=10000, batch_size=100, batch_wait=0.05,
+                 max_retries=3, retry_backoff=0.5):
+        self.provider = provider
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.sent = 0
+        self.failed = 0
+        # Пачки, ожидающие повтора: куча (время повтора, номер, попытка, сообщения); её меняет только диспетчер
+        self._retries = []
+        self._retry_numbers = itertools.count()
+        self._retrying = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """ Запуск потока-диспетчера при первой отправке и заново в дочернем процессе после fork """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Очередь и повторы родительского процесса после fork не используются: их отправит родитель
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._retries = []
+                self._retrying = 0
+            self._thread = threading.Thread(target=self._run, name='sms-dispatcher', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, phone_number, text):
+        """ Постановка сообщения в очередь без ожидания отправки """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(SmsMessage(phone_number, text))
+        except queue.Full:
+            logger.warning('Очередь СМС заполнена, сообщение на номер %s отклонено', phone_number)
+            raise SmsQueueFull()
+
+    def flush(self):
+        """ Ожидание отправки всех сообщений, поставленных в очередь, включая повторы """
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """ Отправка оставшихся сообщений (с ожиданием их повторов) и остановка потока-диспетчера """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _collect_batch(self, first):
+        """ Пачка из первого сообщения и тех, что успели прийти за batch_wait секунд """
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(message)
+            if message is _STOP:
+                break
+        return batch
+
+    def _run(self):
+        stopping = False
+        while True:
+            self._retry_due()
+            if stopping and not self._retries:
+                return
+            timeout = max(0, self._retries[0][0] - time.monotonic()) if self._retries else None
+            if stopping:
+                # Новые сообщения после остановки не принимаются, остаётся дождаться повторов
+                time.sleep(timeout)
+                continue
+            try:
+                first = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            batch = self._collect_batch(first)
+            if batch[-1] is _STOP:
+                stopping = True
+                batch.pop()
+                self._queue.task_done()
+            if batch:
+                self._deliver(batch, 0)
+
+    def _retry_due(self):
+        """ Повтор пачек, срок повтора которых наступил """
+        while self._retries and self._retries[0][0] <= time.monotonic():
+            _, _, attempt, messages = heapq.heappop(self._retries)
+            self._retrying -= len(messages)
+            self._deliver(messages, attempt)
+
+    def _deliver(self, messages, attempt):
+        """ Одна попытка отправки пачки; при ошибке пачка откладывается на повтор, пока не исчерпаны попытки
+
+        Сообщения пачки считаются обработанными очередью (task_done) только после
+        успешной отправки или отказа, поэтому flush ждёт и отложенные повторы.
+        """
+        try:
+            self.provider.send_batch(messages)
+        except Exception:
+            if attempt == self.max_retries or self._retrying + len(messages) > self.queue_size:
+                logger.exception('Не удалось отправить %d СМС после %d попыток', len(messages), attempt + 1)
+                self.failed += len(messages)
+            else:
+                retry_at = time.monotonic() + self.retry_backoff * 2 ** attempt
+                heapq.heappush(self._retries, (retry_at, next(self._retry_numbers), attempt + 1, messages))
+                self._retrying += len(messages)
+                return
+        else:
+            self.sent += len(messages)
+        for _ in messages:
+            self._queue.task_done()
+
+
+@functools.lru_cache(maxsize=None)
+def get_sms_dispatcher():
+    """ Диспетчер СМС с провайдером из настройки SMS_DISPATCHER """
+    config = settings.SMS_DISPATCHER
+    provider = import_string(config['PROVIDER'])(**config.get('PROVIDER_OPTIONS', {}))
+    return SmsDispatcher(provider, **config.get('OPTIONS', {}))
+
+
+def send_verification_code(phone_number, code):
+    """ Отправка кода верификации на номер телефона """
+    get_sms_dispatcher().enqueue(phone_number, f'Код верификации: {code}')
+
+
+def send_password(phone_number, password):
+    """ Отправка пароля на номер телефона """
+    get_sms_dispatcher().enqueue(phone_number, f'Пароль для входа: {password}')
@@ -1,12 +1,59 @@
 """ Тесты для authorization_service """
+import csv
+import gc
+import importlib
+import json
+import sqlite3
+import threading
+import time
+from io import StringIO
+
 import pytest
-from rest_framework.exceptions import ErrorDetail
-from rest_framework.test import APIClient
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction, IntegrityError, OperationalError
+from django.test import AsyncClient, AsyncRequestFactory, Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.tokens import AccessToken
 
-from authorization_service.models import UserProfile
-from authorization_service.utils import get_verification_code_from_db
+from authorization_service.checks import check_referral_code_key
+from authorization_service.authentication import CachedJWTAuthentication, user_version_key
+from authorization_service.ratelimit import LocMemRateLimitBackend, CacheRateLimitBackend
+from authorization_service.revocation import LocMemTokenRevocationStore, CacheTokenRevocationStore, \
+    get_token_revocation_store
+from authorization_service.sms import get_sms_dispatcher, SmsDispatcher, FakeSmsProvider, SmsMessage, \
+    SmsQueueFull
+from authorization_service.tokens import UserClaimsRefreshToken
+from authorization_service.async_views import AsyncUserProfileLoginAPI, AsyncInputVerificationCodeAPI
+from authorization_service.loadgen import synthesize_records, read_records, prepare_records, group_sessions, \
+    run_threads, run_processes, run_asyncio, summarize, percentile
+from authorization_service.leaderboard import FenwickTree, LocMemLeaderboard, CacheLeaderboard, \
+    get_leaderboard, reconcile_leaderboard
+from authorization_service.db_router import ReplicaRouter
+from authorization_service.metrics import MetricsRegistry, registry
+from authorization_service.response_cache import get_generations
+from authorization_service.models import UserProfile, ReferralClosure
+from authorization_service.referrals import activate_referral_code, bulk_activate_referral_codes, ACTIVATION_OK, \
+    ACTIVATION_OTHER_CODE_ACTIVATED, ACTIVATION_CYCLE
+from authorization_service.utils import get_password_hashing_executor, generate_referral_code, \
+    create_phone_user_profile
+from authorization_service.validators import PhoneNumberValidator
+from authorization_service.warmup import warmup
+from authorization_service.referral_codes import ReferralCodeAllocator, get_referral_code_allocator, CODE_SPACE, \
+    REFERRAL_CODE_ALPHABET, REFERRAL_CODE_LENGTH, DEFAULT_REFERRAL_CODE_KEY
+from authorization_service.code_store import get_verification_code_store, LocMemVerificationCodeStore, \
+    CacheVerificationCodeStore, CODE_VERIFIED, CODE_INVALID, CODE_EXPIRED, CODE_ATTEMPTS_EXCEEDED
+from benchmarks.bench_e2e import DEFAULT_BASELINE
+from benchmarks.e2e import QUERY_BUDGETS, QUERY_FIELDS, run_flows, create_referrer, check_query_budgets, \
+    compare_with_baseline, split_summary
 from users.models import User
+from users.views import UserViewSet
 
 
 @pytest.fixture
@@ -76,7 +123,8 @@ def incorrect_phone_number():
 
 @pytest.fixture
 def correct_verification_code(first_user_profile):
-    """ Фикстура корректного кода верификации """
+    """ Фикстура корректного кода верификации, выданного первому пользователю """
+    get_verification_code_store().issue(first_user_profile.phone_number, first_user_profile.verification_code)
     return first_user_profile.verification_code
 
 
@@ -104,6 +152,60 @@ def test_new_user_login_api(client):
     assert response.status_code == 200
 
 
+@pytest.mark.django_db
+def test_new_user_login_assigns_allocated_referral_code_api(client):
+    """ Тест: новому пользователю выдаётся реферальный код по его первичному ключу """
+    response = client.post('/user_login/', {'phone_number': '+79999999991'})
+    assert response.status_code == 200
+    profile = UserProfile.objects.get(phone_number='+79999999991')
+    assert profile.user_referral_code == get_referral_code_allocator().code_for(profile.user_id)
+
+
+@pytest.mark.django_db
+def test_new_user_login_avoids_legacy_referral_code_api(client):
+    """ Тест: код нового пользователя, совпавший со старым кодом, заменяется свободным """
+    legacy_users = [User.objects.create_user(username=f'+7999200000{index}') for index in range(3)]
+    next_pk = legacy_users[-1].pk + 1
+    legacy_codes = [generate_referral_code(next_pk + offset) for offset in range(3)]
+    for user, code in zip(legacy_users, legacy_codes):
+        UserProfile.objects.create(user=user, phone_number=user.username, user_referral_code=code)
+    response = client.post('/user_login/', {'phone_number': '+79992000010'})
+    assert response.status_code == 200
+    profile = UserProfile.objects.get(phone_number='+79992000010')
+    assert profile.user_referral_code not in legacy_codes
+    assert len(profile.user_referral_code) == 6
+
+
+@pytest.mark.django_db
+def test_create_phone_user_profile_rolls_back_user():
+    """ Тест: при ошибке создания профиля пользователь не остаётся без профиля """
+    user = User.objects.create_user(username='+79992000020')
+    UserProfile.objects.create(user=user, phone_number='+79992000021', user_referral_code='OLD001')
+    with pytest.raises(IntegrityError):
+        create_phone_user_profile('+79992000021')
+    assert not User.objects.filter(username='+79992000021').exists()
+
+
+@pytest.mark.django_db
+def test_new_user_login_creates_passwordless_user_api(client):
+    """ Тест: новый пользователь создаётся с непригодным паролем, без хэширования """
+    response = client.post('/user_login/', {'phone_number': '+79999999991'})
+    assert response.status_code == 200
+    assert not User.objects.get(username='+79999999991').has_usable_password()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_new_user_login_hashes_password_in_thread_pool_api(client, settings):
+    """ Тест: без PASSWORDLESS_SIGNUP пароль хэшируется в пуле потоков после ответа """
+    settings.PASSWORDLESS_SIGNUP = False
+    get_password_hashing_executor.cache_clear()
+    response = client.post('/user_login/', {'phone_number': '+79999999991'})
+    assert response.status_code == 200
+    get_password_hashing_executor().shutdown(wait=True)
+    get_password_hashing_executor.cache_clear()
+    assert User.objects.get(username='+79999999991').has_usable_password()
+
+
 @pytest.mark.django_db
 def test_incorrect_phone_number_api(client, incorrect_phone_number):
     """ Тест для входа по некорректному номеру телефона """
@@ -113,6 +215,15 @@ def test_incorrect_phone_number_api(client, incorrect_phone_number):
     assert response.data == [ErrorDetail(string='Введите номер телефона в формате +79999999999', code='invalid')]
 
 
+@pytest.mark.django_db
+def test_user_login_with_formatted_phone_number_api(client, user_first, first_user_profile):
+    """ Тест: номер в другом формате приводится к E.164 и находит существующего пользователя """
+    response = client.post('/user_login/', {'phone_number': '+7 999 669-15-54'})
+    assert response.status_code == 200
+    assert User.objects.count() == 1
+    assert get_verification_code_store().peek(user_first.username) is not None
+
+
 @pytest.mark.django_db
 def test_input_correct_verification_code_api(client, user_first, correct_verification_code):
     """ Тест для ввода кода верификации """
@@ -159,12 +270,139 @@ def test_user_login_and_input_verification_code_api(client, user_first, first_us
     assert login_response.status_code == 200
 
     # Шаг 2: Ввод кода верификации
-    verification_code = get_verification_code_from_db(user_first)
+    verification_code = get_verification_code_store().peek(user_first.username)
     input_verification_data = {'phone_number': user_first.username, 'entered_code': verification_code}
     input_verification_response = client.post('/input_verification_code/', input_verification_data)
     assert input_verification_response.status_code == 200
     assert input_verification_response.data['message'] == 'Вход выполнен успешно'
 
+
+@pytest.mark.django_db
+def test_user_login_does_not_write_verification_code_to_profile(client, user_first, first_user_profile):
+    """ Тест: код верификации при входе хранится в хранилище кодов, а не в профиле """
+    response = client.post('/user_login/', {'phone_number': user_first.username})
+    assert response.status_code == 200
+    first_user_profile.refresh_from_db()
+    assert first_user_profile.verification_code == '5432'
+    assert get_verification_code_store().peek(user_first.username) is not None
+
+
+@pytest.mark.django_db
+def test_verification_code_is_single_use_api(client, user_first, correct_verification_code):
+    """ Тест: код верификации нельзя использовать повторно """
+    data = {'phone_number': user_first.username, 'entered_code': correct_verification_code}
+    assert client.post('/input_verification_code/', data).status_code == 200
+    response = client.post('/input_verification_code/', data)
+    assert response.status_code == 400
+    assert response.data['error'] == 'Неверный код верификации'
+
+
+# Тесты для хранилищ кодов верификации
+
+@pytest.fixture(params=[LocMemVerificationCodeStore, CacheVerificationCodeStore])
+def code_store(request):
+    """ Фикстура хранилища кодов верификации для каждого бэкенда """
+    return request.param(timeout=300, max_attempts=3)
+
+
+def test_code_store_verify_consumes_code(code_store):
+    """ Тест: верный код погашается после проверки """
+    code_store.issue('+79996691554', '1234')
+    assert code_store.verify('+79996691554', '1234') == CODE_VERIFIED
+    assert code_store.verify('+79996691554', '1234') == CODE_EXPIRED
+
+
+def test_code_store_attempts_limit(code_store):
+    """ Тест: после исчерпания попыток код перестаёт действовать """
+    code_store.issue('+79996691554', '1234')
+    assert code_store.verify('+79996691554', '0000') == CODE_INVALID
+    assert code_store.verify('+79996691554', '0000') == CODE_INVALID
+    assert code_store.verify('+79996691554', '0000') == CODE_ATTEMPTS_EXCEEDED
+    assert code_store.verify('+79996691554', '1234') == CODE_EXPIRED
+
+
+def test_code_store_reissue_resets_attempts(code_store):
+    """ Тест: новый код сбрасывает счётчик попыток """
+    code_store.issue('+79996691554', '1234')
+    code_store.verify('+79996691554', '0000')
+    code_store.verify('+79996691554', '0000')
+    code_store.issue('+79996691554', '4321')
+    assert code_store.verify('+79996691554', '0000') == CODE_INVALID
+    assert code_store.verify('+79996691554', '4321') == CODE_VERIFIED
+
+
+def test_code_store_expiry(code_store):
+    """ Тест: просроченный код не принимается """
+    code_store.timeout = 0
+    if isinstance(code_store, LocMemVerificationCodeStore):
+        code_store._codes.timeout = 0
+    code_store.issue('+79996691554', '1234')
+    assert code_store.verify('+79996691554', '1234') == CODE_EXPIRED
+
+
+@pytest.mark.django_db
+def test_verification_codes_survive_shared_cache_eviction():
+    """ Тест: заполнение общего кэша и поток входов не вытесняют ещё действующий код """
+    store = get_verification_code_store()
+    store.issue('+79990000000', '1111')
+    for index in range(1, 400):
+        store.issue(f'+7999000{index:04d}', '2222')
+        cache.set(f'unrelated:{index}', index)
+    assert store.verify('+79990000000', '1111') == CODE_VERIFIED
+
+
+# Тесты для валидатора номера телефона
+
+@pytest.mark.parametrize('value, expected', [
+    ('+79996691554', '+79996691554'),
+    ('+7 (999) 669-15-54', '+79996691554'),
+    ('+44 20 7946 0958', '+442079460958'),
+])
+def test_phone_number_validator_normalizes(value, expected):
+    """ Тест: валидатор возвращает номер в формате E.164 """
+    assert PhoneNumberValidator()(value) == expected
+
+
+@pytest.mark.parametrize('value, message', [
+    ('8712831', 'Введите номер телефона в формате +79999999999'),
+    (None, 'Введите номер телефона в формате +79999999999'),
+    ('+7012345678', 'Неверный номер телефона'),
+])
+def test_phone_number_validator_errors(value, message):
+    """ Тест: ошибки разбора и невалидные номера дают разные сообщения """
+    with pytest.raises(ValidationError) as error:
+        PhoneNumberValidator()(value)
+    assert error.value.detail == [ErrorDetail(string=message, code='invalid')]
+
+
+# Тесты для распределителя реферальных кодов
+
+def test_referral_code_allocator_is_collision_free():
+    """ Тест: коды для разных номеров различны, имеют нужный формат и обратимы """
+    allocator = ReferralCodeAllocator('test-key')
+    codes = [allocator.code_for(sequence) for sequence in range(20000)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == REFERRAL_CODE_LENGTH and set(code) <= set(REFERRAL_CODE_ALPHABET) for code in codes)
+    assert [allocator.sequence_for(code) for code in codes] == list(range(20000))
+    assert allocator.sequence_for(allocator.code_for(CODE_SPACE - 1)) == CODE_SPACE - 1
+
+
+def test_referral_code_allocator_depends_on_key():
+    """ Тест: последовательность кодов зависит от ключа и не совпадает с самой последовательностью """
+    first, second = ReferralCodeAllocator('first-key'), ReferralCodeAllocator('second-key')
+    assert [first.code_for(n) for n in range(10)] != [second.code_for(n) for n in range(10)]
+    with pytest.raises(ValueError):
+        first.code_for(CODE_SPACE)
+
+
+def test_public_referral_code_key_reported_by_deploy_check(settings):
+    """ Тест: check --deploy предупреждает о публичном ключе реферальных кодов """
+    settings.REFERRAL_CODE_KEY = DEFAULT_REFERRAL_CODE_KEY
+    assert [warning.id for warning in check_referral_code_key(None)] == ['authorization_service.W001']
+    settings.REFERRAL_CODE_KEY = 'secret-referral-key'
+    assert check_referral_code_key(None) == []
+
+
 # Тесты для работы с профилями
 
 @pytest.mark.django_db
@@ -183,6 +421,7 @@ def test_list_user_profiles_api(client, user_first, first_user_profile, user_sec
                 "phone_number": first_user_profile.phone_number,
                 "user_referral_code": first_user_profile.user_referral_code,
                 "user_referred_code_used": first_user_profile.user_referred_code_used,
+                "referral_count": 0,
                 "referred_users": None,
                 "activated_referral_code": first_user_profile.activated_referral_code,
                 "referred_by": None
@@ -192,6 +431,7 @@ def test_list_user_profiles_api(client, user_first, first_user_profile, user_sec
                 "phone_number": second_user_profile.phone_number,
                 "user_referral_code": second_user_profile.user_referral_code,
                 "user_referred_code_used": second_user_profile.user_referred_code_used,
+                "referral_count": 0,
                 "referred_users": None,
                 "activated_referral_code": second_user_profile.activated_referral_code,
                 "referred_by": None
@@ -200,6 +440,90 @@ def test_list_user_profiles_api(client, user_first, first_user_profile, user_sec
     }
 
 
+@pytest.fixture
+def referral_network():
+    """ Фикстура сети из 60 профилей, где каждый профиль после первого приглашён предыдущим """
+    profiles = []
+    for index in range(60):
+        user = User.objects.create_user(username=f'+7999100{index:04d}')
+        referrer = profiles[-1] if profiles else None
+        profiles.append(UserProfile.objects.create(
+            user=user,
+            phone_number=user.username,
+            user_referral_code=f'NET{index:04d}',
+            activated_referral_code=referrer.user_referral_code if referrer else None,
+            referrer=referrer.user if referrer else None
+        ))
+        if referrer:
+            referrer.referral_count = 1
+            referrer.referred_phone_numbers = user.username
+            referrer.save()
+    return profiles
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('page_size', [5, 50])
+@pytest.mark.parametrize('cache_phone_numbers, expected_queries', [(True, 2), (False, 3)])
+def test_list_user_profiles_query_count_api(client, settings, django_assert_num_queries, referral_network,
+                                            page_size, cache_phone_numbers, expected_queries):
+    """ Тест: число запросов к базе на страницу списка профилей не зависит от её размера """
+    settings.REFERRAL_CACHE_PHONE_NUMBERS = cache_phone_numbers
+    with django_assert_num_queries(expected_queries):
+        response = client.get('/userprofiles/', {'page_size': page_size})
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert len(results) == page_size
+    assert results[0]['referred_by'] is None
+    assert results[0]['referred_users'] == [referral_network[1].phone_number]
+    assert results[0]['referral_count'] == 1
+    assert results[1]['referred_by'] == referral_network[0].phone_number
+
+
+@pytest.mark.django_db
+def test_list_user_profiles_count_is_cached_api(client, django_assert_num_queries, referral_network):
+    """ Тест: общее число профилей считается один раз и затем берётся из кэша """
+    with django_assert_num_queries(2):
+        response = client.get('/userprofiles/', {'page': 3})
+    assert response.json()['count'] == 60
+    with django_assert_num_queries(1):
+        response = client.get('/userprofiles/', {'page': 4})
+    assert response.json()['count'] == 60
+    assert response.json()['results'][0]['id'] == referral_network[15].id
+
+
+@pytest.mark.django_db
+def test_list_user_profiles_cursor_pagination_api(client, django_assert_num_queries, referral_network):
+    """ Тест: в режиме курсора страницы идут по id без пропусков и без запроса COUNT(*) """
+    ids = []
+    url, params = '/userprofiles/', {'pagination': 'cursor', 'page_size': 25}
+    while url:
+        with django_assert_num_queries(1):
+            response = client.get(url, params)
+        assert response.status_code == 200
+        data = response.json()
+        assert 'count' not in data
+        ids.extend(profile['id'] for profile in data['results'])
+        url, params = data['next'], None
+    assert ids == [profile.id for profile in referral_network]
+
+
+@pytest.mark.django_db
+def test_list_users_cursor_pagination(user_first, user_second):
+    """ Тест: список пользователей поддерживает пагинацию по курсору """
+    admin = User.objects.create_superuser(username='+79990000000', password='1234')
+    factory = APIRequestFactory()
+    view = UserViewSet.as_view({'get': 'list'})
+    request = factory.get('/users/', {'pagination': 'cursor', 'page_size': 2})
+    force_authenticate(request, user=admin)
+    first_page = view(request).data
+    assert [user['username'] for user in first_page['results']] == [user_first.username, user_second.username]
+    request = factory.get(first_page['next'])
+    force_authenticate(request, user=admin)
+    second_page = view(request).data
+    assert [user['username'] for user in second_page['results']] == [admin.username]
+    assert second_page['next'] is None
+
+
 @pytest.mark.django_db
 def test_get_self_user_profile_api(api_client, user_first, first_user_profile, jwt_token_for_first_user):
     """ Тест для получения своего профиля пользователя """
@@ -212,11 +536,13 @@ def test_get_self_user_profile_api(api_client, user_first, first_user_profile, j
         "phone_number": first_user_profile.phone_number,
         "user_referral_code": first_user_profile.user_referral_code,
         "user_referred_code_used": first_user_profile.user_referred_code_used,
+        "referral_count": 0,
         "referred_users": None,
         "activated_referral_code": first_user_profile.activated_referral_code,
         "referred_by": None
     }
 
+
 @pytest.mark.django_db
 def test_get_other_user_profile_api(api_client, user_first, second_user_profile, jwt_token_for_first_user):
     """ Тест для получения чужого профиля пользователя """
@@ -229,6 +555,7 @@ def test_get_other_user_profile_api(api_client, user_first, second_user_profile,
         "phone_number": second_user_profile.phone_number,
         "user_referral_code": second_user_profile.user_referral_code,
         "user_referred_code_used": second_user_profile.user_referred_code_used,
+        "referral_count": 0,
         "referred_users": None,
         "activated_referral_code": second_user_profile.activated_referral_code,
         "referred_by": None
@@ -246,6 +573,195 @@ def test_update_self_user_profile_api(api_client, user_first, first_user_profile
     assert response.data['message'] == "Вы успешно стали рефералом"
 
 
+@pytest.mark.django_db
+def test_update_self_user_profile_updates_referral_counters_api(api_client, user_first, first_user_profile,
+                                                                second_user_profile):
+    """ Тест: активация кода обновляет счётчик и список рефералов пригласившего """
+    api_client.force_authenticate(user=user_first)
+    response = api_client.put(f'/userprofiles/{first_user_profile.id}/',
+                              {'referral_code': second_user_profile.user_referral_code})
+    assert response.status_code == 200
+    second_user_profile.refresh_from_db()
+    assert second_user_profile.referral_count == 1
+    assert second_user_profile.referred_phone_number_list == [first_user_profile.phone_number]
+    assert second_user_profile.user_referred_code_used is True
+
+    response = api_client.get(f'/userprofiles/{second_user_profile.id}/')
+    assert response.json()['referral_count'] == 1
+    assert response.json()['referred_users'] == [first_user_profile.phone_number]
+
+
+@pytest.mark.django_db
+def test_update_self_user_profile_referral_activation_query_count_api(api_client, user_first, first_user_profile,
+                                                                      second_user_profile):
+    """ Тест: активация кода выполняется не более чем тремя запросами (без учёта точек сохранения) """
+    api_client.force_authenticate(user=user_first)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.put(f'/userprofiles/{first_user_profile.id}/',
+                                  {'referral_code': second_user_profile.user_referral_code})
+    assert response.status_code == 200
+    queries = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+    assert len(queries) <= 3, queries
+    first_user_profile.refresh_from_db()
+    assert first_user_profile.activated_referral_code == second_user_profile.user_referral_code
+    assert first_user_profile.referrer == second_user_profile.user
+
+
+@pytest.mark.django_db
+def test_update_self_user_profile_repeated_referral_activation_api(api_client, user_first, first_user_profile,
+                                                                   second_user_profile, referral_network):
+    """ Тест: повторная активация того же или другого кода отклоняется """
+    api_client.force_authenticate(user=user_first)
+    url = f'/userprofiles/{first_user_profile.id}/'
+    assert api_client.put(url, {'referral_code': second_user_profile.user_referral_code}).status_code == 200
+    response = api_client.put(url, {'referral_code': second_user_profile.user_referral_code})
+    assert response.status_code == 400
+    assert response.data['error'] == 'Вы уже активировали этот реферальный код'
+    response = api_client.put(url, {'referral_code': referral_network[0].user_referral_code})
+    assert response.status_code == 400
+    assert response.data['error'] == 'У вас уже активирован другой реферальный код'
+    second_user_profile.refresh_from_db()
+    assert second_user_profile.referral_count == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_referral_activations():
+    """ Тест: из параллельных активаций одного профиля успешна ровно одна """
+    users = [User.objects.create_user(username=f'+7999200{index:04d}') for index in range(9)]
+    profiles = [UserProfile.objects.create(user=user, phone_number=user.username,
+                                           user_referral_code=f'RACE{index:02d}')
+                for index, user in enumerate(users)]
+    activator, referrers = profiles[0], profiles[1:]
+    barrier = threading.Barrier(len(referrers))
+    results = []
+
+    def activate(referral_code):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    results.append(activate_referral_code(activator.pk, referral_code, user_id=activator.user_id))
+                    return
+                except OperationalError:
+                    # SQLite блокирует базу на время записи другого потока
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=activate, args=(referrer.user_referral_code,)) for referrer in referrers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(ACTIVATION_OK) == 1
+    assert results.count(ACTIVATION_OTHER_CODE_ACTIVATED) == len(referrers) - 1
+    activator.refresh_from_db()
+    winner = UserProfile.objects.get(user_referral_code=activator.activated_referral_code)
+    assert activator.referrer_id == winner.user_id
+    assert sum(UserProfile.objects.values_list('referral_count', flat=True)) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_cross_referral_activations():
+    """ Тест: из параллельных встречных активаций двух профилей успешна одна, вторая замкнула бы цикл """
+    users = [User.objects.create_user(username=f'+7999210{index:04d}') for index in range(2)]
+    profiles = [UserProfile.objects.create(user=user, phone_number=user.username,
+                                           user_referral_code=f'CROSS{index}')
+                for index, user in enumerate(users)]
+    barrier = threading.Barrier(len(profiles))
+    results = []
+
+    def activate(profile, referrer):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    results.append(activate_referral_code(profile.pk, referrer.user_referral_code))
+                    return
+                except OperationalError:
+                    # SQLite блокирует базу на время записи другого потока
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=activate, args=pair) for pair in (profiles, profiles[::-1])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == sorted([ACTIVATION_OK, ACTIVATION_CYCLE])
+    assert UserProfile.objects.filter(referrer__isnull=False).count() == 1
+    assert ReferralClosure.objects.count() == 1
+
+
+@pytest.fixture
+def admin_user():
+    """ Фикстура администратора """
+    return User.objects.create_superuser(username='+79990000000', password='1234')
+
+
+@pytest.mark.django_db
+def test_bulk_activate_referral_codes_api(api_client, admin_user, user_first, first_user_profile, second_user_profile,
+                                          referral_network):
+    """ Тест массовой активации: отчёт по каждой паре и те же правила, что у одиночной активации """
+    api_client.force_authenticate(user=admin_user)
+    items = [
+        {'phone_number': '+7 999 669-15-54', 'referral_code': second_user_profile.user_referral_code},
+        {'phone_number': user_first.username, 'referral_code': referral_network[0].user_referral_code},
+        {'phone_number': second_user_profile.phone_number, 'referral_code': second_user_profile.user_referral_code},
+        {'phone_number': referral_network[0].phone_number, 'referral_code': 'NOCODE'},
+        {'phone_number': '+79990009999', 'referral_code': second_user_profile.user_referral_code},
+        {'phone_number': '12345', 'referral_code': second_user_profile.user_referral_code},
+        {'phone_number': referral_network[0].phone_number, 'referral_code': second_user_profile.user_referral_code},
+    ]
+    response = api_client.post('/userprofiles/bulk_activate/', {'items': items}, format='json')
+    assert response.status_code == 200
+    assert [item['result'] for item in response.data['results']] == [
+        'activated', 'other_code_activated', 'self_referral', 'code_not_found', 'profile_not_found',
+        'invalid_phone_number', 'activated',
+    ]
+    assert response.data['activated'] == 2
+    assert response.data['failed'] == 5
+    second_user_profile.refresh_from_db()
+    assert second_user_profile.referral_count == 2
+    assert second_user_profile.referred_phone_number_list == [user_first.username, referral_network[0].phone_number]
+    first_user_profile.refresh_from_db()
+    assert first_user_profile.referrer == second_user_profile.user
+
+
+@pytest.mark.django_db
+def test_bulk_activate_referral_codes_query_count_api(api_client, admin_user, first_user_profile,
+                                                      second_user_profile):
+    """ Тест: число запросов массовой активации не зависит от числа пар """
+    User.objects.bulk_create([User(username=f'+7999300{index:04d}') for index in range(200)])
+    users = User.objects.filter(username__startswith='+7999300')
+    UserProfile.objects.bulk_create([UserProfile(user=user, phone_number=user.username,
+                                                 user_referral_code=f'BULK{user.pk:04d}') for user in users])
+    referrers = [first_user_profile, second_user_profile]
+    items = [{'phone_number': user.username, 'referral_code': referrers[index % 2].user_referral_code}
+             for index, user in enumerate(users)]
+    api_client.force_authenticate(user=admin_user)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.post('/userprofiles/bulk_activate/', {'items': items}, format='json')
+    assert response.data['activated'] == 200
+    queries = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+    # Профили, коды, блокировка строк, поиск пригласивших в поддеревьях, UPDATE профилей,
+    # INSERT связей в таблицу замыкания и UPDATE счётчиков каждого из двух пригласивших
+    assert len(queries) == 8
+    first_user_profile.refresh_from_db()
+    assert first_user_profile.referral_count == 100
+    assert UserProfile.objects.filter(referrer=second_user_profile.user).count() == 100
+
+
+@pytest.mark.django_db
+def test_bulk_activate_referral_codes_requires_admin_api(api_client, user_first, first_user_profile):
+    """ Тест: массовая активация доступна только администраторам """
+    api_client.force_authenticate(user=user_first)
+    response = api_client.post('/userprofiles/bulk_activate/', {'items': []}, format='json')
+    assert response.status_code == 403
+
 @pytest.mark.django_db
 def test_update_self_user_profile_with_incorrect_referral_code_api(api_client, user_first, first_user_profile,
                                                                   jwt_token_for_first_user):
@@ -305,3 +821,1080 @@ def test_create_user_profile_api(api_client, user_first, jwt_token_for_first_use
     response = api_client.post('/userprofiles/', data)
     assert response.status_code == 403
     assert response.data['detail'] == 'У вас недостаточно прав для выполнения данного действия.'
+
+
+# Тесты для реферального дерева
+
+def create_tree_profiles(count):
+    """ Профили без активированных кодов для построения реферального дерева """
+    profiles = []
+    for index in range(count):
+        user = User.objects.create_user(username=f'+7999400{index:04d}')
+        profiles.append(UserProfile.objects.create(user=user, phone_number=user.username,
+                                                   user_referral_code=f'TREE{index:02d}'))
+    return profiles
+
+
+@pytest.fixture
+def referral_tree():
+    """ Фикстура дерева 0 -> 1 -> {2 -> 3, 4}; коды активируются не сверху вниз """
+    profiles = create_tree_profiles(5)
+    for child, parent in [(2, 1), (3, 2), (4, 1), (1, 0)]:
+        assert activate_referral_code(profiles[child].pk, profiles[parent].user_referral_code) == ACTIVATION_OK
+    return profiles
+
+
+@pytest.mark.django_db
+def test_referral_tree_api(api_client, referral_tree):
+    """ Тест: поддерево и цепочка пригласивших до заданной глубины """
+    response = api_client.get(f'/userprofiles/{referral_tree[0].pk}/referral_tree/', {'depth': 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert [(node['id'], node['depth'], node['referred_by']) for node in data['descendants']] == [
+        (referral_tree[1].pk, 1, referral_tree[0].phone_number),
+        (referral_tree[2].pk, 2, referral_tree[1].phone_number),
+        (referral_tree[4].pk, 2, referral_tree[1].phone_number),
+    ]
+    assert data['ancestors'] == []
+    assert (data['subtree_size'], data['max_depth'], data['truncated']) == (4, 3, False)
+
+    data = api_client.get(f'/userprofiles/{referral_tree[3].pk}/referral_tree/').json()
+    assert [(node['id'], node['depth']) for node in data['ancestors']] == [
+        (referral_tree[2].pk, 1), (referral_tree[1].pk, 2), (referral_tree[0].pk, 3)]
+    assert (data['descendants'], data['subtree_size'], data['max_depth']) == ([], 0, 0)
+
+
+@pytest.mark.django_db
+def test_referral_tree_limits_api(api_client, settings, referral_tree):
+    """ Тест: число потомков в ответе ограничено, глубина проверяется """
+    settings.REFERRAL_TREE = dict(settings.REFERRAL_TREE, MAX_NODES=2)
+    data = api_client.get(f'/userprofiles/{referral_tree[0].pk}/referral_tree/', {'depth': 10}).json()
+    assert len(data['descendants']) == 2
+    assert data['truncated'] is True
+    assert data['subtree_size'] == 4
+    for depth in ['0', '11', 'abc']:
+        response = api_client.get(f'/userprofiles/{referral_tree[0].pk}/referral_tree/', {'depth': depth})
+        assert response.status_code == 400
+    assert api_client.get('/userprofiles/999999/referral_tree/').status_code == 404
+
+
+@pytest.mark.django_db
+def test_referral_cycle_is_rejected_api(api_client, referral_tree):
+    """ Тест: нельзя активировать код профиля из своего поддерева """
+    api_client.force_authenticate(user=referral_tree[0].user)
+    response = api_client.put(f'/userprofiles/{referral_tree[0].pk}/',
+                              {'referral_code': referral_tree[3].user_referral_code})
+    assert response.status_code == 400
+    assert response.data['error'] == 'Нельзя активировать код реферала из своего реферального дерева'
+    referral_tree[0].refresh_from_db()
+    assert referral_tree[0].activated_referral_code is None
+
+
+@pytest.mark.django_db
+def test_bulk_activation_maintains_closure_and_rejects_cycles():
+    """ Тест: массовая активация цепочки внутри одной части и отказ в активации, замыкающей цикл """
+    profiles = create_tree_profiles(4)
+    pairs = [(profiles[1].phone_number, profiles[0].user_referral_code),
+             (profiles[2].phone_number, profiles[1].user_referral_code),
+             (profiles[3].phone_number, profiles[0].user_referral_code),
+             (profiles[0].phone_number, profiles[2].user_referral_code)]
+    results = bulk_activate_referral_codes(pairs)
+    assert results == [ACTIVATION_OK, ACTIVATION_OK, ACTIVATION_OK, ACTIVATION_CYCLE]
+    closure = set(ReferralClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+    assert closure == {(profiles[0].pk, profiles[1].pk, 1), (profiles[1].pk, profiles[2].pk, 1),
+                       (profiles[0].pk, profiles[2].pk, 2), (profiles[0].pk, profiles[3].pk, 1)}
+    profiles[0].refresh_from_db()
+    assert profiles[0].activated_referral_code is None
+
+
+@pytest.mark.django_db
+def test_referral_counters_backfill_migration(referral_network):
+    """ Тест: миграция заполняет счётчики и списки номеров рефералов по уже активированным кодам """
+    extra_user = User.objects.create_user(username='+79991009999')
+    UserProfile.objects.create(user=extra_user, phone_number=extra_user.username, user_referral_code='NET9999',
+                               activated_referral_code=referral_network[0].user_referral_code,
+                               referrer=referral_network[0].user)
+    UserProfile.objects.update(referral_count=0, referred_phone_numbers='')
+    migration = importlib.import_module('authorization_service.migrations.0005_userprofile_referral_counters')
+    migration.backfill_referral_counters(apps, type('SchemaEditor', (), {'connection': connection}))
+    counters = dict(UserProfile.objects.values_list('pk', 'referral_count'))
+    assert counters[referral_network[0].pk] == 2
+    assert counters[referral_network[-1].pk] == 0
+    assert sum(counters.values()) == 60
+    referral_network[0].refresh_from_db()
+    assert referral_network[0].referred_phone_number_list == [referral_network[1].phone_number, extra_user.username]
+
+
+@pytest.mark.django_db
+def test_referral_closure_backfill_migration(referral_network):
+    """ Тест: миграция заполняет таблицу замыкания по уже активированным кодам """
+    migration = importlib.import_module('authorization_service.migrations.0006_referralclosure')
+    migration.backfill_referral_closure(apps, type('SchemaEditor', (), {'connection': connection}))
+    assert ReferralClosure.objects.count() == 60 * 59 // 2
+    assert list(ReferralClosure.objects.filter(descendant=referral_network[-1]).order_by('depth').values_list(
+        'ancestor_id', flat=True)) == [profile.pk for profile in reversed(referral_network[:-1])]
+
+
+# Тесты для рейтинга пригласивших
+
+def test_fenwick_tree_prefix_sums_and_growth():
+    """ Тест: суммы на префиксе дерева Фенвика сохраняются при его удвоении """
+    tree = FenwickTree(size=4)
+    values = {1: 2, 3: 1, 4: 5, 9: 3, 17: 1}
+    for index, value in values.items():
+        tree.add(index, value)
+    assert tree.size == 32
+    for index in range(0, 40):
+        assert tree.prefix_sum(index) == sum(value for key, value in values.items() if key <= index)
+
+
+@pytest.mark.parametrize('leaderboard', [LocMemLeaderboard(top_size=3), CacheLeaderboard(top_size=3)],
+                         ids=['locmem', 'cache'])
+def test_leaderboard_backend(leaderboard):
+    """ Тест: топ, места с учётом равного счёта и инкрементальные изменения """
+    assert not leaderboard.is_built()
+    assert leaderboard.increment(1, 1) is None
+    assert leaderboard.rebuild([(1, 5), (2, 3), (3, 3), (4, 1), (5, 0)]) == 4
+    assert leaderboard.top(3) == [(1, 5), (2, 3), (3, 3)]
+    assert [leaderboard.rank(score) for score in (5, 3, 1, 0)] == [1, 2, 4, 5]
+
+    assert leaderboard.increment(4, 5) == 6
+    assert leaderboard.increment(6, 3) == 3
+    assert leaderboard.top(3) == [(4, 6), (1, 5), (2, 3)]
+    assert leaderboard.top(1) == [(4, 6)]
+    assert [leaderboard.rank(score) for score in (6, 5, 3, 0)] == [1, 2, 3, 6]
+    assert leaderboard.total() == 5
+
+
+@pytest.mark.django_db
+def test_leaderboard_api(api_client, django_capture_on_commit_callbacks):
+    """ Тест: рейтинг обновляется при активации кодов и читается без агрегации по таблице """
+    profiles = create_tree_profiles(6)
+    activate_referral_code(profiles[5].pk, profiles[1].user_referral_code)
+    # Рейтинг собирает фоновая пересборка, а не запросы к API
+    reconcile_leaderboard()
+    with django_capture_on_commit_callbacks(execute=True):
+        for child, parent in [(2, 0), (3, 0), (4, 1)]:
+            api_client.force_authenticate(user=profiles[child].user)
+            response = api_client.put(f'/userprofiles/{profiles[child].pk}/',
+                                      {'referral_code': profiles[parent].user_referral_code})
+            assert response.status_code == 200
+
+    api_client.force_authenticate(user=None)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get('/userprofiles/leaderboard/', {'limit': 5})
+    assert response.status_code == 200
+    assert len(context.captured_queries) == 1
+    assert response.json() == {'total': 2, 'results': [
+        {'rank': 1, 'id': profiles[0].pk, 'phone_number': profiles[0].phone_number, 'referral_count': 2},
+        {'rank': 1, 'id': profiles[1].pk, 'phone_number': profiles[1].phone_number, 'referral_count': 2},
+    ]}
+    data = api_client.get(f'/userprofiles/{profiles[4].pk}/leaderboard_rank/').json()
+    assert (data['referral_count'], data['rank'], data['total']) == (0, 3, 2)
+    assert api_client.get('/userprofiles/leaderboard/', {'limit': 1000}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_leaderboard_api_before_build(api_client):
+    """ Тест: пока рейтинг не собран, запросы читают его из базы ограниченным числом запросов и не пересобирают """
+    profiles = create_tree_profiles(6)
+    for child, parent in [(2, 0), (3, 0), (4, 1), (5, 1), (1, 0)]:
+        activate_referral_code(profiles[child].pk, profiles[parent].user_referral_code)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get('/userprofiles/leaderboard/', {'limit': 5})
+    assert response.status_code == 200
+    assert len(context.captured_queries) == 3
+    assert response.json() == {'total': 2, 'results': [
+        {'rank': 1, 'id': profiles[0].pk, 'phone_number': profiles[0].phone_number, 'referral_count': 3},
+        {'rank': 2, 'id': profiles[1].pk, 'phone_number': profiles[1].phone_number, 'referral_count': 2},
+    ]}
+    with CaptureQueriesContext(connection) as context:
+        data = api_client.get(f'/userprofiles/{profiles[1].pk}/leaderboard_rank/').json()
+    assert (data['referral_count'], data['rank'], data['total']) == (2, 2, 2)
+    assert len(context.captured_queries) == 3
+    assert not get_leaderboard().is_built()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_leaderboard_background_refresh():
+    """ Тест: LocMemLeaderboard собирается из базы в фоновом потоке """
+    profiles = create_tree_profiles(3)
+    activate_referral_code(profiles[1].pk, profiles[0].user_referral_code)
+    leaderboard = LocMemLeaderboard(refresh_interval=3600)
+    leaderboard.start_refresh()
+    deadline = time.monotonic() + 5
+    while not leaderboard.is_built() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert leaderboard.top(3) == [(profiles[0].pk, 1)]
+
+
+@pytest.mark.django_db
+def test_reconcile_leaderboard_command(referral_network):
+    """ Тест: сверка исправляет расхождение рейтинга с базой """
+    reconcile_leaderboard()
+    leaderboard = get_leaderboard()
+    assert leaderboard.total() == 59
+    UserProfile.objects.filter(pk=referral_network[10].pk).update(referral_count=4)
+    assert leaderboard.top(1) != [(referral_network[10].pk, 4)]
+    out = StringIO()
+    call_command('reconcile_leaderboard', stdout=out)
+    assert 'пригласивших 59, топ-10 изменился' in out.getvalue()
+    assert leaderboard.top(1) == [(referral_network[10].pk, 4)]
+    assert leaderboard.rank(1) == 2
+
+
+# Тесты для выгрузки профилей
+
+@pytest.mark.django_db
+def test_export_profiles_ndjson_api(api_client, settings, admin_user, referral_network):
+    """ Тест: выгрузка профилей в NDJSON одним запросом к базе при любом числе частей """
+    settings.EXPORT_CHUNK_SIZE = 7
+    api_client.force_authenticate(user=admin_user)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get('/userprofiles/export/')
+        content = b''.join(response.streaming_content).decode()
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('application/x-ndjson')
+    assert len(context.captured_queries) == 1
+    records = [json.loads(line) for line in content.splitlines()]
+    assert len(records) == 60
+    assert records[1] == {'id': referral_network[1].pk, 'phone_number': referral_network[1].phone_number,
+                          'user_referral_code': 'NET0001', 'activated_referral_code': 'NET0000',
+                          'referred_by': referral_network[0].phone_number, 'referral_count': 1}
+
+
+@pytest.mark.django_db
+def test_export_referral_edges_csv_api(api_client, admin_user, referral_network):
+    """ Тест: выгрузка реферальных связей в CSV с заголовком """
+    api_client.force_authenticate(user=admin_user)
+    response = api_client.get('/userprofiles/export/', {'export_format': 'csv', 'dataset': 'edges'})
+    assert response.status_code == 200
+    assert response['Content-Disposition'] == 'attachment; filename="edges.csv"'
+    rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+    assert rows[0] == ['referrer_id', 'referrer_phone_number', 'referral_id', 'referral_phone_number',
+                       'referral_code']
+    assert len(rows) == 60
+    assert rows[1] == [str(referral_network[0].pk), referral_network[0].phone_number, str(referral_network[1].pk),
+                       referral_network[1].phone_number, 'NET0000']
+
+
+@pytest.mark.django_db
+def test_export_profiles_requires_admin_api(api_client, admin_user, user_first, first_user_profile):
+    """ Тест: выгрузка доступна только администраторам, параметры проверяются """
+    api_client.force_authenticate(user=user_first)
+    assert api_client.get('/userprofiles/export/').status_code == 403
+    api_client.force_authenticate(user=admin_user)
+    assert api_client.get('/userprofiles/export/', {'export_format': 'xml'}).status_code == 400
+    assert api_client.get('/userprofiles/export/', {'dataset': 'users'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_export_profiles_command(tmp_path, referral_network):
+    """ Тест: команда выгружает профили в файл, который читает import_users """
+    path = tmp_path / 'profiles.csv'
+    out = StringIO()
+    call_command('export_profiles', str(path), '--chunk-size', '7', stdout=out)
+    assert 'Выгружено строк: 60' in out.getvalue()
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['phone_number'] for row in rows] == [profile.phone_number for profile in referral_network]
+    out = StringIO()
+    call_command('import_users', str(path), stdout=out)
+    assert 'создано 0, пропущено существующих 60' in out.getvalue()
+
+
+# Тесты для бюджетов запросов к базе
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('response_cache', [False, True])
+def test_endpoint_query_budgets(settings, referral_network, response_cache):
+    """ Тест: сквозной сценарий укладывается в бюджет запросов к базе каждого эндпоинта """
+    settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=response_cache)
+    referrer = create_referrer()
+    summary = run_flows(5, referrer.user_referral_code).summary()
+    assert list(summary) == list(QUERY_BUDGETS)
+    assert check_query_budgets(summary) == []
+    referrer.refresh_from_db()
+    assert referrer.referral_count == 5
+
+
+def test_query_budget_and_baseline_regressions_are_reported():
+    """ Тест: превышение бюджета и рост относительно базовой сводки выявляются """
+    summary = {'userprofile-list': {'requests': 10, 'p50_ms': 4.0, 'p95_ms': 9.0, 'p99_ms': 12.0,
+                                    'queries_mean': 4.0, 'queries_max': 4}}
+    assert check_query_budgets(summary) == [('userprofile-list', 4, QUERY_BUDGETS['userprofile-list'])]
+    baseline = {'userprofile-list': {'p95_ms': 5.0, 'queries_max': 2}}
+    assert len(compare_with_baseline(summary, baseline)) == 2
+    assert compare_with_baseline(summary, {'userprofile-list': {'p95_ms': 8.0, 'queries_max': 4}}) == []
+    queries, latencies = split_summary(summary)
+    assert queries == {'userprofile-list': {'queries_mean': 4.0, 'queries_max': 4}}
+    assert latencies == {'userprofile-list': {'p50_ms': 4.0, 'p95_ms': 9.0, 'p99_ms': 12.0}}
+    assert compare_with_baseline(summary, {'userprofile-list': {'queries_max': 4}}) == []
+    assert len(compare_with_baseline(summary, {'userprofile-list': {'p95_ms': 5.0}})) == 1
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile([5, 1, 4, 2, 3], 99) == 5
+
+
+def test_committed_e2e_baseline_has_no_latencies():
+    """ Тест: в базовой сводке из репозитория только число запросов к базе, задержки хранятся у каждой машины """
+    with open(DEFAULT_BASELINE, encoding='utf-8') as file:
+        baseline = json.load(file)
+    assert list(baseline) == list(QUERY_BUDGETS)
+    for endpoint, stats in baseline.items():
+        assert set(stats) == set(QUERY_FIELDS)
+        assert stats['queries_max'] <= QUERY_BUDGETS[endpoint]
+
+
+# Тесты для кэширования ответов чтения профилей
+
+@pytest.mark.django_db
+def test_retrieve_user_profile_response_cache_api(api_client, django_assert_num_queries, user_first,
+                                                  first_user_profile):
+    """ Тест: повторное чтение профиля отдаётся из кэша, совпадающий If-None-Match даёт 304 """
+    api_client.force_authenticate(user=user_first)
+    url = f'/userprofiles/{first_user_profile.id}/'
+    response = api_client.get(url)
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert etag.startswith('"') and not etag.startswith('W/')
+
+    with django_assert_num_queries(0):
+        cached_response = api_client.get(url)
+    assert cached_response.json() == response.json()
+    assert cached_response['ETag'] == etag
+
+    with django_assert_num_queries(0):
+        not_modified = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert not_modified.status_code == 304
+    assert not_modified.content == b''
+    assert api_client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code == 200
+
+
+@pytest.mark.django_db
+def test_profile_response_cache_invalidated_on_referral_activation_api(api_client, user_first, first_user_profile,
+                                                                       second_user_profile):
+    """ Тест: активация реферального кода сбрасывает кэшированные ответы пригласившего и списка """
+    api_client.force_authenticate(user=user_first)
+    referrer_url = f'/userprofiles/{second_user_profile.id}/'
+    etag = api_client.get(referrer_url)['ETag']
+    list_etag = api_client.get('/userprofiles/')['ETag']
+
+    response = api_client.put(f'/userprofiles/{first_user_profile.id}/',
+                              {'referral_code': second_user_profile.user_referral_code})
+    assert response.status_code == 200
+
+    response = api_client.get(referrer_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['referral_count'] == 1
+    assert response['ETag'] != etag
+    response = api_client.get('/userprofiles/', HTTP_IF_NONE_MATCH=list_etag)
+    assert response.status_code == 200
+    assert response.json()['results'][0]['referred_by'] == second_user_profile.phone_number
+
+
+@pytest.mark.django_db
+def test_profile_response_cache_invalidated_on_profile_save_api(client, first_user_profile):
+    """ Тест: сохранение профиля сбрасывает кэш, разные параметры запроса кэшируются отдельно """
+    assert client.get('/userprofiles/', {'page_size': 1}).json()['results'][0]['activated_referral_code'] is None
+    first_user_profile.activated_referral_code = 'NEW001'
+    first_user_profile.save()
+    assert client.get('/userprofiles/', {'page_size': 1}).json()['results'][0]['activated_referral_code'] == 'NEW001'
+    assert client.get('/userprofiles/', {'page_size': 2}).json()['results'][0]['activated_referral_code'] == 'NEW001'
+
+
+@pytest.mark.django_db
+def test_user_response_generation_bumped_only_on_displayed_field_change(user_first):
+    """ Тест: создание пользователя и сохранение невыводимых полей не сбрасывают кэш ответов, смена имени сбрасывает """
+    generations = get_generations('users')
+    User.objects.create_user(username='+79994000001')
+    user_first.save(update_fields=['last_login'])
+    assert get_generations('users') == generations
+    user_first.username = '+79994000002'
+    user_first.save()
+    assert get_generations('users') != generations
+
+
+# Тесты для ограничения частоты запросов
+
+@pytest.mark.django_db
+def test_user_login_rate_limited_by_phone_number_api(client, settings, django_assert_num_queries, user_first,
+                                                     first_user_profile):
+    """ Тест: лимит по номеру учитывает разные записи одного номера и срабатывает до запросов к базе """
+    settings.RATE_LIMITS = dict(settings.RATE_LIMITS, RULES={'login': {'phone': (2, 60), 'ip': (100, 60)}})
+    assert client.post('/user_login/', {'phone_number': user_first.username}).status_code == 200
+    assert client.post('/user_login/', {'phone_number': '+7 999 669-15-54'}).status_code == 200
+    with django_assert_num_queries(0):
+        response = client.post('/user_login/', {'phone_number': user_first.username})
+    assert response.status_code == 429
+    assert 0 < int(response['Retry-After']) <= 120
+
+
+@pytest.mark.django_db
+def test_input_verification_code_rate_limited_by_ip_api(client, settings, user_first, user_second,
+                                                        first_user_profile):
+    """ Тест: лимит по IP-адресу действует для разных номеров """
+    settings.RATE_LIMITS = dict(settings.RATE_LIMITS, RULES={'verify': {'phone': (100, 60), 'ip': (2, 60)}})
+    for phone_number in (user_first.username, user_second.username):
+        response = client.post('/input_verification_code/', {'phone_number': phone_number, 'entered_code': '0000'})
+        assert response.status_code == 400
+    response = client.post('/input_verification_code/', {'phone_number': '+79990000001', 'entered_code': '0000'})
+    assert response.status_code == 429
+    response = client.post('/input_verification_code/', {'phone_number': user_first.username, 'entered_code': '0000'},
+                           REMOTE_ADDR='10.0.0.2')
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_rate_limit_by_ip_ignores_spoofed_forwarded_for_api(client, settings, async_request_factory):
+    """ Тест: подменой X-Forwarded-For нельзя обойти лимит по IP; за доверенным прокси берётся адрес из заголовка """
+    settings.RATE_LIMITS = dict(settings.RATE_LIMITS, RULES={'login': {'ip': (2, 60)}})
+    for index in range(2):
+        response = client.post('/user_login/', {'phone_number': f'+7999300000{index}'},
+                               HTTP_X_FORWARDED_FOR=f'203.0.113.{index}')
+        assert response.status_code == 200
+    response = client.post('/user_login/', {'phone_number': '+79993000009'}, HTTP_X_FORWARDED_FOR='203.0.113.9')
+    assert response.status_code == 429
+    request = async_request_factory.post('/user_login/', {'phone_number': '+79993000008'},
+                                         content_type='application/json', HTTP_X_FORWARDED_FOR='203.0.113.8')
+    assert async_to_sync(AsyncUserProfileLoginAPI.as_view())(request).status_code == 429
+
+    settings.REST_FRAMEWORK = dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)
+    response = client.post('/user_login/', {'phone_number': '+79993000007'},
+                           HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.7')
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_async_user_login_rate_limited_api(settings, async_request_factory):
+    """ Тест: асинхронный вход возвращает 429 с заголовком Retry-After """
+    settings.RATE_LIMITS = dict(settings.RATE_LIMITS, RULES={'login': {'phone': (1, 60)}})
+    view = async_to_sync(AsyncUserProfileLoginAPI.as_view())
+    request = async_request_factory.post('/user_login/', {'phone_number': '+79999999992'},
+                                         content_type='application/json')
+    assert view(request).status_code == 200
+    response = view(request)
+    assert response.status_code == 429
+    assert response.has_header('Retry-After')
+
+
+@pytest.mark.parametrize('backend_class', [LocMemRateLimitBackend, CacheRateLimitBackend])
+def test_rate_limit_backend_sliding_window(monkeypatch, backend_class):
+    """ Тест: запросы предыдущего окна учитываются с весом, убывающим по мере сдвига окна """
+    backend = backend_class()
+    now = [1000.0]
+    monkeypatch.setattr('authorization_service.ratelimit.time.time', lambda: now[0])
+    assert all(backend.hit('key', 10, 10)[0] for _ in range(10))
+    # Следующий запрос станет возможен, когда вес этих 10 запросов опустится до 9: через 11 с
+    assert backend.hit('key', 10, 10) == (False, 11)
+    assert backend.hit('other', 10, 10)[0]
+
+    # Середина следующего окна: предыдущее учитывается с весом 0.5, свободно 5 запросов
+    now[0] = 1015.0
+    assert all(backend.hit('key', 10, 10)[0] for _ in range(5))
+    allowed, retry_after = backend.hit('key', 10, 10)
+    assert not allowed
+    assert retry_after == 1
+
+    # Через два окна счётчики сброшены
+    now[0] = 1040.0
+    assert all(backend.hit('key', 10, 10)[0] for _ in range(10))
+
+
+# Тесты для отправки СМС
+
+@pytest.mark.django_db
+def test_user_login_sends_verification_code_sms_api(client, settings, user_first, first_user_profile):
+    """ Тест: код верификации отправляется через очередь СМС """
+    settings.SMS_DISPATCHER = {'PROVIDER': 'authorization_service.sms.FakeSmsProvider', 'OPTIONS': {'batch_wait': 0}}
+    response = client.post('/user_login/', {'phone_number': user_first.username})
+    assert response.status_code == 200
+    dispatcher = get_sms_dispatcher()
+    dispatcher.flush()
+    code = get_verification_code_store().peek(user_first.username)
+    assert dispatcher.provider.outbox == [SmsMessage(user_first.username, f'Код верификации: {code}')]
+
+
+def test_sms_dispatcher_sends_messages_in_batches():
+    """ Тест: сообщения, пришедшие за время набора пачки, отправляются одним вызовом провайдера """
+    dispatcher = SmsDispatcher(FakeSmsProvider(), batch_size=4, batch_wait=0.2)
+    for index in range(10):
+        dispatcher.enqueue(f'+7999000000{index}', 'текст')
+    dispatcher.close()
+    assert len(dispatcher.provider.outbox) == 10
+    assert [len(batch) for batch in dispatcher.provider.batches] == [4, 4, 2]
+    assert dispatcher.sent == 10
+
+
+def test_sms_dispatcher_retries_failed_batches():
+    """ Тест: пачка отправляется повторно, после исчерпания повторов сообщения считаются неотправленными """
+    dispatcher = SmsDispatcher(FakeSmsProvider(fail_times=2), batch_wait=0, max_retries=3, retry_backoff=0)
+    dispatcher.enqueue('+79990000001', 'текст')
+    dispatcher.flush()
+    assert dispatcher.provider.calls == 3
+    assert dispatcher.sent == 1
+
+    dispatcher = SmsDispatcher(FakeSmsProvider(fail_times=5), batch_wait=0, max_retries=1, retry_backoff=0)
+    dispatcher.enqueue('+79990000001', 'текст')
+    dispatcher.close()
+    assert dispatcher.provider.calls == 2
+    assert dispatcher.failed == 1
+    assert dispatcher.provider.outbox == []
+
+
+def test_sms_dispatcher_retry_does_not_block_new_messages():
+    """ Тест: пока пачка ждёт повтора, новые сообщения отправляются без задержки """
+    dispatcher = SmsDispatcher(FakeSmsProvider(fail_times=1), batch_size=1, batch_wait=0, retry_backoff=1)
+    dispatcher.enqueue('+79990000001', 'текст')
+    deadline = time.monotonic() + 0.5
+    while dispatcher.provider.calls == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dispatcher.enqueue('+79990000002', 'текст')
+    while not dispatcher.provider.outbox and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [message.phone_number for message in dispatcher.provider.outbox] == ['+79990000002']
+    dispatcher.close()
+    assert dispatcher.provider.outbox[-1].phone_number == '+79990000001'
+    assert dispatcher.sent == 2
+
+
+def test_sms_dispatcher_rejects_messages_when_queue_is_full():
+    """ Тест: при заполненной очереди постановка сообщения завершается ошибкой 503 """
+    started, release = threading.Event(), threading.Event()
+
+    class BlockingSmsProvider(FakeSmsProvider):
+        def send_batch(self, messages):
+            started.set()
+            release.wait()
+            super().send_batch(messages)
+
+    dispatcher = SmsDispatcher(BlockingSmsProvider(), queue_size=1, batch_size=1, batch_wait=0)
+    dispatcher.enqueue('+79990000001', 'текст')
+    started.wait()
+    dispatcher.enqueue('+79990000002', 'текст')
+    with pytest.raises(SmsQueueFull) as exc_info:
+        dispatcher.enqueue('+79990000003', 'текст')
+    assert exc_info.value.status_code == 503
+    release.set()
+    dispatcher.close()
+    assert [message.phone_number for message in dispatcher.provider.outbox] == ['+79990000001', '+79990000002']
+
+
+# Тесты для JWT-аутентификации с кэшем пользователей
+
+@pytest.mark.django_db
+def test_cached_jwt_authentication_skips_user_query(api_client, settings, django_assert_num_queries, user_first,
+                                                    first_user_profile):
+    """ Тест: повторный запрос с тем же токеном не загружает пользователя из базы """
+    settings.JWT_USER_CACHE = {'MODE': 'cached', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    settings.PROFILE_RESPONSE_CACHE = {'ENABLED': False, 'TIMEOUT': 60}
+    token = UserClaimsRefreshToken.for_user(user_first).access_token
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    with django_assert_num_queries(2):
+        assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 200
+    with django_assert_num_queries(1):
+        assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 200
+
+
+@pytest.mark.django_db
+def test_cached_jwt_authentication_invalidated_on_user_save(api_client, settings, user_first, first_user_profile):
+    """ Тест: изменение пользователя сбрасывает кэш, деактивированный пользователь не проходит проверку """
+    settings.JWT_USER_CACHE = {'MODE': 'cached', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    token = UserClaimsRefreshToken.for_user(user_first).access_token
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 200
+    user_first.is_active = False
+    user_first.save()
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 401
+
+
+@pytest.mark.django_db
+def test_cached_jwt_authentication_invalidated_by_other_worker(api_client, settings, user_first, first_user_profile):
+    """ Тест: смена версии пользователя в общем кэше другим воркером сбрасывает запись в кэше процесса """
+    settings.JWT_USER_CACHE = {'MODE': 'cached', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    token = UserClaimsRefreshToken.for_user(user_first).access_token
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 200
+    # Другой воркер деактивирует пользователя: кэш этого процесса он не видит, только общий кэш
+    User.objects.filter(pk=user_first.pk).update(is_active=False)
+    cache.set(user_version_key(user_first.pk), 'other-worker')
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 401
+
+
+@pytest.mark.django_db
+def test_cached_jwt_authentication_reloads_user_on_claims_mismatch(settings, user_first):
+    """ Тест: токен, выданный после изменения прав, загружает пользователя из базы заново """
+    settings.JWT_USER_CACHE = {'MODE': 'cached', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    authentication = CachedJWTAuthentication()
+    assert authentication.get_user(UserClaimsRefreshToken.for_user(user_first).access_token).is_staff is False
+    User.objects.filter(pk=user_first.pk).update(is_staff=True)
+    user_first.is_staff = True
+    assert authentication.get_user(UserClaimsRefreshToken.for_user(user_first).access_token).is_staff is True
+
+
+@pytest.mark.django_db
+def test_stateless_jwt_authentication_builds_user_from_claims(settings, django_assert_num_queries, user_first):
+    """ Тест: в режиме stateless пользователь строится из полей токена без запроса к базе """
+    settings.JWT_USER_CACHE = {'MODE': 'stateless', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    token = UserClaimsRefreshToken.for_user(user_first).access_token
+    with django_assert_num_queries(0):
+        user = CachedJWTAuthentication().get_user(token)
+    assert user.pk == user_first.pk
+    assert user.username == user_first.username
+    assert user.is_staff is False
+    assert user.is_authenticated
+
+
+# Тесты для асинхронных представлений входа и ввода кода верификации
+
+@pytest.fixture
+def async_request_factory():
+    """ Фикстура фабрики асинхронных запросов """
+    return AsyncRequestFactory()
+
+
+@pytest.mark.django_db
+def test_async_user_login_api(async_request_factory):
+    """ Тест асинхронного входа нового пользователя и получения кода верификации """
+    request = async_request_factory.post('/user_login/', {'phone_number': '+79999999992'},
+                                         content_type='application/json')
+    response = async_to_sync(AsyncUserProfileLoginAPI.as_view())(request)
+    assert response.status_code == 200
+    assert UserProfile.objects.filter(phone_number='+79999999992').exists()
+
+
+@pytest.mark.django_db
+def test_async_input_correct_verification_code_api(settings, async_request_factory, user_first,
+                                                   correct_verification_code):
+    """ Тест асинхронного ввода корректного кода верификации """
+    settings.VERIFICATION_DELAY = 0
+    data = {'phone_number': user_first.username, 'entered_code': correct_verification_code}
+    request = async_request_factory.post('/input_verification_code/', data, content_type='application/json')
+    response = async_to_sync(AsyncInputVerificationCodeAPI.as_view())(request)
+    assert response.status_code == 200
+    assert json.loads(response.content)['message'] == 'Вход выполнен успешно'
+
+
+@pytest.mark.django_db
+def test_async_input_incorrect_verification_code_api(settings, async_request_factory, user_first,
+                                                     first_user_profile):
+    """ Тест асинхронного ввода некорректного кода верификации """
+    settings.VERIFICATION_DELAY = 0
+    data = {'phone_number': user_first.username, 'entered_code': '0000'}
+    request = async_request_factory.post('/input_verification_code/', data, content_type='application/json')
+    response = async_to_sync(AsyncInputVerificationCodeAPI.as_view())(request)
+    assert response.status_code == 400
+    assert json.loads(response.content)['error'] == 'Неверный код верификации'
+
+
+@pytest.mark.django_db
+def test_async_incorrect_phone_number_api(async_request_factory, incorrect_phone_number):
+    """ Тест асинхронного входа по некорректному номеру телефона """
+    request = async_request_factory.post('/user_login/', {'phone_number': incorrect_phone_number},
+                                         content_type='application/json')
+    response = async_to_sync(AsyncUserProfileLoginAPI.as_view())(request)
+    assert response.status_code == 400
+    assert json.loads(response.content) == ['Введите номер телефона в формате +79999999999']
+
+
+# Тесты для команд управления
+
+@pytest.mark.django_db
+def test_explain_queries_command(first_user_profile):
+    """ Тест команды печати планов выполнения основных запросов """
+    out = StringIO()
+    call_command('explain_queries', stdout=out)
+    output = out.getvalue()
+    assert 'Профиль по реферальному коду' in output
+    assert 'Страница списка профилей' in output
+
+
+@pytest.mark.django_db
+def test_repair_referral_counters_command(referral_network):
+    """ Тест команды пересчёта счётчиков рефералов: расхождения находятся и исправляются """
+    UserProfile.objects.filter(pk=referral_network[0].pk).update(referral_count=7, referred_phone_numbers='')
+    out = StringIO()
+    call_command('repair_referral_counters', '--chunk-size', '7', '--dry-run', stdout=out)
+    assert 'расхождений найдено: 1' in out.getvalue()
+
+    call_command('repair_referral_counters', '--chunk-size', '7', stdout=out)
+    assert 'Проверено профилей: 60, расхождений исправлено: 1' in out.getvalue()
+    referral_network[0].refresh_from_db()
+    assert referral_network[0].referral_count == 1
+    assert referral_network[0].referred_phone_number_list == [referral_network[1].phone_number]
+
+
+@pytest.mark.django_db
+def test_import_users_command_csv(tmp_path, user_first, first_user_profile):
+    """ Тест импорта пользователей из CSV: некорректные и существующие номера пропускаются """
+    path = tmp_path / 'users.csv'
+    path.write_text('phone_number\n+79990000001\n8712831\n+79996691554\n+7 999 000-00-02\n+79990000001\n')
+    out = StringIO()
+    call_command('import_users', str(path), '--chunk-size', '2', stdout=out)
+    assert 'создано 2, пропущено существующих 2, некорректных номеров 1' in out.getvalue()
+
+    profile = UserProfile.objects.select_related('user').get(phone_number='+79990000002')
+    assert profile.user.username == '+79990000002'
+    assert not profile.user.has_usable_password()
+    assert UserProfile.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_import_users_command_replaces_legacy_referral_codes(tmp_path):
+    """ Тест импорта: профиль, чей код совпал с ранее выданным, создаётся со свободным кодом """
+    legacy_users = [User.objects.create_user(username=f'+7999600009{index}') for index in range(2)]
+    # Коды, которые распределитель выдал бы первому и третьему импортируемому пользователю
+    legacy_codes = [generate_referral_code(legacy_users[-1].pk + offset) for offset in (1, 3)]
+    for user, code in zip(legacy_users, legacy_codes):
+        UserProfile.objects.create(user=user, phone_number=user.username, user_referral_code=code)
+    path = tmp_path / 'users.csv'
+    path.write_text('phone_number\n' + '\n'.join(f'+7999600000{index}' for index in range(1, 5)) + '\n')
+    out = StringIO()
+    call_command('import_users', str(path), stdout=out)
+    assert 'создано 4' in out.getvalue()
+    codes = list(UserProfile.objects.values_list('user_referral_code', flat=True))
+    assert len(codes) == 6 and len(set(codes)) == 6
+    assert UserProfile.objects.get(phone_number='+79996000001').user_referral_code not in legacy_codes
+
+
+@pytest.mark.django_db
+def test_import_users_command_ndjson_resume(tmp_path):
+    """ Тест импорта из NDJSON с продолжением с контрольной точки """
+    path = tmp_path / 'users.ndjson'
+    path.write_text('\n'.join(json.dumps({'phone_number': f'+7999000000{index}'}) for index in range(5)))
+    checkpoint = tmp_path / 'import.checkpoint'
+    checkpoint.write_text('3')
+    call_command('import_users', str(path), '--checkpoint', str(checkpoint), stdout=StringIO())
+    assert sorted(User.objects.values_list('username', flat=True)) == ['+79990000003', '+79990000004']
+    assert not checkpoint.exists()
+
+
+# Тесты для прогрева воркера
+
+def test_warmup_preloads_modules():
+    """ Тест: прогрев выполняет все шаги и замораживает объекты для сборщика мусора """
+    try:
+        timings = warmup()
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert {'phonenumbers', 'urlconf', 'serializers', 'referral_codes'} <= set(timings)
+
+
+def test_profile_startup_command():
+    """ Тест команды профилирования холодного старта """
+    out = StringIO()
+    call_command('profile_startup', '--top', '3', '--no-docs', stdout=out)
+    output = out.getvalue()
+    assert 'Первый запрос GET /user_login/ (статус 405)' in output
+    assert 'drf_yasg' not in output
+
+
+# Тесты для генератора нагрузки
+
+def test_synthesize_records_deterministic():
+    """ Тест генерации входов: одинаковое начальное значение даёт одинаковые записи, ввод кода идёт за входом """
+    records = synthesize_records(200, 'login-verify', seed=3, repeat_ratio=0.3, invalid_ratio=0.05)
+    assert records == synthesize_records(200, 'login-verify', seed=3, repeat_ratio=0.3, invalid_ratio=0.05)
+    assert records != synthesize_records(200, 'login-verify', seed=4, repeat_ratio=0.3, invalid_ratio=0.05)
+
+    logins = [record for record in records if record['path'] == '/user_login/']
+    assert len(logins) == 200
+    valid = [record for record in logins if record.get('session') is not None]
+    assert len(records) == len(logins) + len(valid)
+    phone_numbers = [record['body']['phone_number'] for record in records
+                     if record['path'] == '/input_verification_code/']
+    assert len(set(phone_numbers)) < len(phone_numbers)
+    sessions = group_sessions(records)
+    assert len(sessions) == len(logins)
+    assert all([record['path'] for _, record in session] == ['/user_login/', '/input_verification_code/']
+               for session in sessions if len(session) > 1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_loadgen_threads_login_verify():
+    """ Тест прогона входов с вводом кода в потоках: ответы сгруппированы по именам URL """
+    records = synthesize_records(10, 'login-verify', seed=1, repeat_ratio=0, invalid_ratio=0)
+    # Номера с 8 вместо +7 валидатор отклоняет: такие сессии исключаются
+    rejected = {record['session'] for record in records if record['body']['phone_number'].startswith('8')}
+    records = [record for record in records if record['session'] not in rejected]
+    # SQLite в памяти блокирует таблицу на всю транзакцию записи, поэтому пользователи создаются
+    # заранее: потоки только читают базу
+    for record in records:
+        if record['path'] == '/user_login/':
+            create_phone_user_profile(record['body']['phone_number'])
+    results = run_threads(records, 2, 0, 'wsgi')
+    summary = summarize(results, 1.0)
+    assert set(summary) == {'user_login', 'input_verification_code', 'всего'}
+    assert summary['всего']['requests'] == len(records)
+    assert summary['input_verification_code']['statuses'] == {200: len(records) // 2}
+    assert summary['всего']['error_rate'] == 0
+    assert User.objects.count() == len(records) // 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_loadgen_command_asgi_asyncio(tmp_path, user_first, first_user_profile):
+    """ Тест команды loadgen: записи из JSONL с токеном по номеру телефона через ASGI в задачах asyncio """
+    path = tmp_path / 'traffic.jsonl'
+    path.write_text('\n'.join(json.dumps(record) for record in [
+        {'method': 'GET', 'path': f'/userprofiles/{first_user_profile.pk}/',
+         'auth': {'phone_number': user_first.username}},
+        {'method': 'GET', 'path': '/userprofiles/?page_size=5', 'auth': {'phone_number': user_first.username}},
+        {'method': 'GET', 'path': '/userprofiles/'},
+        {'method': 'POST', 'path': '/user_login/', 'body': {'phone_number': '8712831'}, 'remote_addr': '10.0.0.7'},
+    ]) + '\n')
+    out = StringIO()
+    call_command('loadgen', '--input', str(path), '--mode', 'asyncio', '--app', 'asgi', '--workers', '2',
+                 '--json', stdout=out)
+    summary = json.loads(out.getvalue())
+    assert summary['userprofile-detail']['statuses'] == {'200': 1}
+    assert summary['userprofile-list']['statuses'] == {'200': 2}
+    assert summary['user_login']['error_rate'] == 1
+    assert summary['всего']['requests'] == 4
+
+
+def test_loadgen_processes_with_rate():
+    """ Тест прогона в процессах с целевой частотой: задержка отсчитывается от расписания """
+    records = [{'method': 'GET', 'path': '/user_login/'}, {'method': 'GET', 'path': '/not-found/'}] * 4
+    results = run_processes(records, 2, 200, 'wsgi')
+    summary = summarize(results, 0.04)
+    assert summary['user_login']['statuses'] == {405: 4}
+    assert summary['unresolved']['statuses'] == {404: 4}
+    assert summary['всего']['throughput'] == 200
+
+
+def test_read_records_and_prepare(tmp_path):
+    """ Тест чтения JSONL: пустые строки пропускаются, заголовок Authorization сохраняется """
+    path = tmp_path / 'traffic.jsonl'
+    path.write_text('{"method": "GET", "path": "/", "auth": "Bearer x"}\n\n')
+    assert prepare_records(read_records(path)) == [{'method': 'GET', 'path': '/', 'auth': 'Bearer x'}]
+    assert run_asyncio([], 3, 0, 'wsgi') == []
+
+
+# Тесты для метрик запросов
+
+@pytest.mark.django_db
+def test_metrics_server_timing_and_endpoint(api_client, settings, jwt_token_for_first_user, first_user_profile):
+    """ Тест: ответ содержит Server-Timing с числом запросов к базе, /metrics/ отдаёт гистограммы представления """
+    settings.METRICS = dict(settings.METRICS, SERVER_TIMING=True)
+    api_client.credentials(HTTP_AUTHORIZATION=jwt_token_for_first_user)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(f'/userprofiles/{first_user_profile.pk}/')
+    assert response.status_code == 200
+    queries = len(context.captured_queries)
+    server_timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+    assert set(server_timing) == {'total', 'db', 'render'}
+    assert f'desc="{queries} queries"' in server_timing['db']
+
+    response = api_client.get('/metrics/')
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = response.content.decode()
+    label = 'view="authorization_service:userprofile-detail",method="GET"'
+    assert f'http_request_duration_seconds_count{{{label}}} 1' in text
+    assert f'http_request_db_queries_bucket{{{label},le="{queries}"}} 1' in text
+    assert f'http_request_db_queries_bucket{{{label},le="{queries - 1}"}} 0' in text
+    assert f'http_response_size_bytes_sum{{{label}}} ' in text
+    assert '# TYPE http_response_render_duration_seconds histogram' in text
+
+
+@pytest.mark.django_db
+def test_metrics_async_client_and_unresolved(settings, incorrect_phone_number):
+    """ Тест метрик в асинхронном стеке и для ненайденных путей """
+    settings.METRICS = dict(settings.METRICS, SERVER_TIMING=True)
+    client = AsyncClient()
+    response = async_to_sync(client.post)('/user_login/', {'phone_number': incorrect_phone_number})
+    assert response.status_code == 400
+    assert response['Server-Timing'].startswith('total;dur=')
+    async_to_sync(client.generic)('BREW', '/no-such-page/')
+    collected = registry.collect()
+    assert collected[('authorization_service:user_login', 'POST')][0][0][-1] == 0
+    assert sum(collected[('unresolved', 'other')][0][0]) == 1
+
+
+@pytest.mark.django_db
+def test_metrics_count_queries_under_asgi(settings):
+    """ Тест: под ASGI учитываются запросы к базе из потоков sync_to_async """
+    settings.METRICS = dict(settings.METRICS, SERVER_TIMING=True)
+    response = async_to_sync(AsyncClient().post)('/user_login/', {'phone_number': '+79995000001'})
+    assert response.status_code == 200
+    assert UserProfile.objects.filter(phone_number='+79995000001').exists()
+    assert 'desc="0 queries"' not in response['Server-Timing']
+    counts, _ = registry.collect()[('authorization_service:user_login', 'POST')][1]
+    assert counts[0] == 0 and sum(counts) == 1
+
+
+@pytest.mark.django_db
+def test_metrics_hidden_from_external_clients(client, settings, user_first):
+    """ Тест: Server-Timing выключен по умолчанию и не отдаётся внешним адресам, /metrics/ закрыт для них """
+    response = client.post('/user_login/', {'phone_number': user_first.username})
+    assert response.status_code == 200
+    assert not response.has_header('Server-Timing')
+
+    settings.METRICS = dict(settings.METRICS, SERVER_TIMING=True)
+    external_client = Client(REMOTE_ADDR='203.0.113.5')
+    response = external_client.post('/user_login/', {'phone_number': user_first.username},
+                                    HTTP_X_FORWARDED_FOR='127.0.0.1')
+    assert not response.has_header('Server-Timing')
+    assert external_client.get('/metrics/', HTTP_X_FORWARDED_FOR='127.0.0.1').status_code == 403
+
+    settings.METRICS = dict(settings.METRICS, INTERNAL_IPS=['203.0.113.0/24'])
+    assert Client(REMOTE_ADDR='203.0.113.5').get('/metrics/').status_code == 200
+
+
+def test_metrics_registry_threads():
+    """ Тест: счётчики потоков суммируются при чтении, границы корзин включаются в корзину """
+    metrics = MetricsRegistry((('queries', 'Запросы', (1, 5)),))
+
+    def observe():
+        for value in (0, 1, 2, 5, 6):
+            metrics.observe(('view', 'GET'), (value,))
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.collect() == {('view', 'GET'): [[[8, 8, 4], 56.0]]}
+    assert 'queries_bucket{view="view",method="GET",le="5"} 16' in metrics.render()
+    assert 'queries_count{view="view",method="GET"} 20' in metrics.render()
+
+
+# Тесты для чтения с реплик
+
+@pytest.fixture
+def replica_database(transactional_db, tmp_path, settings, first_user_profile, second_user_profile):
+    """ Фикстура реплики: копия основной тестовой базы в отдельном файле SQLite с псевдонимом replica
+
+    Изменения основной базы после создания фикстуры в реплику не попадают, как при отставании репликации.
+    """
+    path = tmp_path / 'replica.sqlite3'
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    connection.connection.backup(target)
+    target.close()
+    connections.settings['replica'] = dict(connections.settings['default'], NAME=str(path))
+    settings.DATABASE_ROUTING = dict(settings.DATABASE_ROUTING, REPLICAS=['replica'])
+    settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=False)
+    yield 'replica'
+    connections['replica'].close()
+    del connections['replica']
+    del connections.settings['replica']
+
+
+def test_replica_router_reads_and_writes(replica_database, settings, api_client, user_first, first_user_profile,
+                                         second_user_profile):
+    """ Тест: GET читает с реплики, запись идёт на основную базу и закрепляет клиента за ней """
+    url = f'/userprofiles/{first_user_profile.id}/'
+    api_client.force_authenticate(user=user_first)
+    with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(connections['replica']) as replica:
+        assert api_client.get(url).status_code == 200
+    assert replica.captured_queries and not primary.captured_queries
+
+    response = api_client.put(url, {'referral_code': second_user_profile.user_referral_code})
+    assert response.status_code == 200
+    cookie = response.cookies[settings.DATABASE_ROUTING['COOKIE_NAME']]
+    assert cookie.value == '1' and cookie['max-age'] == 5
+    # Клиент с cookie видит свою запись, остальные до догона реплики читают старые данные
+    assert api_client.get(url).data['activated_referral_code'] == second_user_profile.user_referral_code
+    other_client = APIClient()
+    other_client.force_authenticate(user=user_first)
+    assert other_client.get(url).data['activated_referral_code'] is None
+    assert UserProfile.objects.get(pk=first_user_profile.pk).activated_referral_code is not None
+
+
+def test_replica_router_outside_requests(replica_database, user_first):
+    """ Тест: вне HTTP-запросов, в транзакциях и при миграциях используется только основная база """
+    replica_router = ReplicaRouter()
+    assert router.db_for_read(User) == 'default'
+    assert replica_router.db_for_write(User) == 'default'
+    assert replica_router.allow_migrate('replica', 'users') is False
+    assert replica_router.allow_migrate('default', 'users') is None
+    assert replica_router.allow_relation(User.objects.using('replica').get(pk=user_first.pk), user_first) is True
+    with transaction.atomic():
+        assert router.db_for_read(User) == 'default'
+
+
+# Тесты для выдачи, обновления и отзыва токенов
+
+@pytest.mark.django_db
+def test_verification_code_returns_token_pair_and_refresh_rotates(client, user_first, correct_verification_code):
+    """ Тест: ввод кода выдаёт пару токенов, обновление выдаёт новую пару и отзывает старый refresh-токен """
+    response = client.post('/input_verification_code/',
+                           {'phone_number': user_first.username, 'entered_code': correct_verification_code})
+    assert response.status_code == 200
+    refresh_token = response.data['refresh_token']
+
+    response = client.post('/users/token/refresh/', {'refresh': refresh_token})
+    assert response.status_code == 200
+    rotated = response.data
+    assert rotated['refresh'] != refresh_token
+    assert UserClaimsRefreshToken(rotated['refresh'])['sid'] == UserClaimsRefreshToken(refresh_token)['sid']
+    assert AccessToken(rotated['access'])['username'] == user_first.username
+
+    # Повторное использование старого токена отзывает всю сессию
+    assert client.post('/users/token/refresh/', {'refresh': refresh_token}).status_code == 401
+    assert client.post('/users/token/refresh/', {'refresh': rotated['refresh']}).status_code == 401
+    response = client.get('/userprofiles/', HTTP_AUTHORIZATION=f'Bearer {rotated["access"]}')
+    assert response.status_code == 401
+
+
+@pytest.mark.django_db
+def test_logout_revokes_session_without_db_queries(api_client, settings, django_assert_num_queries, user_first,
+                                                   first_user_profile):
+    """ Тест выхода: access- и refresh-токены сессии отклоняются, проверка отзыва не обращается к базе """
+    settings.JWT_USER_CACHE = {'MODE': 'stateless', 'TIMEOUT': 60, 'MAX_ENTRIES': 100}
+    refresh = UserClaimsRefreshToken.for_user(user_first)
+    other_session = UserClaimsRefreshToken.for_user(user_first)
+    access = str(refresh.access_token)
+    with django_assert_num_queries(0):
+        assert CachedJWTAuthentication().get_validated_token(access.encode())['sid'] == refresh['sid']
+
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+    response = api_client.post('/logout/', {'refresh_token': str(refresh)})
+    assert response.status_code == 200
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 401
+    assert api_client.post('/users/token/refresh/', {'refresh': str(refresh)}).status_code == 401
+    with django_assert_num_queries(0):
+        with pytest.raises(InvalidToken):
+            CachedJWTAuthentication().get_validated_token(str(refresh.access_token).encode())
+
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {other_session.access_token}')
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 200
+    api_client.credentials()
+    assert api_client.post('/logout/', {'refresh_token': 'broken'}).status_code == 400
+    assert api_client.post('/logout/', {}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_logout_survives_cache_eviction(api_client, user_first, first_user_profile):
+    """ Тест: заполнение кэша не возвращает отозванным токенам силу """
+    refresh = UserClaimsRefreshToken.for_user(user_first)
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+    assert api_client.post('/logout/', {'refresh_token': str(refresh)}).status_code == 200
+    for index in range(400):
+        cache.set(f'unrelated:{index}', index)
+    assert api_client.get(f'/userprofiles/{first_user_profile.id}/').status_code == 401
+    assert api_client.post('/users/token/refresh/', {'refresh': str(refresh)}).status_code == 401
+
+
+def test_cache_revocation_store_refuses_unshared_cache(settings):
+    """ Тест: хранилище отзыва в локальном или вытесняющем кэше не принимается (запуск не состоится) """
+    settings.TOKEN_REVOCATION = {'BACKEND': 'authorization_service.revocation.CacheTokenRevocationStore'}
+    get_token_revocation_store.cache_clear()
+    with pytest.raises(ImproperlyConfigured):
+        get_token_revocation_store()
+    settings.TOKEN_REVOCATION = {'BACKEND': 'authorization_service.revocation.LocMemTokenRevocationStore'}
+    get_token_revocation_store.cache_clear()
+    assert isinstance(get_token_revocation_store(), LocMemTokenRevocationStore)
+
+
+@pytest.mark.parametrize('store_class', [LocMemTokenRevocationStore, CacheTokenRevocationStore])
+def test_token_revocation_stores(store_class):
+    """ Тест хранилищ отозванных токенов: повторный отзыв не проходит, записи истекают вместе с токеном """
+    store = store_class()
+    now = time.time()
+    assert store.revoke('0f' * 16, now + 60) is True
+    assert store.revoke('0f' * 16, now + 60) is False
+    assert store.is_revoked('aa' * 16, '0f' * 16)
+    assert not store.is_revoked('aa' * 16)
+    assert store.revoke('not-hex', now - 1) is True
+    assert not store.is_revoked('not-hex')
@@ -0,0 +1,59 @@
+""" JWT-токены сервиса authorization_service """
+from uuid import uuid4
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authorization_service.revocation import is_token_revoked, revoke_session, revoke_token
+
+
+class UserClaimsRefreshToken(RefreshToken):
+    """ Refresh-токен с номером телефона, признаком администратора и идентификатором сессии
+
+    Эти поля копируются и в access-токен, что позволяет восстановить
+    пользователя без запроса к базе (режим stateless в CachedJWTAuthentication),
+    а по sid — отозвать все токены одного входа.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.get_username()
+        token['is_staff'] = user.is_staff
+        token['sid'] = uuid4().hex
+        return token
+
+
+def issue_token_pair(user):
+    """ Пара токенов новой сессии для ответа на ввод кода верификации """
+    refresh = UserClaimsRefreshToken.for_user(user)
+    return {'access_token': str(refresh.access_token), 'refresh_token': str(refresh)}
+
+
+class UserClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """ Выдача пары токенов по логину и паролю с дополнительными полями пользователя """
+    token_class = UserClaimsRefreshToken
+
+
+class RevocationCheckingTokenRefreshSerializer(TokenRefreshSerializer):
+    """ Обновление пары токенов с проверкой отзыва и отзывом использованного refresh-токена
+
+    При ротации старый refresh-токен отзывается. Повторное предъявление уже
+    использованного токена означает, что им владеет кто-то ещё, поэтому
+    отзывается вся сессия.
+    """
+    token_class = UserClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_token_revoked(refresh):
+            if api_settings.ROTATE_REFRESH_TOKENS:
+                revoke_session(refresh)
+            raise InvalidToken(_('Token is blacklisted'))
+        # Из одновременных обновлений одним токеном проходит только одно
+        if api_settings.ROTATE_REFRESH_TOKENS and not revoke_token(refresh):
+            raise InvalidToken(_('Token is blacklisted'))
+        return super().validate(attrs)
@@ -0,0 +1,67 @@
+""" Внутрипроцессный LRU-кэш с временем жизни записей """
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """ Потокобезопасный LRU-кэш с ограничением числа записей и временем жизни
+
+    Просроченные записи удаляются лениво: при чтении и при вытеснении.
+    """
+
+    def __init__(self, max_entries=10000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        """ Получение значения; обращение делает запись самой свежей """
+        with self.lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """ Сохранение значения на timeout секунд (по умолчанию — на self.timeout) """
+        timeout = self.timeout if timeout is None else timeout
+        with self.lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def pop(self, key, default=None):
+        """ Удаление записи с возвратом её значения, если она ещё не просрочена """
+        with self.lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING or item[0] <= time.monotonic():
+            return default
+        return item[1]
+
+    def clear(self):
+        with self.lock:
+            self._data.clear()
+
+    def _evict(self):
+        """ Удаление просроченных записей из начала очереди и вытеснение самых старых """
+        now = time.monotonic()
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now and len(self._data) <= self.max_entries:
+                break
+            del self._data[key]
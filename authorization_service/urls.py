@@ -1,15 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from authorization_service.apps import AuthorizationServiceConfig
+from authorization_service.metrics import metrics_view
+from authorization_service.async_views import AsyncUserProfileLoginAPI, AsyncInputVerificationCodeAPI
 from authorization_service.views import UserProfileLoginAPI, \
-    InputVerificationCodeAPI, UserProfileViewSet
+    InputVerificationCodeAPI, LogoutAPI, UserProfileViewSet
 
 app_name = AuthorizationServiceConfig.name
 router = DefaultRouter()
 router.register(r'userprofiles', UserProfileViewSet, basename='userprofile')
 
+if settings.ASYNC_AUTH_VIEWS:
+    login_view, verification_view = AsyncUserProfileLoginAPI, AsyncInputVerificationCodeAPI
+else:
+    login_view, verification_view = UserProfileLoginAPI, InputVerificationCodeAPI
+
 urlpatterns = [
-    path('user_login/', UserProfileLoginAPI.as_view(), name='user_login'),
-    path('input_verification_code/', InputVerificationCodeAPI.as_view(), name='input_verification_code'),
+    path('user_login/', login_view.as_view(), name='user_login'),
+    path('input_verification_code/', verification_view.as_view(), name='input_verification_code'),
+    path('logout/', LogoutAPI.as_view(), name='logout'),
+    path('metrics/', metrics_view, name='metrics'),
 ] + router.urls
@@ -1,6 +1,21 @@
+import functools
 import random
-import string
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Concat
+from django.utils.crypto import get_random_string
+
+from authorization_service.leaderboard import record_referrals
 from authorization_service.models import UserProfile
+from authorization_service.referral_codes import get_referral_code_allocator, CODE_SPACE
+from authorization_service.response_cache import invalidate_profile_responses
+from authorization_service.sms import send_password
+from users.models import User
 
 
 def generate_verification_code():
@@ -10,18 +25,95 @@ def generate_verification_code():
 
 def send_password_to_user(phone_number, password):
     """ Отправка сообщения с новым паролем на указанный номер телефона """
-    pass
+    send_password(phone_number, password)
 
 
-def generate_referral_code():
-    """Генерация случайного реферального кода в виде строки"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+@functools.lru_cache(maxsize=None)
+def get_password_hashing_executor():
+    """ Пул потоков для хэширования паролей вне потока запроса (создаётся при первом обращении) """
+    return ThreadPoolExecutor(max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing')
 
 
-def get_verification_code_from_db(user):
-    """ Метод для получения кода верификации из базы данных """
+def store_password_hash(user_pk, password):
+    """ Хэширование пароля и запись хэша пользователю (выполняется в пуле потоков) """
     try:
-        profile = UserProfile.objects.get(user=user)
-        return profile.verification_code
-    except UserProfile.DoesNotExist:
-        return 'Неверный код верификации'
+        User.objects.filter(pk=user_pk).update(password=make_password(password))
+    finally:
+        connection.close()  # У каждого потока пула своё соединение с базой
+
+
+def create_phone_user(phone_number):
+    """ Создание пользователя, входящего по номеру телефона
+
+    В режиме PASSWORDLESS_SIGNUP пользователь создаётся с непригодным паролем:
+    вход выполняется только по коду верификации, и дорогое хэширование не нужно.
+    Иначе пользователю отправляется пароль, а его хэш вычисляется в пуле потоков
+    после фиксации транзакции; до этого пароль непригоден.
+    """
+    user = User.objects.create_user(username=phone_number, password=None)
+    if not settings.PASSWORDLESS_SIGNUP:
+        password = get_random_string(6)
+        send_password_to_user(phone_number, password)  # Отправка сообщения о новом пароле
+        transaction.on_commit(lambda: get_password_hashing_executor().submit(store_password_hash, user.pk, password))
+    return user
+
+
+def generate_referral_code(sequence):
+    """Уникальный реферальный код для порядкового номера (первичного ключа пользователя)"""
+    return get_referral_code_allocator().code_for(sequence)
+
+
+# Число попыток создать профиль, если реферальный код уже занят
+REFERRAL_CODE_ATTEMPTS = 5
+
+
+def fallback_referral_code():
+    """ Случайный код из верхней половины пространства кодов, куда не попадают коды первичных ключей
+
+    Выдаётся вместо кода по первичному ключу, совпавшего с кодом, выданным до
+    перехода на распределитель кодов.
+    """
+    return generate_referral_code(CODE_SPACE // 2 + secrets.randbelow(CODE_SPACE - CODE_SPACE // 2))
+
+
+def create_phone_user_profile(phone_number):
+    """ Создание пользователя и его профиля с реферальным кодом в одной транзакции
+
+    Код по первичному ключу может совпасть с кодом, выданным до перехода на
+    распределитель кодов. Тогда транзакция откатывается, и пользователь
+    создаётся заново с кодом fallback_referral_code. Пользователь без профиля
+    не остаётся.
+    """
+    fallback_code = None
+    for _ in range(REFERRAL_CODE_ATTEMPTS):
+        referral_code = None
+        try:
+            with transaction.atomic():
+                user = create_phone_user(phone_number)
+                referral_code = fallback_code or generate_referral_code(user.pk)
+                return UserProfile.objects.create(user=user, phone_number=phone_number,
+                                                  user_referral_code=referral_code)
+        except IntegrityError:
+            # Остальные нарушения уникальности (например, номер уже занят) не повторяются
+            if referral_code is None or not UserProfile.objects.filter(user_referral_code=referral_code).exists():
+                raise
+        fallback_code = fallback_referral_code()
+    raise IntegrityError('Не удалось подобрать свободный реферальный код')
+
+
+def increment_referral_counters(referrer_pk, phone_numbers):
+    """ Атомарное обновление счётчика и списка рефералов пригласившего профиля одним UPDATE """
+    updates = {'user_referred_code_used': True, 'referral_count': F('referral_count') + len(phone_numbers)}
+    if settings.REFERRAL_CACHE_PHONE_NUMBERS:
+        appended = ','.join(phone_numbers)
+        updates['referred_phone_numbers'] = Case(
+            When(referred_phone_numbers='', then=Value(appended)),
+            default=Concat(F('referred_phone_numbers'), Value(',' + appended), output_field=TextField()),
+            output_field=TextField(),
+        )
+    updated = UserProfile.objects.filter(pk=referrer_pk).update(**updates)
+    # UPDATE не отправляет сигналы, поэтому кэшированные ответы сбрасываются явно
+    invalidate_profile_responses([referrer_pk])
+    if updated:
+        transaction.on_commit(functools.partial(record_referrals, referrer_pk, len(phone_numbers)))
+    return updated
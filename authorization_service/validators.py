@@ -1,15 +1,44 @@
-from phonenumbers import parse as parse_phone, is_valid_number
+import functools
+import re
+
+from phonenumbers import parse as parse_phone, is_valid_number, format_number, PhoneNumberFormat, \
+    NumberParseException
 from rest_framework.serializers import ValidationError
 
+INVALID_FORMAT_MESSAGE = 'Введите номер телефона в формате +79999999999'
+INVALID_NUMBER_MESSAGE = 'Неверный номер телефона'
+
+# Российские мобильные номера +79XXXXXXXXX уже в формате E.164 и всегда валидны
+# по метаданным phonenumbers, поэтому проверяются без разбора
+FAST_PATH_RE = re.compile(r'\+79\d{9}')
+
+# Размер кэша результатов разбора остальных номеров
+PHONE_NUMBER_CACHE_SIZE = 10000
+
+
+@functools.lru_cache(maxsize=PHONE_NUMBER_CACHE_SIZE)
+def parse_phone_number(value):
+    """ Разбор номера телефона: (номер в формате E.164, None) или (None, сообщение об ошибке) """
+    try:
+        parsed_number = parse_phone(value, None)  # Анализ номера телефона без указания страны
+    except NumberParseException:
+        return None, INVALID_FORMAT_MESSAGE
+    if not is_valid_number(parsed_number):  # Проверка валидности номера телефона
+        return None, INVALID_NUMBER_MESSAGE
+    return format_number(parsed_number, PhoneNumberFormat.E164), None
+
+
 class PhoneNumberValidator:
-    """ Валидатор для номера телефона """
+    """ Валидатор для номера телефона, возвращает номер в формате E.164 """
     def __init__(self):
         pass
 
     def __call__(self, value):
-        try:
-            parsed_number = parse_phone(value, None)  # Анализ номера телефона без указания страны
-            if not is_valid_number(parsed_number):  # Проверка валидности номера телефона
-                raise ValidationError('Неверный номер телефона')
-        except Exception as e:
-            raise ValidationError('Введите номер телефона в формате +79999999999')
+        if not isinstance(value, str):
+            raise ValidationError(INVALID_FORMAT_MESSAGE)
+        if FAST_PATH_RE.fullmatch(value):
+            return value
+        phone_number, error = parse_phone_number(value)
+        if error:
+            raise ValidationError(error)
+        return phone_number
@@ -1,25 +1,35 @@
 """ Представления для сервиса authorization_service"""
 import time
 
+from django.conf import settings
 from django.core.validators import ValidationError as DjangoValidationError
-from django.shortcuts import get_object_or_404
-from django.utils.crypto import get_random_string
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
+from django.db import router
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import NotFound
 from rest_framework.permissions import (IsAuthenticated, AllowAny,
                                         IsAdminUser, IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
 
+from authorization_service.code_store import get_verification_code_store, CODE_VERIFIED, CODE_ATTEMPTS_EXCEEDED
+from authorization_service.export import iter_export, EXPORT_CONTENT_TYPES, EXPORT_FIELDS
+from authorization_service.leaderboard import get_readable_leaderboard
 from authorization_service.models import UserProfile
 from authorization_service.pagination import UserProfilePagination
 from authorization_service.permissions import IsOwner
-from authorization_service.serializers import UserProfileSerializer
-from authorization_service.utils import generate_verification_code, get_verification_code_from_db, \
-    send_password_to_user, generate_referral_code
+from authorization_service.ratelimit import PhoneNumberAndIPRateThrottle
+from authorization_service.referrals import activate_referral_code, bulk_activate_referral_codes, get_referral_tree, \
+    ACTIVATION_OK, ACTIVATION_MESSAGES, ACTIVATION_PROFILE_NOT_FOUND, ACTIVATION_FORBIDDEN, ACTIVATION_CODE_NOT_FOUND
+from authorization_service.response_cache import ProfileResponseCacheMixin
+from authorization_service.revocation import revoke_session
+from authorization_service.serializers import UserProfileSerializer, BulkReferralActivationSerializer
+from authorization_service.sms import send_verification_code
+from authorization_service.tokens import UserClaimsRefreshToken, issue_token_pair
+from authorization_service.utils import generate_verification_code, create_phone_user_profile
 from authorization_service.validators import PhoneNumberValidator
 from users.models import User
 
@@ -28,52 +38,26 @@ class UserProfileLoginAPI(APIView):
     """ Представление для входа в аккаунт и получения кода верификации
     params: {'phone_number': '+79999999999'}"""
     permission_classes = [AllowAny]
+    throttle_classes = [PhoneNumberAndIPRateThrottle]
+    rate_limit_scope = 'login'
 
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'phone_number': openapi.Schema(type=openapi.TYPE_STRING,
-                                               description='Номер телефона в формате +79999999999'),
-            }
-        ),
-        responses={200: 'OK', 400: 'Invalid Request'},
-        operation_description='Представление для входа в аккаунт и получения кода верификации'
-    )
     def post(self, request):
         """ Представление для входа в аккаунт и получения кода верификации """
         phone_number = request.data.get('phone_number')
 
         try:
             phone_number_validator = PhoneNumberValidator()
-            phone_number_validator(phone_number)
+            phone_number = phone_number_validator(phone_number)
         except DjangoValidationError as e:
             return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
         verification_code = generate_verification_code()
 
-        try:
-            user = User.objects.get(username=phone_number)
-            profile = UserProfile.objects.get(user=user)
-            profile.verification_code = verification_code
-            profile.save()
-            print(f'Код верификации для номера {phone_number}: {verification_code}')
-        except User.DoesNotExist:
+        if not User.objects.filter(username=phone_number).exists():
+            create_phone_user_profile(phone_number)
 
-            password = get_random_string(6)
-            print(f'Пароль для номера {phone_number}: {password}')
-            send_password_to_user(phone_number, password)  # Отправка сообщения о новом пароле
-
-            user = User.objects.create_user(username=phone_number, password=password)
-            referral_code = generate_referral_code()
-            profile = UserProfile.objects.create(
-                user=user,
-                phone_number=phone_number,
-                verification_code=verification_code,
-                user_referral_code=referral_code
-            )
-            profile.refresh_from_db()
-            print(f'Код верификации для номера {phone_number}: {verification_code}')
+        get_verification_code_store().issue(phone_number, verification_code)
+        send_verification_code(phone_number, verification_code)
 
         return Response({'message': 'Введите верификационный код из СМС для входа POST /input_verification_code/'})
 
@@ -82,28 +66,17 @@ class InputVerificationCodeAPI(APIView):
     """ Представление для ввода кода верификации
     params: {'phone_number': '+79999999999', 'entered_code': '1234'}"""
     permission_classes = [AllowAny]
+    throttle_classes = [PhoneNumberAndIPRateThrottle]
+    rate_limit_scope = 'verify'
 
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'phone_number': openapi.Schema(type=openapi.TYPE_STRING,
-                                               description='Номер телефона в формате +79999999999'),
-                'entered_code': openapi.Schema(type=openapi.TYPE_STRING,
-                                               description='Код верификации, полученный по СМС')
-            }
-        ),
-        responses={200: 'OK', 400: 'Invalid Request'},
-        operation_description='Представление для ввода кода верификации'
-    )
     def post(self, request):
         """ Представление для ввода кода верификации """
-        time.sleep(2)
+        time.sleep(settings.VERIFICATION_DELAY)
         username = request.data.get('phone_number')
 
         try:
             phone_number_validator = PhoneNumberValidator()
-            phone_number_validator(username)
+            username = phone_number_validator(username)
         except DjangoValidationError as e:
             return Response({'error': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -116,95 +89,156 @@ class InputVerificationCodeAPI(APIView):
         if entered_code == '':
             return Response({'error': 'Отсутствует код верификации'}, status=status.HTTP_400_BAD_REQUEST)
 
-        verification_code = get_verification_code_from_db(user=user)
-        if entered_code == verification_code:
+        result = get_verification_code_store().verify(username, entered_code)
+        if result == CODE_VERIFIED:
             user_profile = UserProfile.objects.filter(user=user).first()
             if user_profile:
-                refresh = RefreshToken.for_user(user)
-                access_token = str(refresh.access_token)
-                return Response({'access_token': access_token, 'message': 'Вход выполнен успешно'})
+                return Response({**issue_token_pair(user), 'message': 'Вход выполнен успешно'})
             raise NotFound("Профиль пользователя не найден")
+        if result == CODE_ATTEMPTS_EXCEEDED:
+            return Response({'error': 'Превышено число попыток ввода кода, запросите новый код'},
+                            status=status.HTTP_400_BAD_REQUEST)
         return Response({'error': 'Неверный код верификации'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class LogoutAPI(APIView):
+    """ Выход: отзыв всех токенов сессии
+    params: {'refresh_token': '...'} (необязателен при запросе с access-токеном)"""
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        """ Отзыв сессии refresh-токена из тела и access-токена запроса """
+        tokens = [request.auth] if request.auth is not None else []
+        if request.data.get('refresh_token'):
+            try:
+                tokens.append(UserClaimsRefreshToken(request.data['refresh_token']))
+            except TokenError:
+                return Response({'error': 'Некорректный или просроченный refresh-токен'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if not tokens:
+            return Response({'error': 'Отсутствует refresh-токен'}, status=status.HTTP_400_BAD_REQUEST)
+        for token in tokens:
+            revoke_session(token)
+        return Response({'message': 'Выход выполнен'})
+
+
+class UserProfileViewSet(ProfileResponseCacheMixin, viewsets.ModelViewSet):
     """ Представление для работы с профилями пользователей """
     serializer_class = UserProfileSerializer
-    queryset = UserProfile.objects.all().order_by('id')
+    queryset = UserProfile.objects.select_related('user', 'referrer').order_by('id')
     pagination_class = UserProfilePagination
 
-    def get_object_or_none(self):
-        queryset = self.filter_queryset(self.get_queryset())
-        filter_kwargs = {'id': self.kwargs['pk']}
-        try:
-            obj = queryset.get(**filter_kwargs)
-            if not self.request.user == obj.user:
-                return None
-            return obj
-        except UserProfile.DoesNotExist:
-            return None
-
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'referral_code': openapi.Schema(type=openapi.TYPE_STRING, description='Реферальный код')
-            }
-        ),
-        responses={200: 'OK', 400: 'Invalid Request'},
-        operation_description='Обновление профиля пользователя'
-    )
+    def get_queryset(self):
+        """ Рефералы загружаются одним запросом на страницу, а не отдельным запросом на профиль """
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve'] and not settings.REFERRAL_CACHE_PHONE_NUMBERS:
+            queryset = queryset.prefetch_related(
+                Prefetch('user__referrals', queryset=UserProfile.objects.select_related('user').order_by('id'),
+                         to_attr='referred_profiles')
+            )
+        return queryset
+
     def update(self, request, *args, **kwargs):
         """Обновление профиля пользователя"""
         referral_code = request.data.get('referral_code')
         if referral_code:
-            return self._handle_referral_code_update(request, referral_code, *args, **kwargs)
+            return self._handle_referral_code_update(request, referral_code)
         else:
             return super().update(request, *args, **kwargs)
 
-    def _handle_referral_code_update(self, request, referral_code, *args, **kwargs):
-        """Обработка обновления профиля пользователя с реферальным кодом"""
-        profile_2 = self.get_object_or_none()
-        profile = self.get_object()
-        if profile_2 is None:
-            return Response({'error': 'Профиль с таким реферальным кодом не найден'}, status=status.HTTP_404_NOT_FOUND)
-
-        if referral_code == profile.user_referral_code:
-            return Response({'error': 'Вы не можете использовать свой собственный реферальный код'},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        if profile.activated_referral_code == referral_code:
-            return Response({'error': 'Вы уже активировали этот реферальный код'},
+    def _handle_referral_code_update(self, request, referral_code):
+        """Активация реферального кода в профиле пользователя"""
+        result = activate_referral_code(self.kwargs['pk'], referral_code, user_id=request.user.pk)
+        if result == ACTIVATION_OK:
+            return Response({'message': ACTIVATION_MESSAGES[result]}, status=status.HTTP_200_OK)
+        if result in (ACTIVATION_PROFILE_NOT_FOUND, ACTIVATION_CODE_NOT_FOUND):
+            raise Http404
+        if result == ACTIVATION_FORBIDDEN:
+            self.permission_denied(request, message=IsOwner.message)
+        return Response({'error': ACTIVATION_MESSAGES[result]}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='bulk_activate')
+    def bulk_activate(self, request):
+        """ Массовая активация реферальных кодов по парам номер телефона - код (только для администраторов) """
+        serializer = BulkReferralActivationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+        results = bulk_activate_referral_codes([(item['phone_number'], item['referral_code']) for item in items],
+                                               chunk_size=settings.REFERRAL_BULK_ACTIVATION['CHUNK_SIZE'])
+        report = [
+            {'phone_number': item['phone_number'], 'referral_code': item['referral_code'], 'result': result,
+             'message': ACTIVATION_MESSAGES[result]}
+            for item, result in zip(items, results)
+        ]
+        activated = results.count(ACTIVATION_OK)
+        return Response({'activated': activated, 'failed': len(results) - activated, 'results': report})
+
+    @action(detail=True, methods=['get'], url_path='referral_tree')
+    def referral_tree(self, request, pk=None):
+        """ Реферальное дерево профиля: цепочка пригласивших и рефералы всех уровней до глубины ?depth= """
+        config = settings.REFERRAL_TREE
+        try:
+            depth = int(request.query_params.get('depth', config['DEFAULT_DEPTH']))
+        except ValueError:
+            depth = 0
+        if not 1 <= depth <= config['MAX_DEPTH']:
+            return Response({'error': f'Глубина должна быть целым числом от 1 до {config["MAX_DEPTH"]}'},
                             status=status.HTTP_400_BAD_REQUEST)
+        profile = self.get_object()
+        tree = get_referral_tree(profile.pk, depth, config['MAX_NODES'])
+        return Response({'id': profile.pk, 'phone_number': profile.phone_number, 'depth': depth, **tree})
 
-        referred_by = get_object_or_404(UserProfile, user_referral_code=referral_code)
-
-        if profile.activated_referral_code and profile.activated_referral_code != referral_code:
-            return Response({'error': 'У вас уже активирован другой реферальный код'},
+    @action(detail=False, methods=['get'], url_path='leaderboard')
+    def leaderboard(self, request):
+        """ Топ пригласивших по числу рефералов (?limit=, по умолчанию 10) """
+        leaderboard = get_readable_leaderboard()
+        try:
+            limit = int(request.query_params.get('limit', settings.LEADERBOARD['DEFAULT_LIMIT']))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= leaderboard.top_size:
+            return Response({'error': f'Размер топа должен быть целым числом от 1 до {leaderboard.top_size}'},
                             status=status.HTTP_400_BAD_REQUEST)
-
-        self._process_referral_code_update(profile, referred_by, referral_code)
-
-        profile.referrer = referred_by.user
-        profile.save()
-
-        return Response({'message': 'Вы успешно стали рефералом'}, status=status.HTTP_200_OK)
-
-    def _process_referral_code_update(self, profile, referred_by, referral_code):
-        """Обработка успешного обновления профиля с реферальным кодом"""
-        if not profile.activated_referral_code:
-            profile.activated_referral_code = referral_code
-            profile.referrer = referred_by.user
-            profile.save()
-            referred_by.user_referred_code_used = True
-            referred_by.save()
-        else:
-            return Response({'error': 'У вас уже активирован реферальный код'},
+        top = leaderboard.top(limit)
+        phone_numbers = dict(UserProfile.objects.filter(pk__in=[member for member, _ in top]).values_list(
+            'pk', 'phone_number'))
+        results = []
+        for position, (member, score) in enumerate(top, start=1):
+            # При равном счёте места равны
+            rank = results[-1]['rank'] if results and results[-1]['referral_count'] == score else position
+            results.append({'rank': rank, 'id': member, 'phone_number': phone_numbers.get(member),
+                            'referral_count': score})
+        return Response({'total': leaderboard.total(), 'results': results})
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """ Потоковая выгрузка профилей или реферальных связей в NDJSON или CSV (только для администраторов) """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        dataset = request.query_params.get('dataset', 'profiles')
+        if export_format not in EXPORT_CONTENT_TYPES or dataset not in EXPORT_FIELDS:
+            return Response({'error': f'Допустимые значения: export_format — {", ".join(EXPORT_CONTENT_TYPES)}, '
+                                      f'dataset — {", ".join(EXPORT_FIELDS)}'},
                             status=status.HTTP_400_BAD_REQUEST)
+        # Ответ читается после выхода из представления, когда реплика запроса уже не выбрана
+        chunks = iter_export(dataset, export_format, settings.EXPORT_CHUNK_SIZE,
+                             using=router.db_for_read(UserProfile))
+        response = StreamingHttpResponse((text for _, text in chunks),
+                                         content_type=EXPORT_CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{export_format}"'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='leaderboard_rank')
+    def leaderboard_rank(self, request, pk=None):
+        """ Место профиля в рейтинге пригласивших """
+        profile = self.get_object()
+        leaderboard = get_readable_leaderboard()
+        return Response({'id': profile.pk, 'phone_number': profile.phone_number,
+                         'referral_count': profile.referral_count, 'rank': leaderboard.rank(profile.referral_count),
+                         'total': leaderboard.total()})
 
     def get_permissions(self):
         """ Права доступа для работы с профилями пользователей"""
-        if self.action in ['create', 'destroy', 'partial_update']:
+        if self.action in ['create', 'destroy', 'partial_update', 'bulk_activate', 'export']:
             self.permission_classes = [IsAdminUser]
         elif self.action in ['list', 'retrieve']:
             self.permission_classes = [IsAuthenticatedOrReadOnly]
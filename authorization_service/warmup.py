@@ -0,0 +1,75 @@
+""" Прогрев воркера при старте
+
+Загружает то, за что иначе платили бы первые запросы каждого воркера:
+метаданные phonenumbers, URLConf, сериализаторы, таблицы распределителя
+реферальных кодов и схему документации. При запуске с gunicorn --preload
+прогрев выполняется в мастер-процессе до fork, и воркеры получают уже
+заполненную память через copy-on-write.
+"""
+import gc
+import logging
+import time
+
+from django.conf import settings
+from django.urls import get_resolver, resolve
+from phonenumbers import PhoneMetadata
+
+logger = logging.getLogger(__name__)
+
+
+def warmup():
+    """ Прогрев модулей и кэшей; возвращает время каждого шага в секундах """
+    timings = {}
+
+    def step(name, function):
+        started = time.perf_counter()
+        function()
+        timings[name] = time.perf_counter() - started
+
+    step('phonenumbers', _warmup_phonenumbers)
+    step('urlconf', _warmup_urlconf)
+    step('serializers', _warmup_serializers)
+    step('referral_codes', _warmup_referral_codes)
+    if settings.API_DOCS_ENABLED:
+        step('api_docs', _warmup_api_docs)
+
+    # Объекты, созданные при прогреве, больше не обходятся сборщиком мусора,
+    # поэтому страницы памяти мастер-процесса остаются общими после fork
+    gc.freeze()
+    logger.info('Прогрев завершён: %s', ', '.join(f'{name} {elapsed * 1000:.0f} мс'
+                                                  for name, elapsed in timings.items()))
+    return timings
+
+
+def _warmup_phonenumbers():
+    from authorization_service.validators import PhoneNumberValidator
+
+    PhoneMetadata.load_all()
+    PhoneNumberValidator()('+7 999 000-00-00')
+
+
+def _warmup_urlconf():
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+    resolve('/user_login/')
+
+
+def _warmup_serializers():
+    from authorization_service.serializers import UserProfileSerializer
+    from users.serializers import UserSerializer
+
+    UserProfileSerializer().fields
+    UserSerializer().fields
+
+
+def _warmup_referral_codes():
+    from authorization_service.referral_codes import get_referral_code_allocator
+
+    get_referral_code_allocator()
+
+
+def _warmup_api_docs():
+    from drf_yasg.generators import OpenAPISchemaGenerator  # noqa: F401
+    from drf_yasg.inspectors import SwaggerAutoSchema  # noqa: F401
+    from drf_yasg.renderers import SwaggerUIRenderer, ReDocRenderer  # noqa: F401
@@ -0,0 +1,5 @@
+""" Бенчмарки сервиса authorization_service
+
+Запуск из корня проекта: python -m benchmarks.<имя_модуля> --help
+По умолчанию бенчмарки работают на временной тестовой базе SQLite.
+"""
@@ -0,0 +1,123 @@
+""" Бенчмарк проверки кода верификации: синхронный воркер против асинхронного
+
+Синхронный WSGI-воркер обрабатывает один запрос за раз и простаивает во время
+задержки перед проверкой кода. Асинхронное представление ожидает задержку без
+блокировки, поэтому один воркер обслуживает много проверок одновременно.
+
+    python -m benchmarks.bench_async_verification --requests 200 --delay 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks.django_setup import setup_django
+
+
+def create_users(count):
+    """ Создание пользователей с профилями """
+    from django.contrib.auth.hashers import make_password
+
+    from authorization_service.models import UserProfile
+    from users.models import User
+
+    password = make_password(None)
+    users = User.objects.bulk_create(
+        [User(username=f'+7999{index:07d}', password=password) for index in range(count)]
+    )
+    users = list(User.objects.filter(username__in=[user.username for user in users]))
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, phone_number=user.username, user_referral_code=f'B{index:07d}')
+        for index, user in enumerate(users)
+    ])
+    return [user.username for user in users]
+
+
+def issue_codes(phone_numbers):
+    """ Выдача известного кода верификации; код одноразовый, поэтому выдаётся перед каждым прогоном """
+    from authorization_service.code_store import get_verification_code_store
+
+    store = get_verification_code_store()
+    for phone_number in phone_numbers:
+        store.issue(phone_number, '1234')
+
+
+def run_sync(phone_numbers):
+    """ Последовательные проверки, как в одном синхронном воркере """
+    from django.test import RequestFactory
+
+    from authorization_service.views import InputVerificationCodeAPI
+
+    factory = RequestFactory()
+    view = InputVerificationCodeAPI.as_view()
+    started = time.perf_counter()
+    for phone_number in phone_numbers:
+        request = factory.post('/input_verification_code/',
+                               {'phone_number': phone_number, 'entered_code': '1234'},
+                               content_type='application/json')
+        response = view(request)
+        assert response.status_code == 200, response.data
+    return time.perf_counter() - started, 1
+
+
+async def run_async(phone_numbers):
+    """ Конкурентные проверки в одном асинхронном воркере """
+    from django.test import AsyncRequestFactory
+
+    from authorization_service.async_views import AsyncInputVerificationCodeAPI
+
+    factory = AsyncRequestFactory()
+    view = AsyncInputVerificationCodeAPI.as_view()
+    in_flight = 0
+    peak = 0
+
+    async def verify(phone_number):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        request = factory.post('/input_verification_code/',
+                               {'phone_number': phone_number, 'entered_code': '1234'},
+                               content_type='application/json')
+        response = await view(request)
+        in_flight -= 1
+        assert response.status_code == 200, response.content
+
+    started = time.perf_counter()
+    await asyncio.gather(*(verify(phone_number) for phone_number in phone_numbers))
+    return time.perf_counter() - started, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Число проверок в асинхронном прогоне')
+    parser.add_argument('--sync-requests', type=int, default=10, help='Число проверок в синхронном прогоне')
+    parser.add_argument('--delay', type=float, default=0.5, help='Задержка перед проверкой кода, с')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+
+        settings.VERIFICATION_DELAY = args.delay
+        # Все запросы идут с одного адреса; лимиты частоты здесь не измеряются
+        settings.RATE_LIMITS = dict(settings.RATE_LIMITS, ENABLED=False)
+        phone_numbers = create_users(max(args.requests, args.sync_requests))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            issue_codes(phone_numbers[:args.sync_requests])
+            sync_elapsed, sync_peak = run_sync(phone_numbers[:args.sync_requests])
+            issue_codes(phone_numbers[:args.requests])
+            async_elapsed, async_peak = asyncio.run(run_async(phone_numbers[:args.requests]))
+
+        print(f'Задержка перед проверкой: {args.delay} с')
+        print(f'{"режим":<8}{"запросов":>10}{"время, с":>12}{"проверок/с":>14}{"одновременно":>15}')
+        for mode, count, elapsed, peak in (('sync', args.sync_requests, sync_elapsed, sync_peak),
+                                           ('async', args.requests, async_elapsed, async_peak)):
+            print(f'{mode:<8}{count:>10}{elapsed:>12.2f}{count / elapsed:>14.1f}{peak:>15}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+""" Сквозной бенчмарк API с базовой сводкой
+
+Прогоняет сценарий benchmarks.e2e (вход, код верификации, список профилей,
+свой профиль, активация кода) для --users пользователей на таблице из
+--profiles профилей и выводит для каждого эндпоинта процентили задержки
+и число запросов к базе. Число запросов сравнивается с базовой сводкой
+--baseline из репозитория, задержки — с базовой сводкой этой машины
+--latency-baseline (по умолчанию baselines/local/bench_e2e.<имя хоста>.json,
+в репозиторий не попадает): миллисекунды на разных машинах несравнимы.
+При --check регрессия или превышение бюджета запросов завершает бенчмарк
+с кодом 1.
+
+    python -m benchmarks.bench_e2e --users 200
+    python -m benchmarks.bench_e2e --users 200 --save-baseline
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+from benchmarks.django_setup import setup_django
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+DEFAULT_BASELINE = os.path.join(BASELINES_DIR, 'bench_e2e.json')
+DEFAULT_LATENCY_BASELINE = os.path.join(BASELINES_DIR, 'local', f'bench_e2e.{socket.gethostname()}.json')
+
+
+def load_baseline(path):
+    """ Базовая сводка из файла path или None, если файла нет """
+    if not os.path.exists(path):
+        print(f'Базовая сводка {path} не найдена, сравнение пропущено')
+        return None
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(path, summary):
+    """ Сохранение базовой сводки в файл path """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2, ensure_ascii=False)
+        file.write('\n')
+    print(f'Базовая сводка сохранена в {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='Число пользователей, проходящих сценарий')
+    parser.add_argument('--profiles', type=int, default=10000, help='Число профилей в таблице до прогона')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='Включить кэш ответов профилей (по умолчанию измеряется обработка запросов)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='Файл базовой сводки числа запросов к базе (хранится в репозитории)')
+    parser.add_argument('--latency-baseline', default=DEFAULT_LATENCY_BASELINE,
+                        help='Файл базовой сводки задержек этой машины')
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить сводку как базовую')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Допустимый рост p95 относительно базовой сводки (0.5 — на 50%%)')
+    parser.add_argument('--check', action='store_true', help='Код выхода 1 при регрессии')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+
+        from benchmarks.bench_pagination import fill_tables
+        from benchmarks.e2e import run_flows, create_referrer, check_query_budgets, compare_with_baseline, \
+            split_summary
+        from authorization_service.sms import get_sms_dispatcher
+
+        settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=args.response_cache)
+        settings.SMS_DISPATCHER = dict(settings.SMS_DISPATCHER, PROVIDER='authorization_service.sms.FakeSmsProvider')
+        get_sms_dispatcher.cache_clear()
+
+        fill_tables(args.profiles)
+        referrer = create_referrer()
+        # Прогрев: первые запросы загружают модули и заполняют кэши процесса
+        run_flows(3, referrer.user_referral_code, phone_prefix='+7999444')
+        summary = run_flows(args.users, referrer.user_referral_code).summary()
+
+        print(f'{"эндпоинт":<26}{"запросов":>9}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}'
+              f'{"SQL ср.":>9}{"SQL макс.":>11}')
+        for endpoint, stats in summary.items():
+            print(f'{endpoint:<26}{stats["requests"]:>9}{stats["p50_ms"]:>10.2f}{stats["p95_ms"]:>10.2f}'
+                  f'{stats["p99_ms"]:>10.2f}{stats["queries_mean"]:>9.2f}{stats["queries_max"]:>11}')
+
+        problems = [f'{endpoint}: запросов к базе {queries}, бюджет {budget}'
+                    for endpoint, queries, budget in check_query_budgets(summary)]
+        if args.save_baseline:
+            for path, part in zip((args.baseline, args.latency_baseline), split_summary(summary)):
+                save_baseline(path, part)
+        else:
+            for path in (args.baseline, args.latency_baseline):
+                baseline = load_baseline(path)
+                if baseline is not None:
+                    problems += compare_with_baseline(summary, baseline, args.tolerance)
+
+        for problem in problems:
+            print(f'РЕГРЕССИЯ: {problem}')
+        if not problems:
+            print('Регрессий нет')
+        get_sms_dispatcher().close()
+    finally:
+        teardown()
+    if args.check and problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+""" Бенчмарк потоковой выгрузки профилей
+
+Заполняет таблицу --rows профилями (как bench_pagination) и сравнивает
+скорость и пиковую память (tracemalloc) выгрузки:
+- stream — iter_export: курсор на стороне сервера и кортежи values_list;
+- serializer — UserProfileSerializer по всем экземплярам модели сразу.
+
+    python -m benchmarks.bench_export --rows 1000000
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.bench_pagination import fill_tables
+from benchmarks.django_setup import setup_django
+
+
+def profile(function):
+    """ Время выполнения в секундах и пиковая память в МБ
+
+    Память измеряется отдельным прогоном: tracemalloc в разы замедляет выделение объектов.
+    """
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Число профилей в таблице')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Число строк за обращение к курсору')
+    parser.add_argument('--serializer-rows', type=int, default=100_000,
+                        help='Число профилей для выгрузки через сериализатор (она держит все строки в памяти)')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+
+        from authorization_service.export import iter_export
+        from authorization_service.models import UserProfile
+        from authorization_service.serializers import UserProfileSerializer
+
+        fill_tables(args.rows)
+        settings.REFERRAL_CACHE_PHONE_NUMBERS = True
+
+        for export_format in ['ndjson', 'csv']:
+            size = 0
+
+            def stream():
+                nonlocal size
+                size = 0
+                for _, text in iter_export('profiles', export_format, args.chunk_size):
+                    size += len(text)
+
+            elapsed, peak = profile(stream)
+            print(f'stream {export_format}: {args.rows} строк, {size / 2 ** 20:.0f} МБ за {elapsed:.1f} с '
+                  f'({args.rows / elapsed:.0f} строк/с), пик памяти {peak:.1f} МБ')
+
+        def serialize():
+            queryset = UserProfile.objects.select_related('user', 'referrer').order_by('id')[:args.serializer_rows]
+            UserProfileSerializer(queryset, many=True).data
+
+        elapsed, peak = profile(serialize)
+        print(f'serializer: {args.serializer_rows} строк за {elapsed:.1f} с '
+              f'({args.serializer_rows / elapsed:.0f} строк/с), пик памяти {peak:.1f} МБ')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+""" Бенчмарк JWT-аутентификации: запрос пользователя к базе, кэш в процессе и stateless
+
+Сравнивает стандартный JWTAuthentication из simplejwt, который загружает
+пользователя на каждый запрос, с CachedJWTAuthentication в режимах cached
+и stateless. Меряются отдельно вызов authenticate() и полный запрос
+GET /userprofiles/<id>/ с токеном.
+
+    python -m benchmarks.bench_jwt_auth --requests 2000
+"""
+import argparse
+import time
+
+from benchmarks.django_setup import setup_django
+
+AUTHENTICATION_CLASSES = (
+    ('default', 'rest_framework_simplejwt.authentication.JWTAuthentication', 'cached'),
+    ('cached', 'authorization_service.authentication.CachedJWTAuthentication', 'cached'),
+    ('stateless', 'authorization_service.authentication.CachedJWTAuthentication', 'stateless'),
+)
+
+
+def create_user():
+    """ Пользователь с профилем и access-токеном """
+    from authorization_service.models import UserProfile
+    from authorization_service.tokens import UserClaimsRefreshToken
+    from users.models import User
+
+    user = User.objects.create_user(username='+79990000001', password=None)
+    profile = UserProfile.objects.create(user=user, phone_number=user.username, user_referral_code='BENCH1')
+    return profile, str(UserClaimsRefreshToken.for_user(user).access_token)
+
+
+def measure(function, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Число полных запросов в каждом режиме')
+    parser.add_argument('--calls', type=int, default=20000, help='Число вызовов authenticate() в каждом режиме')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+        from django.test import RequestFactory
+        from django.utils.module_loading import import_string
+        from rest_framework.request import Request
+        from rest_framework.test import APIClient
+
+        from authorization_service.authentication import get_jwt_user_cache
+        from authorization_service.views import UserProfileViewSet
+
+        profile, token = create_user()
+        # Измеряется обработка запроса, а не выдача готового ответа из кэша
+        settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=False)
+        factory = RequestFactory()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        print(f'{"режим":<12}{"authenticate()/с":>18}{"запросов/с":>14}')
+        for mode, class_path, cache_mode in AUTHENTICATION_CLASSES:
+            settings.JWT_USER_CACHE = dict(settings.JWT_USER_CACHE, MODE=cache_mode)
+            get_jwt_user_cache.cache_clear()
+            # Классы аутентификации читаются из настроек при импорте представлений
+            UserProfileViewSet.authentication_classes = [import_string(class_path)]
+
+            authentication = import_string(class_path)()
+            request = Request(factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+            calls = measure(lambda: authentication.authenticate(request), args.calls)
+
+            response = client.get(f'/userprofiles/{profile.id}/')
+            assert response.status_code == 200, response.data
+            requests = measure(lambda: client.get(f'/userprofiles/{profile.id}/'), args.requests)
+            print(f'{mode:<12}{calls:>18,.0f}{requests:>14,.0f}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
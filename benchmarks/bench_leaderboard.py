@@ -0,0 +1,84 @@
+""" Бенчмарк рейтинга пригласивших
+
+Заполняет дерево из --nodes профилей (как bench_referral_tree) и сравнивает:
+- aggregate — топ-K агрегацией рефералов по всей таблице профилей;
+- leaderboard — /userprofiles/leaderboard/ из инкрементального рейтинга;
+а также место профиля: COUNT(*) по счётчикам против /leaderboard_rank/.
+
+    python -m benchmarks.bench_leaderboard --nodes 300000
+"""
+import argparse
+import time
+
+from benchmarks.bench_referral_tree import fill_tables, measure
+from benchmarks.django_setup import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=300_000, help='Число профилей')
+    parser.add_argument('--branching', type=int, default=5, help='Число рефералов у каждого профиля')
+    parser.add_argument('--limit', type=int, default=10, help='Размер топа')
+    parser.add_argument('--repeat', type=int, default=5, help='Число повторов каждого запроса')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.db import connection
+        from rest_framework.test import APIRequestFactory
+
+        from authorization_service.leaderboard import get_leaderboard, reconcile_leaderboard
+        from authorization_service.models import UserProfile
+        from authorization_service.views import UserProfileViewSet
+
+        fill_tables(args.nodes, args.branching)
+        profile_table = UserProfile._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {profile_table} SET referral_count = (SELECT COUNT(*) FROM {profile_table} r '
+                f'WHERE r.referrer_id = {profile_table}.user_id)'
+            )
+
+        started = time.perf_counter()
+        total = reconcile_leaderboard()
+        print(f'Сборка рейтинга: {total} пригласивших за {(time.perf_counter() - started) * 1000:.0f} мс')
+
+        factory = APIRequestFactory()
+        top_view = UserProfileViewSet.as_view({'get': 'leaderboard'})
+        rank_view = UserProfileViewSet.as_view({'get': 'leaderboard_rank'})
+        sample_pk = args.nodes // (2 * args.branching)
+
+        def aggregate_top():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT r.id, COUNT(*) FROM {profile_table} p JOIN {profile_table} r ON r.user_id = p.referrer_id '
+                    f'GROUP BY r.id ORDER BY COUNT(*) DESC, r.id LIMIT %s', [args.limit]
+                )
+                return cursor.fetchall()
+
+        def count_rank():
+            score = UserProfile.objects.values_list('referral_count', flat=True).get(pk=sample_pk)
+            return UserProfile.objects.filter(referral_count__gt=score).count() + 1
+
+        def leaderboard_top():
+            response = top_view(factory.get('/userprofiles/leaderboard/', {'limit': args.limit}))
+            assert response.status_code == 200, response.data
+
+        def leaderboard_rank():
+            response = rank_view(factory.get(f'/userprofiles/{sample_pk}/leaderboard_rank/'), pk=sample_pk)
+            assert response.status_code == 200, response.data
+            return response.data['rank']
+
+        assert [tuple(row) for row in aggregate_top()] == get_leaderboard().top(args.limit)
+        assert count_rank() == leaderboard_rank()
+        print(f'{"запрос":>10}{"aggregate, мс":>16}{"leaderboard, мс":>18}')
+        print(f'{"топ":>10}{measure(aggregate_top, args.repeat):>16.1f}'
+              f'{measure(leaderboard_top, args.repeat):>18.1f}')
+        print(f'{"место":>10}{measure(count_rank, args.repeat):>16.1f}'
+              f'{measure(leaderboard_rank, args.repeat):>18.1f}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
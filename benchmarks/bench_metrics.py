@@ -0,0 +1,64 @@
+""" Бенчмарк накладных расходов метрик запросов
+
+Сравнивает полный запрос GET /userprofiles/<id>/ и POST /user_login/ с
+некорректным номером без MetricsMiddleware, с ним и с ним без заголовка
+Server-Timing, а также отдельно запись в гистограммы и отрисовку /metrics/.
+
+    python -m benchmarks.bench_metrics --requests 3000
+"""
+import argparse
+import time
+
+from benchmarks.bench_jwt_auth import create_user, measure
+from benchmarks.django_setup import setup_django
+
+MODES = (
+    ('без метрик', False, False),
+    ('метрики', True, False),
+    ('метрики + Server-Timing', True, True),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=3000, help='Число запросов к каждому эндпоинту в каждом режиме')
+    parser.add_argument('--observations', type=int, default=200000, help='Число записей в гистограммы')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+        from rest_framework.test import APIClient
+
+        from authorization_service.metrics import MetricsRegistry, registry
+
+        profile, token = create_user()
+        settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=False)
+        settings.RATE_LIMITS = dict(settings.RATE_LIMITS, ENABLED=False)
+
+        print(f'{"режим":<26}{"профиль, мкс":>14}{"вход, мкс":>12}')
+        for mode, enabled, server_timing in MODES:
+            settings.METRICS = dict(settings.METRICS, ENABLED=enabled, SERVER_TIMING=server_timing)
+            # Клиент загружает цепочку middleware при первом запросе
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            assert client.get(f'/userprofiles/{profile.id}/').status_code == 200
+            assert ('Server-Timing' in client.get(f'/userprofiles/{profile.id}/')) == server_timing
+            detail = measure(lambda: client.get(f'/userprofiles/{profile.id}/'), args.requests)
+            login = measure(lambda: client.post('/user_login/', {'phone_number': '8712831'}), args.requests)
+            print(f'{mode:<26}{1e6 / detail:>14.1f}{1e6 / login:>12.1f}')
+
+        metrics = MetricsRegistry()
+        values = (0.004, 2, 0.0006, 0.0002, 640)
+        per_second = measure(lambda: metrics.observe(('authorization_service:userprofile-detail', 'GET'), values),
+                             args.observations)
+        print(f'запись в гистограммы: {1e6 / per_second:.2f} мкс')
+        started = time.perf_counter()
+        text = registry.render()
+        print(f'отрисовка /metrics/: {(time.perf_counter() - started) * 1000:.2f} мс, {len(text)} байт')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+""" Бенчмарк постраничного вывода профилей на большой таблице
+
+Сравнивает задержку запроса страницы N списка /userprofiles/:
+- offset — прежний PageNumberPagination: COUNT(*) и OFFSET на каждый запрос;
+- page — пагинация по номеру страницы с числом записей из кэша (OFFSET остаётся);
+- cursor — пагинация по курсору: условие id > позиция, без OFFSET и COUNT(*).
+
+Таблица заполняется напрямую через executemany, без ORM.
+
+    python -m benchmarks.bench_pagination --rows 5000000
+"""
+import argparse
+import time
+
+from benchmarks.django_setup import setup_django
+
+
+def fill_tables(rows, chunk_size=50000):
+    """ Заполнение таблиц пользователей и профилей rows строками """
+    from django.db import connection, transaction
+
+    from authorization_service.models import UserProfile
+    from users.models import User
+
+    user_table = User._meta.db_table
+    profile_table = UserProfile._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(1, rows + 1, chunk_size):
+            ids = range(start, min(start + chunk_size, rows + 1))
+            cursor.executemany(
+                f'INSERT INTO {user_table} (id, password, is_superuser, username, first_name, last_name, email, '
+                f'is_staff, is_active, date_joined) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                [(index, '!', False, f'+7{index:010d}', '', '', '', False, True, '2024-01-01 00:00:00')
+                 for index in ids]
+            )
+            cursor.executemany(
+                f'INSERT INTO {profile_table} (id, user_id, phone_number, verification_code, user_referral_code, '
+                f'user_referred_code_used, referral_count, referred_phone_numbers) '
+                f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+                [(index, index, f'+7{index:010d}', '', f'{index:08X}', False, 0, '') for index in ids]
+            )
+
+
+def measure(view, factory, path, params, repeat):
+    """ Средняя задержка запроса в миллисекундах """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = view(factory.get(path, params))
+        assert response.status_code == 200, response.data
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5_000_000, help='Число профилей в таблице')
+    parser.add_argument('--page-size', type=int, default=50, help='Размер страницы')
+    parser.add_argument('--repeat', type=int, default=5, help='Число повторов каждого запроса')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+        from django.core.cache import cache
+        from rest_framework.pagination import Cursor, PageNumberPagination
+        from rest_framework.test import APIRequestFactory
+
+        from authorization_service.pagination import UserProfilePagination, IdCursorPagination
+        from authorization_service.views import UserProfileViewSet
+
+        started = time.perf_counter()
+        fill_tables(args.rows)
+        print(f'Заполнение таблицы: {args.rows} строк за {time.perf_counter() - started:.1f} с')
+
+        class OffsetPagination(PageNumberPagination):
+            page_size_query_param = 'page_size'
+            max_page_size = args.page_size
+
+        # Измеряется обработка запроса, а не выдача готового ответа из кэша
+        settings.PROFILE_RESPONSE_CACHE = dict(settings.PROFILE_RESPONSE_CACHE, ENABLED=False)
+        factory = APIRequestFactory()
+        view = UserProfileViewSet.as_view({'get': 'list'})
+        cursor_encoder = IdCursorPagination()
+        cursor_encoder.base_url = 'http://testserver/userprofiles/'
+
+        last_page = (args.rows - 1) // args.page_size + 1
+        pages = sorted({1, 100, 10_000, last_page // 2, last_page} & set(range(1, last_page + 1)))
+        print(f'{"страница":>10}{"offset, мс":>14}{"page, мс":>12}{"cursor, мс":>13}')
+        for page in pages:
+            params = {'page': page, 'page_size': args.page_size}
+            UserProfileViewSet.pagination_class = OffsetPagination
+            offset_latency = measure(view, factory, '/userprofiles/', params, args.repeat)
+
+            UserProfileViewSet.pagination_class = UserProfilePagination
+            UserProfilePagination.max_page_size = args.page_size
+            cache.clear()
+            view(factory.get('/userprofiles/', params))  # Число записей попадает в кэш
+            page_latency = measure(view, factory, '/userprofiles/', params, args.repeat)
+
+            # Курсор, указывающий на последний id предыдущей страницы
+            cursor_url = cursor_encoder.encode_cursor(Cursor(offset=0, reverse=False,
+                                                             position=str((page - 1) * args.page_size)))
+            cursor_latency = measure(view, factory, cursor_url, {'page_size': args.page_size}, args.repeat)
+            print(f'{page:>10}{offset_latency:>14.1f}{page_latency:>12.1f}{cursor_latency:>13.1f}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+""" Микробенчмарк валидатора номера телефона
+
+Сравнивает полный разбор phonenumbers, повторную проверку из кэша
+и быстрый путь для номеров вида +79XXXXXXXXX.
+
+    python -m benchmarks.bench_phone_validation --iterations 200000
+"""
+import argparse
+import time
+
+from phonenumbers import parse as parse_phone, is_valid_number
+
+from authorization_service.validators import PhoneNumberValidator, parse_phone_number
+
+
+def measure(title, function, values, iterations):
+    started = time.perf_counter()
+    for index in range(iterations):
+        function(values[index % len(values)])
+    elapsed = time.perf_counter() - started
+    print(f'{title:<44}{iterations / elapsed:>14,.0f} проверок/с')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000, help='Число проверок в каждом режиме')
+    args = parser.parse_args()
+
+    validator = PhoneNumberValidator()
+    mobile_numbers = [f'+7999{index:07d}' for index in range(1000)]
+    formatted_numbers = [f'+7 (999) {index:03d}-{index % 100:02d}-{index % 97:02d}' for index in range(1000)]
+
+    measure('Прежняя проверка: parse + is_valid_number', lambda value: is_valid_number(parse_phone(value, None)),
+            mobile_numbers, args.iterations // 10)
+
+    def uncached(value):
+        parse_phone_number.cache_clear()
+        return validator(value)
+
+    measure('Валидатор, без кэша', uncached, formatted_numbers, args.iterations // 10)
+    parse_phone_number.cache_clear()
+    for value in formatted_numbers:
+        validator(value)
+    measure('Валидатор, из кэша', validator, formatted_numbers, args.iterations)
+    measure('Валидатор, быстрый путь +79XXXXXXXXX', validator, mobile_numbers, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
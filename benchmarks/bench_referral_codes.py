@@ -0,0 +1,55 @@
+""" Бенчмарк распределителя реферальных кодов
+
+Выдаёт коды для номеров 0..N-1 и проверяет отсутствие совпадений. Проверка
+не требует хранить все коды: если каждый код однозначно декодируется обратно
+в свой номер, отображение инъективно и совпадений нет. Флаг --bitmap
+дополнительно отмечает каждый код в битовой карте всего пространства кодов
+(около 270 МБ памяти).
+
+    python -m benchmarks.bench_referral_codes --count 10000000
+"""
+import argparse
+import time
+
+from authorization_service.referral_codes import ReferralCodeAllocator, CODE_SPACE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10_000_000, help='Число выдаваемых кодов')
+    parser.add_argument('--key', default='benchmark-key', help='Ключ перестановки')
+    parser.add_argument('--bitmap', action='store_true', help='Проверять совпадения по битовой карте кодов')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    allocator = ReferralCodeAllocator(args.key)
+    print(f'Подготовка раундовых таблиц: {time.perf_counter() - started:.2f} с')
+
+    code_for = allocator.code_for
+    started = time.perf_counter()
+    for sequence in range(args.count):
+        code_for(sequence)
+    elapsed = time.perf_counter() - started
+    print(f'Выдано кодов: {args.count} за {elapsed:.1f} с ({args.count / elapsed:,.0f} кодов/с)')
+
+    started = time.perf_counter()
+    sequence_for = allocator.sequence_for
+    collisions = 0
+    bitmap = bytearray(CODE_SPACE // 8 + 1) if args.bitmap else None
+    for sequence in range(args.count):
+        code = code_for(sequence)
+        if sequence_for(code) != sequence:
+            collisions += 1
+        if bitmap is not None:
+            value = allocator.permute(sequence)
+            byte, bit = divmod(value, 8)
+            if bitmap[byte] >> bit & 1:
+                collisions += 1
+            bitmap[byte] |= 1 << bit
+    print(f'Проверка за {time.perf_counter() - started:.1f} с, совпадений: {collisions}')
+    if collisions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+""" Бенчмарк запроса реферального дерева на большом дереве
+
+Строит дерево из --nodes профилей, где у каждого профиля до --branching
+рефералов, заполняет таблицу замыкания и измеряет задержку
+/userprofiles/<id>/referral_tree/ для корня, профиля в середине и листа.
+Для сравнения размер поддерева корня считается рекурсивным CTE по referrer_id.
+
+    python -m benchmarks.bench_referral_tree --nodes 300000
+"""
+import argparse
+import time
+
+from benchmarks.django_setup import setup_django
+
+
+def parent_of(index, branching):
+    """ Номер пригласившего профиля index (профили нумеруются с 1, корень — 1) """
+    return (index - 2) // branching + 1 if index > 1 else None
+
+
+def fill_tables(nodes, branching, chunk_size=50000):
+    """ Заполнение пользователей, профилей и таблицы замыкания """
+    from django.db import connection, transaction
+
+    from authorization_service.models import UserProfile, ReferralClosure
+    from users.models import User
+
+    user_table = User._meta.db_table
+    profile_table = UserProfile._meta.db_table
+    closure_table = ReferralClosure._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(1, nodes + 1, chunk_size):
+            ids = range(start, min(start + chunk_size, nodes + 1))
+            cursor.executemany(
+                f'INSERT INTO {user_table} (id, password, is_superuser, username, first_name, last_name, email, '
+                f'is_staff, is_active, date_joined) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                [(index, '!', False, f'+7{index:010d}', '', '', '', False, True, '2024-01-01 00:00:00')
+                 for index in ids]
+            )
+            cursor.executemany(
+                f'INSERT INTO {profile_table} (id, user_id, phone_number, verification_code, user_referral_code, '
+                f'activated_referral_code, referrer_id, user_referred_code_used, referral_count, '
+                f'referred_phone_numbers) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                [(index, index, f'+7{index:010d}', '', f'{index:08X}',
+                  f'{parent_of(index, branching):08X}' if index > 1 else None, parent_of(index, branching),
+                  False, 0, '') for index in ids]
+            )
+            rows = []
+            for index in ids:
+                ancestor, depth = parent_of(index, branching), 1
+                while ancestor is not None:
+                    rows.append((ancestor, index, depth))
+                    ancestor, depth = parent_of(ancestor, branching), depth + 1
+            cursor.executemany(
+                f'INSERT INTO {closure_table} (ancestor_id, descendant_id, depth) VALUES (%s, %s, %s)', rows
+            )
+
+
+def measure(function, repeat):
+    """ Средняя задержка вызова в миллисекундах """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=300_000, help='Число профилей в дереве')
+    parser.add_argument('--branching', type=int, default=5, help='Число рефералов у каждого профиля')
+    parser.add_argument('--repeat', type=int, default=5, help='Число повторов каждого запроса')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.db import connection
+        from rest_framework.test import APIRequestFactory
+
+        from authorization_service.models import UserProfile
+        from authorization_service.views import UserProfileViewSet
+
+        started = time.perf_counter()
+        fill_tables(args.nodes, args.branching)
+        print(f'Заполнение таблиц: {args.nodes} профилей за {time.perf_counter() - started:.1f} с')
+
+        factory = APIRequestFactory()
+        view = UserProfileViewSet.as_view({'get': 'referral_tree'})
+
+        def tree(pk, depth):
+            def request():
+                response = view(factory.get(f'/userprofiles/{pk}/referral_tree/', {'depth': depth}), pk=pk)
+                assert response.status_code == 200, response.data
+                return response.data
+            return request
+
+        def recursive_subtree_size(pk):
+            profile_table = UserProfile._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'WITH RECURSIVE subtree(user_id) AS (SELECT user_id FROM {profile_table} WHERE id = %s '
+                    f'UNION ALL SELECT p.user_id FROM {profile_table} p JOIN subtree s ON p.referrer_id = s.user_id) '
+                    f'SELECT COUNT(*) - 1 FROM subtree', [pk]
+                )
+                return cursor.fetchone()[0]
+
+        leaf = args.nodes
+        middle = parent_of(parent_of(leaf, args.branching), args.branching) or 1
+        print(f'{"профиль":>10}{"поддерево":>12}{"depth=1, мс":>14}{"depth=3, мс":>14}{"CTE, мс":>10}')
+        for pk in [1, middle, leaf]:
+            data = tree(pk, 1)()
+            assert data['subtree_size'] == recursive_subtree_size(pk)
+            shallow = measure(tree(pk, 1), args.repeat)
+            deep = measure(tree(pk, 3), args.repeat)
+            cte = measure(lambda: recursive_subtree_size(pk), args.repeat)
+            print(f'{pk:>10}{data["subtree_size"]:>12}{shallow:>14.1f}{deep:>14.1f}{cte:>10.1f}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
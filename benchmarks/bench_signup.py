@@ -0,0 +1,68 @@
+""" Бенчмарк создания аккаунтов: хэширование пароля в запросе, в пуле потоков и без пароля
+
+Режимы:
+- inline — прежнее поведение: create_user со случайным паролем (PBKDF2 в потоке запроса);
+- pool — PASSWORDLESS_SIGNUP=0: пароль хэшируется в пуле потоков после ответа;
+- passwordless — PASSWORDLESS_SIGNUP=1: пользователь без пароля, хэширования нет.
+
+Для каждого режима выводятся время потока запроса на один аккаунт и процессорное
+время процесса с учётом пула — из него получается число регистраций в секунду
+на одно ядро.
+
+    python -m benchmarks.bench_signup --signups 50
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from benchmarks.django_setup import setup_django
+
+
+def signup_inline(phone_number):
+    """ Создание аккаунта так, как это делалось до режима без пароля """
+    from django.utils.crypto import get_random_string
+
+    from users.models import User
+
+    return User.objects.create_user(username=phone_number, password=get_random_string(6))
+
+
+def run(mode, phone_numbers):
+    from django.conf import settings
+
+    from authorization_service.utils import create_phone_user, get_password_hashing_executor
+
+    settings.PASSWORDLESS_SIGNUP = mode == 'passwordless'
+    signup = signup_inline if mode == 'inline' else create_phone_user
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for phone_number in phone_numbers:
+            signup(phone_number)
+    request_elapsed = time.perf_counter() - started
+    get_password_hashing_executor().shutdown(wait=True)
+    get_password_hashing_executor.cache_clear()
+    return request_elapsed, time.process_time() - cpu_started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--signups', type=int, default=50, help='Число регистраций в каждом режиме')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        print(f'{"режим":<14}{"запрос, мс":>12}{"CPU, мс":>10}{"регистраций/с на ядро":>24}')
+        for offset, mode in enumerate(('inline', 'pool', 'passwordless')):
+            phone_numbers = [f'+7999{offset}{index:06d}' for index in range(args.signups)]
+            request_elapsed, cpu_elapsed = run(mode, phone_numbers)
+            print(f'{mode:<14}{request_elapsed / args.signups * 1000:>12.2f}'
+                  f'{cpu_elapsed / args.signups * 1000:>10.2f}{args.signups / cpu_elapsed:>24,.0f}')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+""" Подготовка окружения Django для бенчмарков """
+import os
+
+
+def setup_django():
+    """ Настройка Django и создание временной тестовой базы данных
+
+    Возвращает функцию, удаляющую тестовую базу. Чтобы измерять на PostgreSQL,
+    задайте ENGINE_DB и параметры подключения в переменных окружения.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    os.environ.setdefault('ENGINE_DB', 'django.db.backends.sqlite3')
+    if os.environ['ENGINE_DB'].endswith('sqlite3'):
+        os.environ.setdefault('POSTGRES_DB', ':memory:')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production-use')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    return teardown
@@ -0,0 +1,161 @@
+""" Сквозной прогон API и бюджеты запросов к базе
+
+Каждый пользователь проходит реальный сценарий через URLConf, middleware
+и представления: вход по номеру телефона, ввод кода верификации, список
+профилей, свой профиль и активация реферального кода. Для каждого эндпоинта
+записываются задержка и число запросов к базе.
+
+QUERY_BUDGETS — максимум запросов к базе на один запрос к эндпоинту.
+Бюджеты проверяются тестами (test_endpoint_query_budgets) и бенчмарком
+bench_e2e, поэтому лишний запрос в любом из представлений роняет тесты.
+"""
+import json
+import time
+
+from authorization_service.loadgen import percentile
+
+# Максимум запросов к базе на запрос: при превышении тесты падают. Список и профиль включают
+# загрузку пользователя при промахе кэша JWT-аутентификации
+QUERY_BUDGETS = {
+    # Проверка пользователя, создание пользователя и профиля
+    'user_login': 3,
+    # Пользователь и профиль
+    'input_verification_code': 2,
+    # Пользователь, COUNT(*) при промахе кэша числа записей, страница
+    'userprofile-list': 3,
+    # Пользователь и профиль
+    'userprofile-detail': 2,
+    # См. authorization_service.referrals
+    'userprofile-activate': 3,
+}
+
+# Порядок эндпоинтов в отчёте
+ENDPOINTS = tuple(QUERY_BUDGETS)
+
+# Поля сводки: число запросов к базе детерминировано и хранится в репозитории, задержки зависят
+# от машины и хранятся в базовой сводке окружения
+QUERY_FIELDS = ('queries_mean', 'queries_max')
+LATENCY_FIELDS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+# Код верификации, выдаваемый пользователям сценария
+VERIFICATION_CODE = '0000'
+
+
+def is_transaction_control(sql):
+    """ BEGIN, COMMIT и точки сохранения: их число зависит от того, идёт ли прогон внутри транзакции теста """
+    return sql.lstrip().upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT'))
+
+
+class FlowRecorder:
+    """ Задержки (мс) и число запросов к базе по эндпоинтам """
+
+    def __init__(self):
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.queries = {endpoint: [] for endpoint in ENDPOINTS}
+
+    def request(self, endpoint, send, expected_status=200):
+        """ Выполнение запроса send() с замером задержки и числа запросов к базе """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = send()
+            elapsed = time.perf_counter() - started
+        assert response.status_code == expected_status, (endpoint, response.status_code, response.content[:500])
+        self.latencies[endpoint].append(elapsed * 1000)
+        self.queries[endpoint].append(sum(not is_transaction_control(query['sql'])
+                                          for query in context.captured_queries))
+        return response
+
+    def summary(self):
+        """ Сводка по эндпоинтам: число запросов, процентили задержки, запросы к базе """
+        result = {}
+        for endpoint in ENDPOINTS:
+            latencies, queries = self.latencies[endpoint], self.queries[endpoint]
+            if not latencies:
+                continue
+            result[endpoint] = {
+                'requests': len(latencies),
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'queries_mean': round(sum(queries) / len(queries), 2),
+                'queries_max': max(queries),
+            }
+        return result
+
+
+def create_referrer(phone_number='+79990000099', referral_code='E2E001'):
+    """ Профиль, код которого активируют пользователи сценария """
+    from authorization_service.models import UserProfile
+    from users.models import User
+
+    user = User.objects.create_user(username=phone_number, password=None)
+    return UserProfile.objects.create(user=user, phone_number=phone_number, user_referral_code=referral_code)
+
+
+def run_flows(users, referral_code, recorder=None, page_size=50, phone_prefix='+7999555'):
+    """ Прохождение сценария users пользователями; возвращает FlowRecorder
+
+    Каждый пользователь приходит со своего IP-адреса, поэтому лимиты частоты
+    по IP не срабатывают, но их проверка остаётся в измеряемом пути.
+    """
+    from django.test import Client
+
+    from authorization_service.code_store import get_verification_code_store
+    from authorization_service.models import UserProfile
+
+    recorder = recorder or FlowRecorder()
+    store = get_verification_code_store()
+    for index in range(users):
+        phone_number = f'{phone_prefix}{index:04d}'
+        client = Client(REMOTE_ADDR=f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}')
+        recorder.request('user_login', lambda: client.post('/user_login/', {'phone_number': phone_number}))
+        # Код из СМС заменяется известным: сценарий не читает очередь отправки
+        store.issue(phone_number, VERIFICATION_CODE)
+        response = recorder.request('input_verification_code', lambda: client.post(
+            '/input_verification_code/', {'phone_number': phone_number, 'entered_code': VERIFICATION_CODE}))
+        client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {response.json()["access_token"]}'
+
+        recorder.request('userprofile-list', lambda: client.get('/userprofiles/', {'page_size': page_size}))
+        # id профиля ответ на ввод кода не содержит; запрос вне замеров
+        profile_id = UserProfile.objects.values_list('id', flat=True).get(phone_number=phone_number)
+        recorder.request('userprofile-detail', lambda: client.get(f'/userprofiles/{profile_id}/'))
+        recorder.request('userprofile-activate', lambda: client.put(
+            f'/userprofiles/{profile_id}/', json.dumps({'referral_code': referral_code}),
+            content_type='application/json'))
+    return recorder
+
+
+def check_query_budgets(summary, budgets=None):
+    """ Эндпоинты, превысившие бюджет запросов: список (эндпоинт, максимум запросов, бюджет) """
+    budgets = budgets or QUERY_BUDGETS
+    return [(endpoint, stats['queries_max'], budgets[endpoint]) for endpoint, stats in summary.items()
+            if stats['queries_max'] > budgets[endpoint]]
+
+
+def split_summary(summary):
+    """ Сводка, разделённая на две: (число запросов к базе, задержки) по эндпоинтам """
+    return tuple({endpoint: {field: stats[field] for field in fields} for endpoint, stats in summary.items()}
+                 for fields in (QUERY_FIELDS, LATENCY_FIELDS))
+
+
+def compare_with_baseline(summary, baseline, latency_tolerance=0.5):
+    """ Регрессии относительно базовой сводки: список строк с описанием
+
+    Регрессия — больше запросов к базе, чем в базовой сводке, или p95
+    задержки больше базового в 1 + latency_tolerance раз. Сравниваются только
+    поля, которые есть в базовой сводке.
+    """
+    regressions = []
+    for endpoint, stats in summary.items():
+        base = baseline.get(endpoint)
+        if base is None:
+            continue
+        if 'queries_max' in base and stats['queries_max'] > base['queries_max']:
+            regressions.append(f'{endpoint}: запросов к базе {stats["queries_max"]}, в базовой сводке '
+                               f'{base["queries_max"]}')
+        if 'p95_ms' in base and stats['p95_ms'] > base['p95_ms'] * (1 + latency_tolerance):
+            regressions.append(f'{endpoint}: p95 {stats["p95_ms"]:.2f} мс, в базовой сводке {base["p95_ms"]:.2f} мс')
+    return regressions
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Прогрев при загрузке приложения: с gunicorn --preload выполняется один раз до fork
+os.environ.setdefault('STARTUP_WARMUP', '1')
+# Под ASGI вход и проверка кода обслуживаются асинхронными представлениями
+os.environ.setdefault('ASYNC_AUTH_VIEWS', '1')
 
 application = get_asgi_application()
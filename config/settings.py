@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os.path
 from dotenv import load_dotenv
@@ -32,6 +33,12 @@ DEBUG = os.getenv('DEBUG') == '1'
 
 ALLOWED_HOSTS = ['*']
 
+# Документация API (/swagger/, /redoc/); при отключённой документации drf_yasg не загружается
+API_DOCS_ENABLED = os.getenv('API_DOCS_ENABLED', '1') == '1'
+
+# Прогрев воркера при старте (включается в config/wsgi.py и config/asgi.py)
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP') == '1'
+
 
 # Application definition
 
@@ -44,13 +51,17 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework.authtoken',
-    'drf_yasg',
 
     'users',
     'authorization_service',
 ]
 
+if API_DOCS_ENABLED:
+    INSTALLED_APPS.append('drf_yasg')
+
 MIDDLEWARE = [
+    'authorization_service.metrics.MetricsMiddleware',
+    'authorization_service.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,9 +104,31 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': os.getenv('POSTGRES_PORT'),
+        # Постоянные соединения: время жизни соединения в секундах (0 — новое соединение на каждый запрос,
+        # None — без ограничения) и проверка соединения перед повторным использованием
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплики для чтения: хосты PostgreSQL через запятую (для SQLite — файлы баз). Реплика получает
+# псевдоним replica1, replica2, ... и те же параметры, что и основная база; в тестах она зеркалит default
+for index, replica in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{index}'] = dict(
+        DATABASES['default'],
+        **({'NAME': replica} if 'sqlite' in (DATABASES['default']['ENGINE'] or '') else {'HOST': replica}),
+        TEST={'MIRROR': 'default'},
+    )
+
+# Безопасные запросы читают с реплик; после записи клиент читает с основной базы STICKY_SECONDS секунд
+# (cookie COOKIE_NAME), чтобы видеть свои изменения, пока реплики догоняют основную базу
+DATABASE_ROUTERS = ['authorization_service.db_router.ReplicaRouter']
+DATABASE_ROUTING = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', '5')),
+    'COOKIE_NAME': 'db_primary',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,6 +175,174 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'authorization_service.authentication.CachedJWTAuthentication',
+    ),
+    # Число доверенных прокси перед приложением: IP-адрес клиента для лимитов берётся из X-Forwarded-For
+    # на этой глубине. При 0 заголовок, который клиент может подделать, не учитывается — только REMOTE_ADDR
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+SIMPLE_JWT = {
+    # Пара токенов содержит номер телефона и признак администратора (нужно для режима stateless)
+    'TOKEN_OBTAIN_SERIALIZER': 'authorization_service.tokens.UserClaimsTokenObtainPairSerializer',
+    # Время жизни access- и refresh-токенов; при обновлении выдаётся новый refresh-токен, а старый отзывается
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv('JWT_ACCESS_TOKEN_LIFETIME_MINUTES', '5'))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_LIFETIME_DAYS', '30'))),
+    'ROTATE_REFRESH_TOKENS': True,
+    'TOKEN_REFRESH_SERIALIZER': 'authorization_service.tokens.RevocationCheckingTokenRefreshSerializer',
+}
+
+# Кэш пользователей JWT-аутентификации: режим cached (кэш в памяти процесса на TIMEOUT секунд,
+# сбрасывается во всех процессах через версию пользователя в кэше Django)
+# или stateless (пользователь строится из полей токена без обращения к базе)
+JWT_USER_CACHE = {
+    'MODE': os.getenv('JWT_USER_CACHE_MODE', 'cached'),
+    'TIMEOUT': int(os.getenv('JWT_USER_CACHE_TTL', '60')),
+    'MAX_ENTRIES': int(os.getenv('JWT_USER_CACHE_MAX_ENTRIES', '10000')),
 }
+
+# Задержка перед проверкой кода верификации, в секундах. От перебора кодов защищают лимиты RATE_LIMITS
+VERIFICATION_DELAY = float(os.getenv('VERIFICATION_DELAY', '0'))
+
+# Лимиты частоты запросов: для каждой области — (число запросов, окно в секундах) по номеру телефона
+# и по IP-адресу. LocMemRateLimitBackend считает запросы в памяти процесса; чтобы лимиты были общими
+# для всех воркеров, укажите RATE_LIMIT_BACKEND=authorization_service.ratelimit.CacheRateLimitBackend
+RATE_LIMITS = {
+    'ENABLED': os.getenv('RATE_LIMIT_ENABLED', '1') == '1',
+    'BACKEND': os.getenv('RATE_LIMIT_BACKEND', 'authorization_service.ratelimit.LocMemRateLimitBackend'),
+    'RULES': {
+        'login': {
+            'phone': (int(os.getenv('RATE_LIMIT_LOGIN_PHONE', '5')), 60),
+            'ip': (int(os.getenv('RATE_LIMIT_LOGIN_IP', '30')), 60),
+        },
+        'verify': {
+            'phone': (int(os.getenv('RATE_LIMIT_VERIFY_PHONE', '10')), 60),
+            'ip': (int(os.getenv('RATE_LIMIT_VERIFY_IP', '60')), 60),
+        },
+    },
+}
+
+# Создавать пользователей без пароля (вход только по коду верификации). При PASSWORDLESS_SIGNUP=0
+# пользователю отправляется пароль, хэш которого вычисляется в пуле из PASSWORD_HASHING_WORKERS потоков
+PASSWORDLESS_SIGNUP = os.getenv('PASSWORDLESS_SIGNUP', '1') == '1'
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', '2'))
+
+# Асинхронные представления входа и проверки кода (включаются при запуске через config/asgi.py)
+ASYNC_AUTH_VIEWS = os.getenv('ASYNC_AUTH_VIEWS') == '1'
+
+# Кэш. LocMemCache — замена для локального запуска; в продакшене, где воркеров несколько,
+# нужен общий кэш (например, CACHE_BACKEND=django.core.cache.backends.redis.RedisCache)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Коды верификации хранятся в отдельном кэше: при вытеснении записей общего кэша (ответы профилей,
+    # число записей) действующие коды не должны пропадать. На каждый ожидающий ввода код приходится две
+    # записи, поэтому VERIFICATION_CODE_CACHE_MAX_ENTRIES должно быть не меньше удвоенного числа входов
+    # за VERIFICATION_CODE_TTL. MAX_ENTRIES действует для LocMemCache; для Redis выделите отдельную базу
+    # (VERIFICATION_CODE_CACHE_LOCATION) с запасом памяти
+    'verification_codes': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('VERIFICATION_CODE_CACHE_LOCATION', os.getenv('CACHE_LOCATION') or 'verification-codes'),
+        **({'OPTIONS': {'MAX_ENTRIES': int(os.getenv('VERIFICATION_CODE_CACHE_MAX_ENTRIES', '200000'))}}
+           if CACHE_BACKEND.endswith('LocMemCache') else {}),
+    },
+    # Отозванные токены: вытесненная запись снова делает отозванный токен действительным, поэтому
+    # CacheTokenRevocationStore принимает только общий для процессов кэш без вытеснения — Redis
+    # (отдельная база TOKEN_REVOCATION_CACHE_LOCATION с maxmemory-policy noeviction)
+    'token_revocation': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('TOKEN_REVOCATION_CACHE_LOCATION', os.getenv('CACHE_LOCATION') or 'token-revocation'),
+    },
+}
+
+# Хранилище кодов верификации: время жизни кода (с) и число попыток ввода. CacheVerificationCodeStore
+# хранит коды в кэше verification_codes (см. CACHES)
+VERIFICATION_CODE_STORE = {
+    'BACKEND': os.getenv('VERIFICATION_CODE_STORE', 'authorization_service.code_store.CacheVerificationCodeStore'),
+    'OPTIONS': {
+        'timeout': int(os.getenv('VERIFICATION_CODE_TTL', '300')),
+        'max_attempts': int(os.getenv('VERIFICATION_CODE_MAX_ATTEMPTS', '5')),
+    },
+}
+
+# Хранилище отозванных токенов (выход, ротация refresh-токенов). При общем кэше — CacheTokenRevocationStore
+# в кэше token_revocation (см. CACHES), при LocMemCache — LocMemTokenRevocationStore в памяти процесса:
+# записи не вытесняются, но отзыв действует только в своём процессе. С кэшем, который не общий для
+# процессов или вытесняет записи, CacheTokenRevocationStore не даёт приложению запуститься
+TOKEN_REVOCATION = {
+    'BACKEND': os.getenv('TOKEN_REVOCATION_STORE', 'authorization_service.revocation.LocMemTokenRevocationStore'
+                         if CACHE_BACKEND.endswith('LocMemCache')
+                         else 'authorization_service.revocation.CacheTokenRevocationStore'),
+}
+
+# Отправка СМС: провайдер, размер очереди, размер пачки и время её набора (с), число повторов
+# и начальная задержка между ними (с). ConsoleSmsProvider выводит сообщения в консоль
+SMS_DISPATCHER = {
+    'PROVIDER': os.getenv('SMS_PROVIDER', 'authorization_service.sms.ConsoleSmsProvider'),
+    'OPTIONS': {
+        'queue_size': int(os.getenv('SMS_QUEUE_SIZE', '10000')),
+        'batch_size': int(os.getenv('SMS_BATCH_SIZE', '100')),
+        'batch_wait': float(os.getenv('SMS_BATCH_WAIT', '0.05')),
+        'max_retries': int(os.getenv('SMS_MAX_RETRIES', '3')),
+        'retry_backoff': float(os.getenv('SMS_RETRY_BACKOFF', '0.5')),
+    },
+}
+
+# Постраничный вывод: время хранения общего числа записей в кэше (с) и размер таблицы PostgreSQL,
+# начиная с которого число записей берётся из статистики планировщика, а не из COUNT(*)
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', '60'))
+PAGINATION_APPROXIMATE_COUNT_THRESHOLD = int(os.getenv('PAGINATION_APPROXIMATE_COUNT_THRESHOLD', '100000'))
+
+# Кэширование ответов чтения профилей (list, retrieve) в кэше Django с ETag; время хранения в секундах
+PROFILE_RESPONSE_CACHE = {
+    'ENABLED': os.getenv('PROFILE_RESPONSE_CACHE_ENABLED', '1') == '1',
+    'TIMEOUT': int(os.getenv('PROFILE_RESPONSE_CACHE_TIMEOUT', '300')),
+}
+
+# Массовая активация реферальных кодов: максимум пар в запросе и размер части, применяемой в одной транзакции
+REFERRAL_BULK_ACTIVATION = {
+    'MAX_ITEMS': int(os.getenv('REFERRAL_BULK_ACTIVATION_MAX_ITEMS', '10000')),
+    'CHUNK_SIZE': int(os.getenv('REFERRAL_BULK_ACTIVATION_CHUNK_SIZE', '500')),
+}
+
+# Реферальное дерево профиля: глубина по умолчанию, максимальная глубина и максимум потомков в ответе
+REFERRAL_TREE = {
+    'DEFAULT_DEPTH': int(os.getenv('REFERRAL_TREE_DEFAULT_DEPTH', '3')),
+    'MAX_DEPTH': int(os.getenv('REFERRAL_TREE_MAX_DEPTH', '10')),
+    'MAX_NODES': int(os.getenv('REFERRAL_TREE_MAX_NODES', '1000')),
+}
+
+# Рейтинг пригласивших: LocMemLeaderboard хранит его в памяти процесса и пересобирает из базы в фоновом
+# потоке раз в 5 минут (при STARTUP_WARMUP); чтобы рейтинг был общим для всех воркеров, укажите
+# LEADERBOARD_BACKEND=authorization_service.leaderboard.CacheLeaderboard и общий кэш (CACHE_BACKEND)
+# и запускайте по расписанию manage.py reconcile_leaderboard
+LEADERBOARD = {
+    'BACKEND': os.getenv('LEADERBOARD_BACKEND', 'authorization_service.leaderboard.LocMemLeaderboard'),
+    'OPTIONS': {'top_size': int(os.getenv('LEADERBOARD_TOP_SIZE', '100'))},
+    'DEFAULT_LIMIT': int(os.getenv('LEADERBOARD_DEFAULT_LIMIT', '10')),
+}
+
+# Метрики запросов: гистограммы по представлениям для GET /metrics/ и заголовок Server-Timing в ответах.
+# Оба раскрывают число запросов к базе, поэтому отдаются только адресам INTERNAL_IPS (адреса и подсети
+# через запятую), а Server-Timing по умолчанию выключен
+METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', '1') == '1',
+    'SERVER_TIMING': os.getenv('METRICS_SERVER_TIMING', '0') == '1',
+    'INTERNAL_IPS': [network.strip() for network in os.getenv('METRICS_INTERNAL_IPS', '127.0.0.1,::1').split(',')
+                     if network.strip()],
+}
+
+# Число строк, читаемых из курсора и отправляемых одной частью при выгрузке профилей
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Хранить в профиле список номеров рефералов, чтобы отдавать его без JOIN
+REFERRAL_CACHE_PHONE_NUMBERS = os.getenv('REFERRAL_CACHE_PHONE_NUMBERS', '1') == '1'
+
+# Ключ перестановки, по которой выдаются реферальные коды. Задаётся явно и не меняется после запуска:
+# он не зависит от SECRET_KEY, чтобы смена секрета не меняла перестановку. Значение по умолчанию
+# публично, и коды с ним предсказуемы по номеру пользователя, поэтому manage.py check --deploy о нём
+# предупреждает
+REFERRAL_CODE_KEY = os.getenv('REFERRAL_CODE_KEY', 'authorization-service-referral-codes')
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Прогрев при загрузке приложения: с gunicorn --preload выполняется один раз до fork
+os.environ.setdefault('STARTUP_WARMUP', '1')
 
 application = get_wsgi_application()
@@ -1,6 +1,16 @@
 import pytest
+from django.conf import settings
+from django.core.cache import caches
 from django.core.management import call_command
 
+from authorization_service.authentication import get_jwt_user_cache
+from authorization_service.code_store import get_verification_code_store
+from authorization_service.leaderboard import get_leaderboard
+from authorization_service.metrics import registry
+from authorization_service.ratelimit import get_rate_limit_backend
+from authorization_service.revocation import get_token_revocation_store
+from authorization_service.sms import get_sms_dispatcher
+
 
 @pytest.fixture(autouse=True, scope="session")
 def prepare_test_database(django_db_blocker):
@@ -10,3 +20,24 @@ def prepare_test_database(django_db_blocker):
 @pytest.fixture(scope='session', autouse=True)
 def enable_db_access_for_session_fixture(django_db_setup, django_db_blocker):
     pass  # Пустая фикстура для разрешения доступа к базе данных во время сессии
+
+
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_in_memory_state():
+    """ Сброс кэшей и внутрипроцессных хранилищ между тестами """
+    clear_caches()
+    get_verification_code_store.cache_clear()
+    get_jwt_user_cache.cache_clear()
+    get_sms_dispatcher.cache_clear()
+    get_rate_limit_backend.cache_clear()
+    get_leaderboard.cache_clear()
+    registry.clear()
+    get_token_revocation_store.cache_clear()
+    yield
+    get_sms_dispatcher().close()
+    clear_caches()
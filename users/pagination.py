@@ -1,9 +1,9 @@
 """ Пагинаторы приложения users """
-from rest_framework.pagination import PageNumberPagination
+from authorization_service.pagination import CursorOrPageNumberPagination
 
 
-class UserPagination(PageNumberPagination):
-    """ Пагинатор для вывода пользователей """
+class UserPagination(CursorOrPageNumberPagination):
+    """ Пагинатор для вывода пользователей: по номеру страницы или по курсору (?cursor=, ?pagination=cursor) """
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 50